@@ -0,0 +1,92 @@
+''' Context backends, where the vehicle context live
+    manager: Context object served by VehicleManager (default)
+    shm: shared memory store, single machine only, no server process
+    redis: Redis protocol client, work with redis-server or RespServer
+'''
+from autorc.context import Context, serve_context
+
+
+__version__ = '0.1'
+
+
+__all__ = (
+    'ContextBackend',
+    'ManagerBackend',
+    'SharedMemoryBackend',
+    'RedisBackend',
+    'get_backend',
+)
+
+
+class ContextBackend(object):
+    ''' Create and own the vehicle context
+        start return a ContextClient (get, update, snapshot, wait, version,
+        timestamp), it is passed to every node process so it must be
+        picklable. local_context is the one used by nodes running as
+        threads of the vehicle process.
+        remote: context can be handed to nodes of other machines
+        (RemoteVehicle) through the vehicle manager
+    '''
+    context = None
+    local_context = None
+    remote = True
+
+    def start(self, vehicle, local=False):
+        raise NotImplementedError()
+
+    def shutdown(self):
+        pass
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+
+class ManagerBackend(ContextBackend):
+    ''' Context live in the VehicleManager server process
+        local: Context live in vehicle process instead so in-process nodes
+        access it directly, node processes connect to a server thread. It
+        listen on vehicle address (free port) when remote vehicles are
+        allowed, a unix socket otherwise
+    '''
+    server = None
+
+    def start(self, vehicle, local=False):
+        if local:
+            self.local_context = Context(vehicle_name=vehicle.name)
+            address = None
+            if vehicle.allow_remote:
+                address = (vehicle.address, 0)
+            self.server, self.context = serve_context(
+                self.local_context, address, vehicle.authkey)
+        else:
+            self.context = vehicle.manager.Context(vehicle_name=vehicle.name)
+            self.local_context = self.context
+        return self.context
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.stop_event.set()
+            self.server = None
+        # Forked processes reconnect every live proxy, drop ours
+        self.context = self.local_context = None
+
+
+from .shm import SharedMemoryBackend    # noqa: E402
+from .resp import RedisBackend          # noqa: E402
+
+
+BACKENDS = {
+    'manager': ManagerBackend,
+    'shm': SharedMemoryBackend,
+    'redis': RedisBackend,
+}
+
+
+def get_backend(backend, **kwargs):
+    ''' Backend instance from its name, instance are returned as is '''
+    if isinstance(backend, ContextBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise Exception('Unknown context backend %s, available: %s' % (
+            backend, ', '.join(BACKENDS)))
+    return BACKENDS[backend](**kwargs)
@@ -0,0 +1,518 @@
+''' Redis protocol (RESP) context backend
+    RedisContext talk to redis-server (or any RESP compatible server) with
+    plain sockets, no client library needed. RespServer is a tiny stand-in
+    server supporting only the commands used here, good for tests or a car
+    without redis installed.
+
+    Keys are stored under a prefix, values are encoded by codec (pickle by
+    default, see autorc.codec). Every update increase prefix:__version__,
+    record key versions in hash prefix:__versions__ and publish
+    "version key..." to prefix:__changes__ so waiting nodes wake up. An
+    update is a MULTI / EXEC transaction watching prefix:__version__, it is
+    retried if another writer got in between so versions never go back.
+'''
+import fnmatch
+import os
+import select
+import socket
+import socketserver
+import threading
+import time
+
+from autorc.backends import ContextBackend
+from autorc.codec import get_codec
+from autorc.context import ContextClient
+
+
+class RespError(Exception):
+    pass
+
+
+def encode_command(*args):
+    ''' Command to RESP array of bulk strings '''
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif isinstance(arg, int):
+            arg = b'%d' % arg
+        out.append(b'$%d\r\n' % len(arg))
+        out.append(arg)
+        out.append(b'\r\n')
+    return b''.join(out)
+
+
+def read_reply(stream):
+    ''' Read one RESP reply from a buffered binary stream '''
+    line = stream.readline()
+    if not line:
+        raise ConnectionError('Connection closed')
+    kind, data = line[:1], line[1:-2]
+    if kind == b'+':
+        return data
+    if kind == b'-':
+        return RespError(data.decode('utf-8'))
+    if kind == b':':
+        return int(data)
+    if kind == b'$':
+        length = int(data)
+        if length < 0:
+            return None
+        value = stream.read(length + 2)
+        return value[:-2]
+    if kind == b'*':
+        length = int(data)
+        if length < 0:
+            return None
+        return [read_reply(stream) for i in range(length)]
+    raise RespError('Unknown reply %r' % line)
+
+
+class SocketStream(object):
+    ''' Buffered socket reader which can tell if a reply is pending '''
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def _fill(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError('Connection closed')
+        self.buffer += data
+
+    def readline(self):
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                return self.read(end + 1)
+            self._fill()
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readable(self, timeout=None):
+        ''' Wait until there is something to read '''
+        if self.buffer:
+            return True
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def close(self):
+        self.buffer = bytearray()
+
+
+class RespConnection(object):
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = SocketStream(self.sock)
+
+    def execute(self, *commands):
+        ''' Send commands in one write (pipeline), return their replies '''
+        self.sock.sendall(b''.join(
+            encode_command(*command) for command in commands))
+        replies = [read_reply(self.stream) for command in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+class RedisContext(ContextClient):
+    ''' Context stored in a redis (protocol) server
+        Connection is per thread, object can be pickled to node processes
+    '''
+    def __init__(self, host='127.0.0.1', port=6379, prefix='autorc:',
+                 codec='pickle'):
+        self.host = host
+        self.codec = get_codec(codec)
+        self.port = port
+        self.prefix = prefix
+        self.version_key = prefix + '__version__'
+        self.versions_key = prefix + '__versions__'
+        self.channel = prefix + '__changes__'
+        self.local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def _get_local(self):
+        ''' Thread local connections, reset in forked process '''
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.connection = None
+            self.local.subscriber = None
+        return self.local
+
+    @property
+    def connection(self):
+        local = self._get_local()
+        if local.connection is None:
+            local.connection = RespConnection(self.host, self.port)
+        return local.connection
+
+    def encode(self, value):
+        return self.codec.encode(value)
+
+    def decode(self, data):
+        return self.codec.decode(data)
+
+    def get(self, key, default=None):
+        value = self.connection.execute(('GET', self.prefix + key))[0]
+        if value is None:
+            return default
+        return self.decode(value)
+
+    def _write(self, data, delete=False):
+        if not data:
+            return
+        connection = self.connection
+        if delete:
+            command = ['DEL'] + [self.prefix + key for key in data]
+        else:
+            command = ['MSET']
+            for key, value in data.items():
+                command.extend((self.prefix + key, self.encode(value)))
+        while True:
+            version = int(connection.execute(
+                ('WATCH', self.version_key),
+                ('GET', self.version_key))[1] or 0) + 1
+            versions = ['HSET', self.versions_key]
+            for key in data:
+                versions.extend((key, version))
+            replies = connection.execute(
+                ('MULTI', ), ('SET', self.version_key, version), command,
+                versions, ('PUBLISH', self.channel, '\n'.join(
+                    ['%d' % version] + list(data))), ('EXEC', ))
+            if replies[-1] is not None:     # None: version changed, retry
+                return
+
+    def update(self, *args, **kwargs):
+        self._write(dict(*args, **kwargs))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._write({key: None}, delete=True)
+
+    def __contains__(self, key):
+        return self.connection.execute(('EXISTS', self.prefix + key))[0] > 0
+
+    def keys(self):
+        keys = self.connection.execute(('KEYS', self.prefix + '*'))[0]
+        internal = (self.version_key, self.versions_key)
+        return [key.decode('utf-8')[len(self.prefix):] for key in keys
+                if key.decode('utf-8') not in internal]
+
+    def version(self, key=None):
+        if key is None:
+            version = self.connection.execute(('GET', self.version_key))[0]
+        else:
+            version = self.connection.execute(
+                ('HGET', self.versions_key, key))[0]
+        return int(version or 0)
+
+    def snapshot(self, keys, since=None, extra=()):
+        replies, versions = self.connection.execute(
+            ['MGET'] + [self.prefix + key for key in keys] +
+            [self.prefix + key for key in extra],
+            ['HMGET', self.versions_key] + list(keys))
+        versions = [int(version or 0) for version in versions]
+        if since is not None:
+            for value, version, last in zip(replies, versions, since):
+                if value is None or last >= version:
+                    return None
+        return [None if value is None else self.decode(value)
+                for value in replies], versions
+
+    def changed_since(self, since, keys=None):
+        if keys is None:
+            fields = self.connection.execute(
+                ('HGETALL', self.versions_key))[0]
+            versions = dict(zip((key.decode('utf-8')
+                                 for key in fields[0::2]), fields[1::2]))
+            keys = list(versions)
+            exists = self.connection.execute(
+                ['MGET'] + [self.prefix + key for key in keys])[0] \
+                if keys else []
+        else:
+            keys = list(keys)
+            if not keys:
+                return {}
+            exists, values = self.connection.execute(
+                ['MGET'] + [self.prefix + key for key in keys],
+                ['HMGET', self.versions_key] + keys)
+            versions = dict(zip(keys, values))
+        changed = {}
+        for key, value in zip(keys, exists):
+            version = int(versions[key] or 0)
+            if value is not None and version > since:
+                changed[key] = version
+        return changed
+
+    @property
+    def subscriber(self):
+        ''' Dedicated connection subscribed to change channel '''
+        local = self._get_local()
+        if local.subscriber is None:
+            local.subscriber = RespConnection(self.host, self.port)
+            local.subscriber.execute(('SUBSCRIBE', self.channel))
+        return local.subscriber
+
+    def wait(self, keys, since, timeout=None):
+        subscriber = self.subscriber
+        # Changes before subscription (or first wait) are not published
+        versions = self.connection.execute(
+            ['HMGET', self.versions_key] + list(keys))[0]
+        if any(int(version or 0) > since for version in versions):
+            return self.version()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            if not subscriber.stream.readable(remaining):
+                return self.version()
+            message = read_reply(subscriber.stream)
+            if not isinstance(message, list) or message[0] != b'message':
+                continue
+            version, *changed = message[2].decode('utf-8').split('\n')
+            if int(version) > since and set(changed).intersection(keys):
+                return int(version)
+
+    def close(self):
+        local = self._get_local()
+        for name in ('connection', 'subscriber'):
+            connection = getattr(local, name)
+            if connection is not None:
+                connection.close()
+                setattr(local, name, None)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    ''' Serve one client connection of RespServer '''
+    transaction = None      # Commands queued since MULTI
+    watched = None          # {key: value when WATCH was called}
+
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.watched = {}
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                break
+            if not isinstance(command, list) or not command:
+                self.reply(RespError('ERR invalid command'))
+                continue
+            name = command[0].decode('utf-8').upper()
+            method = getattr(self, 'cmd_' + name.lower(), None)
+            if method is None:
+                self.reply(RespError('ERR unknown command %s' % name))
+                continue
+            if self.transaction is not None and name not in (
+                    'EXEC', 'DISCARD', 'MULTI', 'WATCH'):
+                self.transaction.append((method, command[1:]))
+                self.reply('QUEUED')
+                continue
+            with self.server.lock:
+                reply = method(*command[1:])
+            self.reply(reply)
+
+    def reply(self, value):
+        self.wfile.write(self.server.encode_reply(value))
+
+    def cmd_ping(self, *args):
+        return 'PONG'
+
+    def cmd_get(self, key):
+        return self.server.data.get(key)
+
+    def cmd_set(self, key, value):
+        self.server.data[key] = value
+        return 'OK'
+
+    def cmd_mget(self, *keys):
+        return [self.server.data.get(key) for key in keys]
+
+    def cmd_mset(self, *args):
+        self.server.data.update(zip(args[0::2], args[1::2]))
+        return 'OK'
+
+    def cmd_del(self, *keys):
+        return sum(self.server.data.pop(key, None) is not None
+                   for key in keys)
+
+    def cmd_exists(self, *keys):
+        return sum(key in self.server.data for key in keys)
+
+    def cmd_keys(self, pattern):
+        pattern = pattern.decode('utf-8')
+        return [key for key in self.server.data
+                if fnmatch.fnmatchcase(key.decode('utf-8'), pattern)]
+
+    def cmd_incr(self, key):
+        value = int(self.server.data.get(key, 0)) + 1
+        self.server.data[key] = b'%d' % value
+        return value
+
+    def cmd_hset(self, key, *args):
+        fields = self.server.data.setdefault(key, {})
+        fields.update(zip(args[0::2], args[1::2]))
+        return len(args) // 2
+
+    def cmd_hget(self, key, field):
+        return self.server.data.get(key, {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        values = self.server.data.get(key, {})
+        return [values.get(field) for field in fields]
+
+    def cmd_hgetall(self, key):
+        fields = []
+        for field, value in self.server.data.get(key, {}).items():
+            fields.extend((field, value))
+        return fields
+
+    def cmd_watch(self, *keys):
+        for key in keys:
+            value = self.server.data.get(key)
+            self.watched[key] = dict(value) if isinstance(value, dict) \
+                else value
+        return 'OK'
+
+    def cmd_unwatch(self):
+        self.watched = {}
+        return 'OK'
+
+    def cmd_multi(self):
+        if self.transaction is not None:
+            return RespError('ERR MULTI calls can not be nested')
+        self.transaction = []
+        return 'OK'
+
+    def cmd_discard(self):
+        if self.transaction is None:
+            return RespError('ERR DISCARD without MULTI')
+        self.transaction = None
+        self.watched = {}
+        return 'OK'
+
+    def cmd_exec(self):
+        ''' Run queued commands, None if a watched key changed '''
+        if self.transaction is None:
+            return RespError('ERR EXEC without MULTI')
+        commands, self.transaction = self.transaction, None
+        watched, self.watched = self.watched, {}
+        if any(self.server.data.get(key) != value
+               for key, value in watched.items()):
+            return None
+        return [method(*args) for method, args in commands]
+
+    def cmd_flushdb(self):
+        self.server.data.clear()
+        return 'OK'
+
+    def cmd_publish(self, channel, message):
+        subscribers = self.server.channels.get(channel, ())
+        data = self.server.encode_reply([b'message', channel, message])
+        for wfile in list(subscribers):
+            try:
+                wfile.write(data)
+            except OSError:
+                subscribers.discard(wfile)
+        return len(subscribers)
+
+    def cmd_subscribe(self, *channels):
+        for i, channel in enumerate(channels):
+            self.server.channels.setdefault(channel, set()).add(self.wfile)
+        return [b'subscribe', channels[-1], len(channels)]
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    ''' Minimal in memory redis stand-in, one thread per client '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=6379):
+        super(RespServer, self).__init__((host, port), RespHandler)
+        self.data = {}
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def encode_reply(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, RespError):
+            return b'-%s\r\n' % str(value).encode('utf-8')
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode('utf-8')
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, bytes):
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        return b'*%d\r\n' % len(value) + b''.join(
+            self.encode_reply(item) for item in value)
+
+    def start(self):
+        ''' Serve in a background thread '''
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class RedisBackend(ContextBackend):
+    ''' Context in a redis server
+        serve: start a RespServer in vehicle process instead of connecting
+        to an existing redis-server
+        codec: value encoding, pickle or compact (see autorc.codec)
+    '''
+    def __init__(self, host='127.0.0.1', port=6379, prefix='autorc:',
+                 serve=False, codec='pickle'):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.serve = serve
+        self.codec = codec
+        self.server = None
+        self.context = None
+
+    def start(self, vehicle, local=False):
+        if self.serve:
+            self.server = RespServer(self.host, self.port).start()
+            self.port = self.server.port
+        self.context = RedisContext(self.host, self.port, self.prefix,
+                                    self.codec)
+        self.context.update(vehicle_name=vehicle.name)
+        self.local_context = self.context
+        return self.context
+
+    def shutdown(self):
+        if self.context is not None:
+            self.context.close()
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
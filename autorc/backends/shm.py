@@ -0,0 +1,275 @@
+''' Shared memory context store for single machine runs
+    Keys live in a fixed size open addressing table inside one shared memory
+    block, no server process and no socket round trip. Writers are
+    serialized by a multiprocessing Condition which also wake up waiting
+    readers, readers are lock free (seqlock per slot).
+
+    Memory layout:
+        header: magic, capacity, value size, global version, seq
+        slot:   seq, version, key length, value length, key, value
+    seq is odd while a slot is being written, header seq is odd while an
+    update (several slots) is being written so snapshots are atomic.
+'''
+import multiprocessing
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+
+from autorc.backends import ContextBackend
+from autorc.codec import get_codec
+from autorc.context import ContextClient, _MISSING
+from autorc.framebuffer import attach_shared_memory
+
+
+class SharedMemoryContext(ContextClient):
+    MAGIC = b'NCCX'
+    # magic, capacity, value_size, version, seq
+    HEADER = struct.Struct('<4sIIQQ')
+    SLOT_HEADER = struct.Struct('<QQHI')    # seq, version, key_len, value_len
+    KEY_SIZE = 64
+    ALIGN = 64
+    DELETED = 0xFFFFFFFF
+    in_memory = True
+
+    def __init__(self, name, capacity, value_size, condition,
+                 shm=None, owner=False, codec='pickle'):
+        self.name = name
+        self.codec = get_codec(codec)
+        self.capacity = capacity
+        self.value_size = value_size
+        self.condition = condition
+        self.shm = shm
+        self.owner = owner
+        self.header_size = self._align(self.HEADER.size)
+        self.stride = self._align(
+            self.SLOT_HEADER.size + self.KEY_SIZE + value_size)
+
+    @classmethod
+    def _align(cls, size):
+        return (size + cls.ALIGN - 1) // cls.ALIGN * cls.ALIGN
+
+    @classmethod
+    def create(cls, capacity=256, value_size=4096, codec='pickle'):
+        ''' Allocate a new store, caller own (and unlink) the memory '''
+        stride = cls._align(cls.SLOT_HEADER.size + cls.KEY_SIZE + value_size)
+        shm = shared_memory.SharedMemory(
+            create=True, size=cls._align(cls.HEADER.size) + stride * capacity)
+        cls.HEADER.pack_into(shm.buf, 0, cls.MAGIC, capacity, value_size, 0,
+                             0)
+        return cls(shm.name, capacity, value_size,
+                   multiprocessing.Condition(), shm=shm, owner=True,
+                   codec=codec)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shm'] = None
+        state['owner'] = False
+        return state
+
+    @property
+    def buf(self):
+        if self.shm is None:
+            self.shm = attach_shared_memory(self.name)
+        return self.shm.buf
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+
+    def encode(self, value):
+        return self.codec.encode(value)
+
+    def decode(self, data):
+        return self.codec.decode(data)
+
+    def _slot_offset(self, index):
+        return self.header_size + self.stride * index
+
+    def _read_slot(self, index):
+        ''' Consistent (version, key, value bytes) of a slot
+            key is None for an empty slot, value is None if deleted
+        '''
+        buf = self.buf
+        offset = self._slot_offset(index)
+        start = offset + self.SLOT_HEADER.size
+        while True:
+            seq, version, key_len, value_len = self.SLOT_HEADER.unpack_from(
+                buf, offset)
+            if seq & 1:
+                time.sleep(0)   # Writer is busy with this slot
+                continue
+            key = bytes(buf[start:start + key_len]) if key_len else None
+            value = None
+            if key is not None and value_len != self.DELETED:
+                value_start = start + self.KEY_SIZE
+                value = bytes(buf[value_start:value_start + value_len])
+            if self.SLOT_HEADER.unpack_from(buf, offset)[0] == seq:
+                return version, key, value
+
+    def _find(self, key):
+        ''' Slot index of key or first empty slot of its probe sequence '''
+        bkey = key.encode('utf-8')
+        start = zlib.crc32(bkey) % self.capacity
+        for i in range(self.capacity):
+            index = (start + i) % self.capacity
+            version, slot_key, value = self._read_slot(index)
+            if slot_key is None or slot_key == bkey:
+                return index, bkey, version, slot_key, value
+        return None, bkey, 0, None, None
+
+    def _write_slot(self, index, bkey, version, value):
+        ''' Must be called while holding condition '''
+        buf = self.buf
+        offset = self._slot_offset(index)
+        seq = self.SLOT_HEADER.unpack_from(buf, offset)[0]
+        if value is None:
+            value_len = self.DELETED
+        else:
+            value_len = len(value)
+        self.SLOT_HEADER.pack_into(buf, offset, seq + 1, version,
+                                   len(bkey), value_len)
+        start = offset + self.SLOT_HEADER.size
+        buf[start:start + len(bkey)] = bkey
+        if value is not None:
+            buf[start + self.KEY_SIZE:start + self.KEY_SIZE + len(value)] = \
+                value
+        self.SLOT_HEADER.pack_into(buf, offset, seq + 2, version,
+                                   len(bkey), value_len)
+
+    def _write(self, data):
+        encoded = {}
+        for key, value in data.items():
+            if value is not _MISSING:
+                value = self.encode(value)
+                if len(value) > self.value_size:
+                    raise ValueError(
+                        '%s is too large (%d bytes) for shared memory '
+                        'context, value_size is %d' % (
+                            key, len(value), self.value_size))
+            if len(key.encode('utf-8')) > self.KEY_SIZE:
+                raise ValueError('Key %s is too long' % key)
+            encoded[key] = value
+        with self.condition:
+            version = self.version() + 1
+            seq = self._seq()
+            self._write_header(version - 1, seq + 1)    # Mark as writing
+            try:
+                for key, value in encoded.items():
+                    index, bkey, old_version, slot_key, old_value = \
+                        self._find(key)
+                    if index is None:
+                        raise Exception('Shared memory context is full')
+                    if value is _MISSING:
+                        if slot_key is None or old_value is None:
+                            continue
+                        value = None
+                    self._write_slot(index, bkey, version, value)
+            finally:
+                self._write_header(version, seq + 2)
+                self.condition.notify_all()
+
+    def _write_header(self, version, seq):
+        ''' Must be called while holding condition '''
+        self.HEADER.pack_into(self.buf, 0, self.MAGIC, self.capacity,
+                              self.value_size, version, seq)
+
+    def _seq(self):
+        return self.HEADER.unpack_from(self.buf, 0)[4]
+
+    def get(self, key, default=None):
+        index, bkey, version, slot_key, value = self._find(key)
+        if value is None:
+            return default
+        return self.decode(value)
+
+    def update(self, *args, **kwargs):
+        self._write(dict(*args, **kwargs))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._write({key: _MISSING})
+
+    def keys(self):
+        keys = []
+        for index in range(self.capacity):
+            version, key, value = self._read_slot(index)
+            if key is not None and value is not None:
+                keys.append(key.decode('utf-8'))
+        return keys
+
+    def version(self, key=None):
+        if key is None:
+            return self.HEADER.unpack_from(self.buf, 0)[3]
+        return self._find(key)[2]
+
+    def snapshot(self, keys, since=None, extra=()):
+        # Retry until no update was in progress or happened while reading
+        while True:
+            seq = self._seq()
+            if seq & 1:
+                time.sleep(0)   # Writer is busy
+                continue
+            slots = [self._find(key) for key in keys]
+            extra_values = [self.get(key) for key in extra]
+            if self._seq() == seq:
+                break
+        versions = [slot[2] for slot in slots]
+        if since is not None:
+            for slot, last in zip(slots, since):
+                if slot[4] is None or last >= slot[2]:
+                    return None
+        return [None if slot[4] is None else self.decode(slot[4])
+                for slot in slots] + extra_values, versions
+
+    def changed_since(self, since, keys=None):
+        changed = {}
+        if keys is None:
+            for index in range(self.capacity):
+                version, key, value = self._read_slot(index)
+                if key is not None and value is not None and version > since:
+                    changed[key.decode('utf-8')] = version
+            return changed
+        for key in keys:
+            index, bkey, version, slot_key, value = self._find(key)
+            if value is not None and version > since:
+                changed[key] = version
+        return changed
+
+    def wait(self, keys, since, timeout=None):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: any(self.version(key) > since for key in keys),
+                timeout)
+            return self.version()
+
+
+class SharedMemoryBackend(ContextBackend):
+    ''' Context in shared memory, nodes must run on this machine
+        capacity: max number of keys (timestamp keys included)
+        value_size: max encoded value size, share frames with FrameRef
+        codec: value encoding, pickle or compact (see autorc.codec)
+    '''
+    remote = False
+
+    def __init__(self, capacity=256, value_size=4096, codec='pickle'):
+        self.capacity = capacity
+        self.value_size = value_size
+        self.codec = codec
+        self.context = None
+
+    def start(self, vehicle, local=False):
+        self.context = SharedMemoryContext.create(
+            self.capacity, self.value_size, self.codec)
+        self.context.update(vehicle_name=vehicle.name)
+        self.local_context = self.context
+        return self.context
+
+    def shutdown(self):
+        if self.context is not None:
+            self.context.close()
+            self.context = None
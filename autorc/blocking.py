@@ -0,0 +1,105 @@
+''' Run blocking callbacks of async nodes off the event loop
+    Disk writes, CPU heavy processing... stall every coroutine of the node
+    while they run. Mark such callback (a plain def, not async) with
+    @blocking, or a whole node with AsyncNode(blocking=True), and
+    async_loop hand it to a thread pool instead of awaiting it:
+        workers: calls running at once
+        max_pending: calls waiting for a worker, when full a new call drop
+            the oldest waiting one (its inputs are stale anyway). None for
+            no limit, nothing is dropped.
+    Outputs are published when the call is done. Sync Node already run in
+    their own process or thread, the marker is ignored there.
+'''
+import asyncio
+import collections
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+__all__ = (
+    'blocking',
+    'BlockingRunner',
+)
+
+
+def blocking(callback=None, *, workers=1, max_pending=1):
+    ''' Mark a node callback as blocking, usable with or without options
+            @blocking
+            def write(self, image): ...
+            @blocking(max_pending=4)
+            def process_loop(self, image): ...
+    '''
+    def decorate(func):
+        func.blocking = {'workers': workers, 'max_pending': max_pending}
+        return func
+    if callback is not None:
+        return decorate(callback)
+    return decorate
+
+
+class BlockingRunner(object):
+    ''' Bounded thread pool of a blocking callback
+        submit() never wait, it return a future of (return value, start
+        time) or None if the pool is shut down.
+    '''
+    def __init__(self, name, workers=1, max_pending=1):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(
+            workers, thread_name_prefix='blocking-%s' % name)
+        self.in_flight = collections.deque()
+        self.calls = 0
+        self.dropped = 0
+
+    @staticmethod
+    def timed(func, args):
+        start_time = time.time()
+        return func(*args), start_time
+
+    def submit(self, func, args):
+        while self.in_flight and self.in_flight[0].done():
+            self.in_flight.popleft()
+        if self.max_pending is not None:
+            waiting = [future for future in self.in_flight
+                       if not future.running() and not future.done()]
+            for future in waiting[:len(waiting) - self.max_pending + 1]:
+                # Drop oldest calls not started yet
+                if future.cancel():
+                    self.dropped += 1
+        self.calls += 1
+        future = self.executor.submit(self.timed, func, args)
+        self.in_flight.append(future)
+        return future
+
+    async def drain(self):
+        ''' Wait for calls in flight, then stop the pool '''
+        futures = [asyncio.wrap_future(future) for future in self.in_flight
+                   if not future.done()]
+        if futures:
+            await asyncio.wait(futures)
+        self.in_flight.clear()
+        self.executor.shutdown(wait=False)
+
+
+def make_runner(node, callback, default=None):
+    ''' BlockingRunner of a node callback, None if it is not blocking
+        default: options of node marked blocking, apply to plain def
+    '''
+    options = getattr(callback, 'blocking', None)
+    if options is None:
+        if not default or asyncio.iscoroutinefunction(callback):
+            return None
+        options = default if isinstance(default, dict) else {}
+    return BlockingRunner('%s.%s' % (node, callback.__name__), **options)
+
+
+def done_callback(loop, handler, *args):
+    ''' Future done callback calling handler(*args, future) in loop thread '''
+    def done(future):
+        try:
+            loop.call_soon_threadsafe(functools.partial(
+                handler, *args, future))
+        except RuntimeError:    # Loop closed, node is gone
+            pass
+    return done
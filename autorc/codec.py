@@ -0,0 +1,156 @@
+''' Value codecs of context backends storing bytes (shm, redis)
+    pickle: any picklable value, ~15 bytes of framing around small values
+    compact: one tag byte then
+        None, bool: nothing more
+        int, float: 8 bytes
+        str, bytes: raw utf-8 / bytes
+        tuple, list of int / float / bool: count, struct format, values
+        numpy array: dtype, shape then raw buffer, decoded without copy
+            (read only view of the encoded bytes)
+        anything else: pickle
+    Decoded arrays are read only, copy them before modifying in place.
+'''
+import pickle
+import struct
+
+import numpy as np
+
+
+__all__ = (
+    'PickleCodec',
+    'CompactCodec',
+    'get_codec',
+)
+
+
+class PickleCodec(object):
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+    def __repr__(self):
+        return self.__class__.__name__
+
+
+class CompactCodec(PickleCodec):
+    INT = struct.Struct('<q')
+    FLOAT = struct.Struct('<d')
+    ARRAY_HEADER = struct.Struct('<BB')     # dtype length, ndim
+    # Struct format of tuple items by type
+    ITEM_FORMATS = {bool: '?', int: 'q', float: 'd'}
+    MAX_ITEMS = 255
+    MAX_CACHED = 256    # Tuple layouts kept with their Struct
+
+    def __init__(self):
+        self.packers = {}       # item types: (header, Struct)
+        self.unpackers = {}     # format: Struct
+        self.decoders = {
+            ord('N'): lambda data: None,
+            ord('T'): lambda data: True,
+            ord('F'): lambda data: False,
+            ord('i'): lambda data: self.INT.unpack_from(data, 1)[0],
+            ord('f'): lambda data: self.FLOAT.unpack_from(data, 1)[0],
+            ord('s'): lambda data: data[1:].decode('utf-8'),
+            ord('b'): lambda data: data[1:],
+            ord('t'): self.decode_items,
+            ord('l'): lambda data: list(self.decode_items(data)),
+            ord('a'): self.decode_array,
+        }
+
+    def __getstate__(self):
+        return {}   # Caches and decoders are rebuilt
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def encode(self, value):
+        kind = type(value)
+        if kind is float:
+            return b'f' + self.FLOAT.pack(value)
+        if value is None:
+            return b'N'
+        if kind is bool:
+            return b'T' if value else b'F'
+        if kind is int and -2 ** 63 <= value < 2 ** 63:
+            return b'i' + self.INT.pack(value)
+        if kind is str:
+            return b's' + value.encode('utf-8')
+        if kind is bytes:
+            return b'b' + value
+        if kind is tuple or kind is list:
+            data = self.encode_items(value)
+            if data is not None:
+                return (b't' if kind is tuple else b'l') + data
+        if kind is np.ndarray and not value.dtype.hasobject:
+            return self.encode_array(value)
+        return b'p' + super(CompactCodec, self).encode(value)
+
+    def encode_items(self, items):
+        ''' count, format, packed values or None if items can't be packed '''
+        kinds = tuple(map(type, items))
+        packer = self.packers.get(kinds)
+        if packer is None:
+            if len(items) > self.MAX_ITEMS:
+                return None
+            try:
+                fmt = ''.join(self.ITEM_FORMATS[kind] for kind in kinds)
+            except KeyError:
+                return None
+            packer = (bytes((len(items), )) + fmt.encode('ascii'),
+                      struct.Struct('<' + fmt))
+            if len(self.packers) < self.MAX_CACHED:
+                self.packers[kinds] = packer
+        try:
+            return packer[0] + packer[1].pack(*items)
+        except struct.error:    # int out of range
+            return None
+
+    def encode_array(self, array):
+        dtype = array.dtype.str.encode('ascii')
+        return b''.join((
+            b'a', self.ARRAY_HEADER.pack(len(dtype), array.ndim), dtype,
+            struct.pack('<%dI' % array.ndim, *array.shape),
+            np.ascontiguousarray(array).data))
+
+    def decode(self, data):
+        decoder = self.decoders.get(data[0])
+        if decoder is None:
+            return super(CompactCodec, self).decode(data[1:])
+        return decoder(data)
+
+    def decode_items(self, data):
+        count = data[1]
+        fmt = data[2:2 + count]
+        unpacker = self.unpackers.get(fmt)
+        if unpacker is None:
+            unpacker = struct.Struct('<' + fmt.decode('ascii'))
+            if len(self.unpackers) < self.MAX_CACHED:
+                self.unpackers[fmt] = unpacker
+        return unpacker.unpack_from(data, 2 + count)
+
+    def decode_array(self, data):
+        dtype_len, ndim = self.ARRAY_HEADER.unpack_from(data, 1)
+        offset = 1 + self.ARRAY_HEADER.size
+        dtype = np.dtype(data[offset:offset + dtype_len].decode('ascii'))
+        offset += dtype_len
+        shape = struct.unpack_from('<%dI' % ndim, data, offset)
+        offset += 4 * ndim
+        return np.frombuffer(data, dtype, offset=offset).reshape(shape)
+
+
+CODECS = {
+    'pickle': PickleCodec,
+    'compact': CompactCodec,
+}
+
+
+def get_codec(codec):
+    ''' Codec instance from its name, instance are returned as is '''
+    if not isinstance(codec, str):
+        return codec
+    if codec not in CODECS:
+        raise Exception('Unknown codec %s, available: %s' % (
+            codec, ', '.join(CODECS)))
+    return CODECS[codec]()
@@ -0,0 +1,590 @@
+''' Vehicle context, key / value store shared by all nodes
+    Context live in the manager server process, nodes talk to it through
+    ContextProxy. Beside normal dict methods context keep a version for
+    every key so a node can sleep until one of its inputs changed.
+'''
+import asyncio
+import functools
+import os
+import pickle
+import socket
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import current_process
+from multiprocessing.connection import Client
+from multiprocessing.managers import (
+    BaseManager, BaseProxy, convert_to_error, dispatch)
+from multiprocessing.reduction import ForkingPickler
+
+
+TIMESTAMP_SUFFIX = '__timestamp'
+TRACE_SUFFIX = '__trace'
+# Capture time of the camera frame a value derive from, traced or not
+CAPTURE_SUFFIX = '__capture'
+# Written with a value, queued along with it
+SIDECAR_SUFFIXES = (TIMESTAMP_SUFFIX, TRACE_SUFFIX, CAPTURE_SUFFIX)
+# Written by the vehicle on shutdown, wake up nodes waiting for inputs
+STOP_KEY = 'vehicle/stop'
+_MISSING = object()
+# Input delivery: latest value only, bounded queue (drop oldest), no drop
+DELIVERY_POLICIES = ('latest', 'queue', 'lossless')
+
+
+class ContextClient(object):
+    ''' Dict like interface every context implementation provide
+        Subclass implement get, update, keys, snapshot, changed_since, wait,
+        version and __delitem__, remaining dict methods are built on top of
+        them. Versions are integers incremented by the store on every write,
+        change detection never compare clocks of different processes.
+        Queue capable contexts also implement subscribe, unsubscribe and
+        drain (queue and lossless input delivery).
+    '''
+    in_memory = False   # True when calls do no I/O (same process, shm)
+
+    def get(self, key, default=None):
+        raise NotImplementedError()
+
+    def update(self, *args, **kwargs):
+        raise NotImplementedError()
+
+    def keys(self):
+        raise NotImplementedError()
+
+    def snapshot(self, keys, since=None, extra=()):
+        raise NotImplementedError()
+
+    def changed_since(self, since, keys=None):
+        raise NotImplementedError()
+
+    def wait(self, keys, since, timeout=None):
+        raise NotImplementedError()
+
+    def version(self, key=None):
+        raise NotImplementedError()
+
+    def __delitem__(self, key):
+        raise NotImplementedError()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def items(self):
+        items = []
+        for key in self.keys():
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                items.append((key, value))
+        return items
+
+    def copy(self):
+        return dict(self.items())
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
+
+    def pop(self, key, *args):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if args:
+                return args[0]
+            raise KeyError(key)
+        del self[key]
+        return value
+
+    def clear(self):
+        for key in self.keys():
+            del self[key]
+
+    def timestamp(self, key):
+        ''' Last write time of key (written by Node.updates) '''
+        return self.get(key + TIMESTAMP_SUFFIX, 0)
+
+
+class ReaderQueue(object):
+    ''' Writes of a key waiting for one reader '''
+    def __init__(self, size=None):
+        self.items = deque(maxlen=size)
+        self.dropped = 0
+
+    def append(self, item):
+        if len(self.items) == self.items.maxlen:
+            self.dropped += 1
+        self.items.append(item)
+
+    def drain(self):
+        items, dropped = list(self.items), self.dropped
+        self.items.clear()
+        self.dropped = 0
+        return items, dropped
+
+
+class Context(ContextClient):
+    ''' Thread safe dict with per key version and change notification
+        Global version increase by one on every write, a key version is the
+        global version at its last write.
+    '''
+    in_memory = True
+
+    def __init__(self, *args, **kwargs):
+        self.data = dict(*args, **kwargs)
+        self.versions = {}
+        self.current_version = 0
+        self.queues = {}    # key: {reader: ReaderQueue}
+        self.demands = {}   # key: {consumer}
+        self.condition = threading.Condition()
+        with self.condition:
+            self._touch(self.data)
+
+    def _touch(self, keys):
+        ''' Bump version of keys, must be called while holding condition '''
+        self.current_version += 1
+        for key in keys:
+            self.versions[key] = self.current_version
+        self.condition.notify_all()
+
+    def _enqueue(self, data):
+        ''' Queue written values for subscribed readers, after _touch '''
+        for key, readers in self.queues.items():
+            if key in data:
+                sidecars = {key + suffix: data[key + suffix]
+                            for suffix in SIDECAR_SUFFIXES
+                            if key + suffix in data}
+                for queue in readers.values():
+                    queue.append((self.current_version, data[key], sidecars))
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        with self.condition:
+            self.data[key] = value
+            self._touch((key, ))
+            self._enqueue({key: value})
+
+    def __delitem__(self, key):
+        with self.condition:
+            del self.data[key]
+            self._touch((key, ))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return repr(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return list(self.data.keys())
+
+    def values(self):
+        return list(self.data.values())
+
+    def items(self):
+        return list(self.data.items())
+
+    def copy(self):
+        return self.data.copy()
+
+    def update(self, *args, **kwargs):
+        data = dict(*args, **kwargs)
+        with self.condition:
+            self.data.update(data)
+            self._touch(data)
+            self._enqueue(data)
+
+    def setdefault(self, key, default=None):
+        with self.condition:
+            if key not in self.data:
+                self.data[key] = default
+                self._touch((key, ))
+                self._enqueue({key: default})
+            return self.data[key]
+
+    def pop(self, key, *args):
+        with self.condition:
+            value = self.data.pop(key, *args)
+            self._touch((key, ))
+            return value
+
+    def clear(self):
+        with self.condition:
+            keys = list(self.data)
+            self.data.clear()
+            self._touch(keys)
+
+    def version(self, key=None):
+        ''' Version of key or current global version '''
+        if key is None:
+            return self.current_version
+        return self.versions.get(key, 0)
+
+    def snapshot(self, keys, since=None, extra=()):
+        ''' Values and versions of keys read at once
+            since: last seen versions of keys, return None unless every
+            key exist and has been written after it
+            extra: keys read along (trace sidecars), without checks, their
+            values are appended to values
+            Return (values, versions)
+        '''
+        with self.condition:
+            versions = [self.versions.get(key, 0) for key in keys]
+            if since is not None:
+                for key, version, last in zip(keys, versions, since):
+                    if key not in self.data or last >= version:
+                        return None
+            return [self.data.get(key) for key in keys] + [
+                self.data.get(key) for key in extra], versions
+
+    def changed_since(self, since, keys=None):
+        ''' {key: version} of keys (default all) written after since '''
+        with self.condition:
+            if keys is None:
+                return {key: version for key, version in self.versions.items()
+                        if version > since and key in self.data}
+            return {key: self.versions[key] for key in keys
+                    if self.versions.get(key, 0) > since and key in self.data}
+
+    def subscribe(self, key, reader, size=None):
+        ''' Queue every write of key for reader until it drain them
+            size: max queued values, oldest are dropped, None for no limit
+        '''
+        with self.condition:
+            self.queues.setdefault(key, {})[reader] = ReaderQueue(size)
+
+    def unsubscribe(self, key, reader):
+        with self.condition:
+            readers = self.queues.get(key, {})
+            readers.pop(reader, None)
+            if not readers:
+                self.queues.pop(key, None)
+
+    def demand(self, key, consumer):
+        ''' consumer need key, producer of key should keep writing it '''
+        with self.condition:
+            self.demands.setdefault(key, set()).add(consumer)
+
+    def release(self, key, consumer):
+        with self.condition:
+            consumers = self.demands.get(key, set())
+            consumers.discard(consumer)
+            if not consumers:
+                self.demands.pop(key, None)
+
+    def demanded(self, keys):
+        ''' [True if a consumer need key, for key in keys] '''
+        with self.condition:
+            return [key in self.demands for key in keys]
+
+    def release_reader(self, reader):
+        ''' Drop queues and demands of a reader which is gone (crashed) '''
+        with self.condition:
+            for key in list(self.queues):
+                self.queues[key].pop(reader, None)
+                if not self.queues[key]:
+                    self.queues.pop(key)
+            for key in list(self.demands):
+                self.demands[key].discard(reader)
+                if not self.demands[key]:
+                    self.demands.pop(key)
+
+    def drain(self, keys, reader):
+        ''' Queued writes of keys for reader, one entry per key:
+            ([(version, value, sidecars), ...], values dropped since last
+            drain), sidecars are {sidecar key: value} written with value
+        '''
+        with self.condition:
+            return [self.queues[key][reader].drain()
+                    if reader in self.queues.get(key, {}) else ([], 0)
+                    for key in keys]
+
+    def wait(self, keys, since, timeout=None):
+        ''' Block until one of keys is written after version since
+            Return current global version, caller pass it back as since on
+            next call so no update is lost between two waits.
+        '''
+        with self.condition:
+            self.condition.wait_for(
+                lambda: any(self.versions.get(key, 0) > since
+                            for key in keys),
+                timeout)
+            return self.current_version
+
+
+class ContextProxy(BaseProxy):
+    ''' Proxy of Context, dict like '''
+    _exposed_ = (
+        '__contains__', '__delitem__', '__getitem__', '__len__',
+        '__setitem__', 'changed_since', 'clear', 'copy', 'demand',
+        'demanded', 'drain', 'get', 'items', 'keys', 'pop', 'release',
+        'release_reader', 'setdefault', 'snapshot', 'subscribe', 'timestamp',
+        'unsubscribe', 'update', 'values', 'version', 'wait'
+    )
+
+    def __contains__(self, key):
+        return self._callmethod('__contains__', (key, ))
+
+    def __delitem__(self, key):
+        return self._callmethod('__delitem__', (key, ))
+
+    def __getitem__(self, key):
+        return self._callmethod('__getitem__', (key, ))
+
+    def __len__(self):
+        return self._callmethod('__len__')
+
+    def __setitem__(self, key, value):
+        return self._callmethod('__setitem__', (key, value))
+
+    def changed_since(self, since, keys=None):
+        return self._callmethod('changed_since', (
+            since, None if keys is None else tuple(keys)))
+
+    def clear(self):
+        return self._callmethod('clear')
+
+    def copy(self):
+        return self._callmethod('copy')
+
+    def demand(self, key, consumer):
+        return self._callmethod('demand', (key, consumer))
+
+    def demanded(self, keys):
+        return self._callmethod('demanded', (tuple(keys), ))
+
+    def drain(self, keys, reader):
+        return self._callmethod('drain', (tuple(keys), reader))
+
+    def get(self, key, default=None):
+        return self._callmethod('get', (key, default))
+
+    def items(self):
+        return self._callmethod('items')
+
+    def keys(self):
+        return self._callmethod('keys')
+
+    def pop(self, key, *args):
+        return self._callmethod('pop', (key, ) + args)
+
+    def release(self, key, consumer):
+        return self._callmethod('release', (key, consumer))
+
+    def release_reader(self, reader):
+        return self._callmethod('release_reader', (reader, ))
+
+    def setdefault(self, key, default=None):
+        return self._callmethod('setdefault', (key, default))
+
+    def snapshot(self, keys, since=None, extra=()):
+        return self._callmethod('snapshot',
+                                (tuple(keys), since, tuple(extra)))
+
+    def subscribe(self, key, reader, size=None):
+        return self._callmethod('subscribe', (key, reader, size))
+
+    def timestamp(self, key):
+        return self._callmethod('timestamp', (key, ))
+
+    def unsubscribe(self, key, reader):
+        return self._callmethod('unsubscribe', (key, reader))
+
+    def update(self, *args, **kwargs):
+        return self._callmethod('update', args, kwargs)
+
+    def values(self):
+        return self._callmethod('values')
+
+    def version(self, key=None):
+        return self._callmethod('version', (key, ))
+
+    def wait(self, keys, since, timeout=None):
+        return self._callmethod('wait', (tuple(keys), since, timeout))
+
+
+class ProxyConnection(object):
+    ''' Non blocking connection to a manager server
+        Speak the same protocol as BaseProxy (length prefixed pickles of
+        (id, method, args, kwds) and (kind, result)) on an asyncio stream.
+        Handshake (auth) is blocking, done once in a thread.
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def connect(address, authkey):
+        conn = Client(address, authkey=authkey)
+        try:
+            dispatch(conn, None, 'accept_connection', (
+                '%s|async' % current_process().name, ))
+            family = socket.AF_UNIX if isinstance(address, str) \
+                else socket.AF_INET
+            return socket.socket(family, socket.SOCK_STREAM,
+                                 fileno=os.dup(conn.fileno()))
+        finally:
+            conn.close()
+
+    @classmethod
+    async def open(cls, address, authkey):
+        sock = await asyncio.get_event_loop().run_in_executor(
+            None, cls.connect, address, authkey)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        return cls(reader, writer)
+
+    async def call(self, ident, method, args=(), kwds={}):
+        payload = ForkingPickler.dumps((ident, method, args, kwds))
+        if len(payload) > 0x7fffffff:
+            self.writer.write(struct.pack('!iQ', -1, len(payload)))
+        else:
+            self.writer.write(struct.pack('!i', len(payload)))
+        self.writer.write(payload)
+        await self.writer.drain()
+        size, = struct.unpack('!i', await self.reader.readexactly(4))
+        if size == -1:
+            size, = struct.unpack('!Q', await self.reader.readexactly(8))
+        kind, result = pickle.loads(await self.reader.readexactly(size))
+        if kind == '#RETURN':
+            return result
+        raise convert_to_error(kind, result)
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncContext(object):
+    ''' Asyncio client of a context, coroutines await it without stalling
+        the event loop.
+        ContextProxy: calls go through non blocking connections to the
+            manager, one per concurrent call so a small write (steering)
+            never queue behind a large read (frame) or a long wait.
+        In memory context (Context, shared memory): called directly, only
+            wait run in a thread.
+        Others (redis): blocking calls run in a thread pool.
+    '''
+    max_threads = 4
+    max_connections = 2
+
+    def __init__(self, context):
+        self.context = context
+        self.direct = getattr(context, 'in_memory', False)
+        self.token = None
+        if isinstance(context, BaseProxy):
+            self.token = context._token
+            self.authkey = context._authkey
+        self.connections = []
+        self.slots = None
+        self.executor = None
+
+    async def run(self, func, *args, **kwargs):
+        ''' Run a blocking call in a thread '''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.max_threads, thread_name_prefix='context')
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def call(self, method, *args):
+        ''' Call context method without blocking '''
+        if self.direct:
+            return getattr(self.context, method)(*args)
+        if self.token is None:
+            return await self.run(getattr(self.context, method), *args)
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        async with self.slots:
+            if self.connections:
+                connection = self.connections.pop()
+            else:
+                connection = await ProxyConnection.open(
+                    self.token.address, self.authkey)
+            try:
+                result = await connection.call(self.token.id, method, args)
+            except BaseException:
+                # Cancelled or failed half way, stream state is unknown
+                connection.close()
+                raise
+            self.connections.append(connection)
+            return result
+
+    def has(self, method):
+        return callable(getattr(self.context, method, None))
+
+    async def get(self, key, default=None):
+        return await self.call('get', key, default)
+
+    async def update(self, *args, **kwargs):
+        return await self.call('update', dict(*args, **kwargs))
+
+    async def snapshot(self, keys, since=None, extra=()):
+        return await self.call('snapshot', tuple(keys), since, tuple(extra))
+
+    async def timestamp(self, key):
+        return await self.call('timestamp', key)
+
+    async def version(self, key=None):
+        return await self.call('version', key)
+
+    async def changed_since(self, since, keys=None):
+        return await self.call('changed_since', since,
+                               None if keys is None else tuple(keys))
+
+    async def wait(self, keys, since, timeout=None):
+        if self.direct:
+            return await self.run(self.context.wait, keys, since, timeout)
+        return await self.call('wait', tuple(keys), since, timeout)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+def serve_context(context, address=None, authkey=None):
+    ''' Serve a Context living in this process from a background thread
+        Return (server, proxy), proxy is passed to node processes while
+        threads of this process use context directly.
+    '''
+    class ContextServer(BaseManager):
+        pass
+    ContextServer.register('get_context', callable=lambda: context,
+                           proxytype=ContextProxy)
+    server = ContextServer(address=address, authkey=authkey).get_server()
+
+    def serve():
+        try:
+            server.serve_forever()
+        except SystemExit:  # Raised when server.stop_event is set
+            pass
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    client = ContextServer(address=server.address, authkey=authkey)
+    client.connect()
+    return server, client.get_context()
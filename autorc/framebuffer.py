@@ -0,0 +1,155 @@
+''' Shared memory ring buffer for large context values (camera frames)
+    Writer copy a frame into one of N fixed size slots and publish a small
+    FrameRef descriptor to the context instead of the frame itself.
+    Readers map the slot and get the frame without pickling / copying.
+
+    Memory layout:
+        header: magic, slot count, slot size
+        slot 0: seq, nbytes, data (slot size bytes)
+        slot 1: ...
+    Slot seq is reset to 0 while writing, a reader only accept a slot when its
+    seq match the one in FrameRef.
+'''
+import struct
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+FrameRef = namedtuple('FrameRef', ('name', 'slot', 'seq', 'nbytes', 'dtype',
+                                   'shape'))
+FrameRef.__doc__ = ''' Slot descriptor, dtype and shape are None for bytes '''
+_attach_lock = threading.Lock()
+
+
+def attach_shared_memory(name):
+    ''' Map shared memory created by another process without tracking it
+        Python < 3.13 always track attached memory, resource tracker would
+        unlink the creator's memory when this process exit
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        with _attach_lock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+
+class FrameRingBuffer(object):
+    MAGIC = b'NCRB'
+    HEADER = struct.Struct('<4sIQ')         # magic, slots, slot_size
+    SLOT_HEADER = struct.Struct('<QQ')      # seq, nbytes
+    ALIGN = 64
+
+    def __init__(self, shm, slots, slot_size, owner=False):
+        self.shm = shm
+        self.name = shm.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = owner
+        self.seq = 0
+        self.stride = self._align(self.SLOT_HEADER.size + slot_size)
+
+    @classmethod
+    def _align(cls, size):
+        return (size + cls.ALIGN - 1) // cls.ALIGN * cls.ALIGN
+
+    @classmethod
+    def create(cls, slots=4, slot_size=0, name=None):
+        ''' Allocate new ring buffer, caller own (and unlink) the memory '''
+        stride = cls._align(cls.SLOT_HEADER.size + slot_size)
+        size = cls._align(cls.HEADER.size) + stride * slots
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        cls.HEADER.pack_into(shm.buf, 0, cls.MAGIC, slots, slot_size)
+        for slot in range(slots):
+            cls.SLOT_HEADER.pack_into(
+                shm.buf, cls._align(cls.HEADER.size) + stride * slot, 0, 0)
+        return cls(shm, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        ''' Map an existing ring buffer created by another process '''
+        shm = attach_shared_memory(name)
+        magic, slots, slot_size = cls.HEADER.unpack_from(shm.buf, 0)
+        if magic != cls.MAGIC:
+            shm.close()
+            raise Exception('%s is not a frame ring buffer' % name)
+        return cls(shm, slots, slot_size)
+
+    def _slot_offset(self, slot):
+        return self._align(self.HEADER.size) + self.stride * slot
+
+    def write(self, value):
+        ''' Copy bytes or numpy array into next slot
+            Return FrameRef or None if value does not fit the slot
+        '''
+        if isinstance(value, np.ndarray):
+            data = np.ascontiguousarray(value)
+            dtype, shape = data.dtype.str, data.shape
+            nbytes = data.nbytes
+        else:
+            data = memoryview(value).cast('B')
+            dtype, shape = None, None
+            nbytes = data.nbytes
+        if nbytes > self.slot_size:
+            return None
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = self._slot_offset(slot)
+        buf = self.shm.buf
+        self.SLOT_HEADER.pack_into(buf, offset, 0, 0)    # Mark as writing
+        start = offset + self.SLOT_HEADER.size
+        if dtype is None:
+            buf[start:start + nbytes] = data
+        else:
+            np.ndarray(shape, dtype=data.dtype, buffer=buf,
+                       offset=start)[...] = data
+        self.SLOT_HEADER.pack_into(buf, offset, self.seq, nbytes)
+        return FrameRef(self.name, slot, self.seq, nbytes, dtype, shape)
+
+    def is_valid(self, ref: FrameRef):
+        ''' Slot still hold the frame described by ref '''
+        seq, nbytes = self.SLOT_HEADER.unpack_from(
+            self.shm.buf, self._slot_offset(ref.slot))
+        return seq == ref.seq
+
+    def read(self, ref: FrameRef, copy=False):
+        ''' Return the frame of ref or None if slot was overwritten
+            numpy frames are zero-copy views unless copy is True, a view
+            stay valid until writer wrap around the ring. bytes are always
+            copied (jpeg frames are small).
+        '''
+        if not self.is_valid(ref):
+            return None
+        start = self._slot_offset(ref.slot) + self.SLOT_HEADER.size
+        if ref.dtype is None:
+            value = bytes(self.shm.buf[start:start + ref.nbytes])
+        else:
+            value = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype),
+                               buffer=self.shm.buf, offset=start)
+            if not copy:
+                return value
+            value = value.copy()
+        # Writer may overwrite the slot while we are copying
+        if not self.is_valid(ref):
+            return None
+        return value
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # Numpy views are still alive, memory is released on exit
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,158 @@
+''' Node runtime metrics
+    Enabled per node (Node(metrics=True)) or for all nodes of a vehicle
+    (Vehicle(metrics=True)). Published every interval to context:
+        metrics/<node>/loop: loops, overruns (loop longer than
+            1 / process_rate), achieved rate, loop time percentiles and
+            lateness (tick start past its deadline, scheduling jitter)
+        metrics/<node>/<callback>: calls, rate, call time and input age
+            (time since inputs were written) percentiles
+        metrics/<node>/inputs: writes dropped per queued input key, calls
+            skipped per input key older than its max_age budget
+    Counters are cumulative, rates and percentiles cover the last interval.
+    Times are in seconds.
+'''
+import time
+from bisect import bisect_left
+
+
+__all__ = (
+    'Histogram',
+    'NodeMetrics',
+)
+
+
+# Bucket upper bounds, 25% wide from 10us to ~9min
+BUCKETS = tuple(1e-5 * 1.25 ** i for i in range(80))
+
+
+class Histogram(object):
+    ''' Latency histogram with fixed exponential buckets
+        Percentiles are bucket upper bounds (within 25%), capped to max
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                break
+        if index < len(BUCKETS):
+            return min(BUCKETS[index], self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max if self.count else None,
+        }
+
+
+class CallbackMetrics(object):
+    def __init__(self):
+        self.calls = 0
+        self.window_calls = 0
+        self.latency = Histogram()
+        self.input_age = Histogram()
+
+
+class NodeMetrics(object):
+    ''' Collect metrics of a node loop, report them every interval '''
+    def __init__(self, name, interval=1.0):
+        self.name = name
+        self.interval = interval
+        self.callbacks = {}
+        self.drops = {}     # Queued input key: dropped writes
+        self.stale = {}     # Input key: calls skipped, input too old
+        self.loop = Histogram()
+        self.lateness = Histogram()
+        self.loops = 0
+        self.overruns = 0
+        self.window_start = time.time()
+        self.window_loops = 0
+
+    def record_call(self, callback, duration, input_age=None):
+        stats = self.callbacks.get(callback)
+        if stats is None:
+            stats = self.callbacks[callback] = CallbackMetrics()
+        stats.calls += 1
+        stats.window_calls += 1
+        stats.latency.add(duration)
+        if input_age is not None:
+            stats.input_age.add(input_age)
+
+    def record_drops(self, key, count):
+        self.drops[key] = self.drops.get(key, 0) + count
+
+    def record_stale(self, key):
+        self.stale[key] = self.stale.get(key, 0) + 1
+
+    def record_loop(self, duration, overrun=False):
+        self.loops += 1
+        self.window_loops += 1
+        self.loop.add(duration)
+        if overrun:
+            self.overruns += 1
+
+    def record_lateness(self, lateness):
+        self.lateness.add(lateness)
+
+    def due(self, now):
+        return now - self.window_start >= self.interval
+
+    def report(self, now=None):
+        ''' {context key: metrics} of current window, start a new one '''
+        now = now or time.time()
+        elapsed = max(now - self.window_start, 1e-9)
+        prefix = 'metrics/%s/' % self.name
+        loop = self.loop.summary()
+        loop.update({
+            'loops': self.loops,
+            'overruns': self.overruns,
+            'rate': self.window_loops / elapsed,
+            'lateness': self.lateness.summary(),
+        })
+        data = {prefix + 'loop': loop}
+        if self.drops or self.stale:
+            inputs = {}
+            for key, dropped in self.drops.items():
+                inputs.setdefault(key, {})['dropped'] = dropped
+            for key, stale in self.stale.items():
+                inputs.setdefault(key, {})['stale'] = stale
+            data[prefix + 'inputs'] = inputs
+        for callback, stats in self.callbacks.items():
+            summary = stats.latency.summary()
+            summary.update({
+                'calls': stats.calls,
+                'rate': stats.window_calls / elapsed,
+                'input_age': stats.input_age.summary(),
+            })
+            data[prefix + callback] = summary
+            stats.window_calls = 0
+            stats.latency.reset()
+            stats.input_age.reset()
+        self.loop.reset()
+        self.lateness.reset()
+        self.window_loops = 0
+        self.window_start = now
+        return data
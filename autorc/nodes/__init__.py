@@ -1,20 +1,42 @@
+import os
 import time
 import logging
 import asyncio
 import typing
 
+from autorc.blocking import make_runner, done_callback
+from autorc.context import (
+    TIMESTAMP_SUFFIX, TRACE_SUFFIX, CAPTURE_SUFFIX, SIDECAR_SUFFIXES,
+    STOP_KEY, DELIVERY_POLICIES, AsyncContext)
+from autorc.framebuffer import FrameRef, FrameRingBuffer
+from autorc.metrics import NodeMetrics
+from autorc.scheduler import RateScheduler
+from autorc.tracing import (
+    Trace, TraceAggregator, newest_trace, newest_capture)
+
 __version__ = '0.1'
 
+NO_OUTPUT = object()    # Returned in place of an output not to publish it
+
 
 __all__ = (
     'Node'
 )
 
 
+class QueuedCall(list):
+    ''' Callback arguments of a queued write, sidecars are values of the
+        input sidecar keys (Node.input_keys) as they were with this write
+    '''
+    def __init__(self, args, sidecars):
+        super(QueuedCall, self).__init__(args)
+        self.sidecars = sidecars
+
+
 class Node(object):
     ''' Base class for vehicle nodes
         A node will be run in it own process or managed by main vehicle loop
-        Check for new input data by comparing timestamps header
+        Check for new input data by comparing context versions of inputs
         inputs = {
             'on_image_update': 'image',
             'on_driving': ('steering', 'steering')
@@ -23,39 +45,130 @@ class Node(object):
         input = ['image', 'steering'] without method will be pass to
         process loop
         same for process
-        When image is update (based on timestamp) on_image_update will be call
+        When image is update (new version) on_image_update will be call
         image become arg for on_image_update
         on_driving only called when both steering and throttle is updated
+        delivery = {'image': 'lossless'} per input key policy:
+            latest: (default) callback see the last value, writes between
+                two loops are missed
+            queue or ('queue', size): callback is called for every queued
+                write, oldest are dropped when queue is full
+            lossless: every write is delivered
+        Queued inputs need a queue capable context (manager backend), the
+        other inputs of the callback carry their latest value.
+        max_age = {'pilot/steering': 0.15} per input key staleness budget in
+        seconds: a callback is not called with an input older than that,
+        on_stale is called instead (safe action). Age is measured from the
+        capture of the frame the input derive from (key__capture sidecar,
+        written by every node with outputs), otherwise from its write.
+        Node demand its inputs, producers may skip outputs nobody demand
+        (see BaseWebCam). lazy_inputs are only demanded by set_demand, when
+        node really use them (pilot engaged, recording...).
+        shared_memory=False publish shared_outputs values in context, for
+        readers on another machine (Vehicle turn it off when allow_remote).
+        declare(*args, **kwargs) give inputs and outputs of a node without
+        building it (fused pipelines): class attributes or inputs / outputs
+        arguments, nodes computing them from other arguments override it.
+        Shared frames are zero-copy views into a ring of frame_slots, the
+        result of a callback whose frame was overwritten meanwhile is
+        dropped (torn_frames).
     '''
     inputs = None                 # Input call back
-    input_timestamps = None       # Cache last input timestamp for updated
+    input_timestamps = None       # Last input timestamps, input age
+    input_versions = None         # Last seen context version of inputs
     outputs = None                # Output
     max_loop = None               # Use for testing, exit process after loops
     process_rate = 24             # process loop should be call per second
+    overrun_policy = 'skip'       # skip, catchup or asap, see scheduler
+    adaptive_rate = False         # Lower process rate when CPU can't keep up
     input_output_mapping = None
+    shared_outputs = None         # Output keys publish via shared memory
+    frame_slots = 4               # Ring buffer slots per shared output
+    idle_timeout = 0.5            # Max time waiting for input changes
+    context_version = None        # Last seen context version
+    metrics = None                # NodeMetrics when metrics are enabled
+    trace = False                 # Propagate frame traces to outputs
+    trace_frame = 0               # Last frame ID of traces started here
+    current_trace = None          # Trace of inputs of running callback
+    current_capture = None        # Frame capture time of running callback
+    input_captures = None         # {input key: capture time of its frame}
+    traces = None                 # TraceAggregator of applied traces
+    delivery = None               # {input key: delivery policy}
+    queue_size = 8                # Default size of queue delivery
+    queues = None                 # {queued input key: queue size}
+    input_drops = None            # {queued input key: dropped writes}
+    max_age = None                # {input key: max age in seconds}
+    stale_inputs = None           # {input key: calls skipped, too old}
+    lazy_inputs = ()              # Inputs demanded by set_demand only
+    demands = None                # Input keys demanded by this node
+    ready_key = None              # Context key set when node is started
+    first_output = None           # Time of first published output
+    heartbeat_key = None          # Context key the loop write it is alive
+    views = None                  # (ring, FrameRef) of frames being used
+    torn_frames = 0               # Results dropped, frame overwritten
+    heartbeat_interval = 0.5      # Seconds between heartbeats
+    heartbeat_timeout = None      # Min hang timeout, default to vehicle one
+    last_heartbeat = 0
 
     def __init__(self, context, *,
-                 inputs: typing.Union[dict, list, tuple]=None,
-                 outputs: typing.Union[dict, list, tuple]=None,
-                 process_rate=24, max_loop=None, logger=None, **kwargs):
+                 inputs: typing.Union[dict, list, tuple] = None,
+                 outputs: typing.Union[dict, list, tuple] = None,
+                 shared_outputs: typing.Union[list, tuple] = None,
+                 shared_memory=True, process_rate=24, overrun_policy='skip',
+                 adaptive_rate=False,
+                 max_loop=None, logger=None,
+                 metrics=False, metrics_interval=1.0, trace=False,
+                 delivery: dict = None, max_age: dict = None, ready_key=None,
+                 heartbeat_key=None, **kwargs):
         super(Node, self).__init__()
         self.logger = logger or logging.getLogger(self.__class__.__name__)
         self.max_loop = max_loop
+        self.process_rate = process_rate
+        self.overrun_policy = overrun_policy
+        self.adaptive_rate = adaptive_rate
         self.context = context
         self.input_timestamps = {}
+        self.input_captures = {}
+        self.input_versions = {}
+        if metrics:
+            self.metrics = NodeMetrics(repr(self), metrics_interval)
+        self.trace = trace
         if (inputs):
             self.inputs = inputs
         if (outputs):
             self.outputs = outputs
+        if (shared_outputs):
+            self.shared_outputs = shared_outputs
+        if not shared_memory:   # Readers may not reach this host memory
+            self.shared_outputs = None
+        if (delivery):
+            self.delivery = delivery
+        if (max_age):
+            self.max_age = max_age
+        self.stale_inputs = {key: 0 for key in self.max_age or ()}
+        self.ready_key = ready_key
+        self.heartbeat_key = heartbeat_key
+        self.queues = {}
+        self.demands = set()
+        self.input_drops = {}
+        self.frame_buffers = {}       # Own ring buffers, by output key
+        self.attached_buffers = {}    # Ring buffers of other nodes, by name
+        self.views = []
         # Convert callback name to class method
         self.input_output_mapping = {}
         self._prepare_mapping(self.inputs, 'inputs')
         self._prepare_mapping(self.outputs, 'outputs')
         process_loop = getattr(self, 'process_loop', None)
-        if process_loop and process_loop not in self.input_output_mapping:
+        if (process_loop and process_loop not in self.input_output_mapping and
+                not getattr(process_loop, 'noop', False)):
             # Process loop just need to run
             self.input_output_mapping[process_loop] = {}
 
+    @classmethod
+    def declare(cls, *args, inputs=None, outputs=None, **kwargs):
+        ''' (inputs, outputs) of a node built with args and kwargs '''
+        return inputs or cls.inputs, outputs or cls.outputs
+
     def _prepare_mapping(self, keys, mtype='inputs'):
         if keys:
             if isinstance(keys, (list, tuple)):
@@ -76,7 +189,13 @@ class Node(object):
         return self.__class__.__name__
 
     def make_timestamp_key(self, key):
-        return key + '__timestamp'
+        return key + TIMESTAMP_SUFFIX
+
+    def make_trace_key(self, key):
+        return key + TRACE_SUFFIX
+
+    def make_capture_key(self, key):
+        return key + CAPTURE_SUFFIX
 
     def update(self, key, value):
         ''' Write output to current context, add timestamp to track updates '''
@@ -84,12 +203,229 @@ class Node(object):
 
     def updates(self, data: dict):
         ''' Update multiple key, values '''
+        self.context.update(self.make_updates(data))
+
+    def make_updates(self, data: dict):
+        ''' Context update of data: timestamps added, frames shared '''
         updater = {}
         timestamp = time.time()
         for k, v in data.items():
+            if k.endswith((TRACE_SUFFIX, CAPTURE_SUFFIX)):  # Sidecar, as is
+                updater[k] = v
+                continue
+            if self.shared_outputs and k in self.shared_outputs:
+                v = self.share_frame(k, v)
             updater[k] = v
             updater[self.make_timestamp_key(k)] = timestamp
-        self.context.update(updater)
+        return updater
+
+    def share_frame(self, key, value):
+        ''' Copy frame to shared memory, return FrameRef to put in context
+            Fallback to the value itself if it could not be shared
+        '''
+        if value is None:
+            return value
+        ring = self.frame_buffers.get(key)
+        if ring is not None:
+            ref = ring.write(value)
+            if ref is not None:
+                return ref
+            # Frame got bigger, allocate a new ring for it
+            ring.close()
+        nbytes = memoryview(value).nbytes
+        if not hasattr(value, 'dtype'):
+            # Encoded frame (jpeg) size vary, leave some room
+            nbytes = max(nbytes * 2, 65536)
+        try:
+            ring = FrameRingBuffer.create(self.frame_slots, nbytes)
+        except (OSError, ValueError) as ex:
+            self.logger.error('Unable to share %s: %s', key, ex)
+            self.shared_outputs = tuple(
+                k for k in self.shared_outputs if k != key)
+            return value
+        self.frame_buffers[key] = ring
+        return ring.write(value)
+
+    def resolve(self, value, copy=False):
+        ''' Map FrameRef from context to the actual frame
+            copy: frame is used later (queued, deferred to a thread), copy it
+            out of the ring before the writer wrap around
+        '''
+        if not isinstance(value, FrameRef):
+            return value
+        ring = self.attached_buffers.get(value.name)
+        if ring is None:
+            try:
+                ring = FrameRingBuffer.attach(value.name)
+            except FileNotFoundError:
+                return None
+            self.attached_buffers[value.name] = ring
+        frame = ring.read(value, copy)
+        if not copy and value.dtype is not None and frame is not None:
+            self.views.append((ring, value))
+        return frame
+
+    def views_valid(self):
+        ''' False if a frame view given to the callback was overwritten while
+            it ran (slow callback), its result is dropped
+        '''
+        views, self.views = self.views, []
+        if all(ring.is_valid(ref) for ring, ref in views):
+            return True
+        self.torn_frames += 1
+        self.logger.warning('Frame overwritten during callback, result'
+                            ' dropped')
+        return False
+
+    def release_frame_buffers(self):
+        for ring in self.frame_buffers.values():
+            ring.close()
+        for ring in self.attached_buffers.values():
+            ring.close()
+        self.frame_buffers = {}
+        self.attached_buffers = {}
+
+    @property
+    def reader_id(self):
+        ''' Identify this node among readers of a queued key, vehicle nodes
+            use their ready key, a restarted node take its queues back
+        '''
+        if self.ready_key:
+            return self.ready_key
+        return '%s:%d:%x' % (self, os.getpid(), id(self))
+
+    def subscribe_inputs(self):
+        ''' Ask context to queue inputs with queue or lossless delivery '''
+        for key, policy in (self.delivery or {}).items():
+            size = self.queue_size
+            if isinstance(policy, (list, tuple)):
+                policy, size = policy
+            if policy not in DELIVERY_POLICIES:
+                raise Exception('Unknown delivery policy %s, available: %s' % (
+                    policy, ', '.join(DELIVERY_POLICIES)))
+            if policy == 'latest':
+                continue
+            if not callable(getattr(self.context, 'subscribe', None)):
+                self.logger.warning('Context could not queue %s, deliver'
+                                    ' latest value only', key)
+                continue
+            size = None if policy == 'lossless' else size
+            self.context.subscribe(key, self.reader_id, size)
+            self.queues[key] = size
+            self.input_drops[key] = 0
+        for innout in self.input_output_mapping.values():
+            for key in innout.get('inputs') or ():
+                if key not in self.lazy_inputs:
+                    self.set_demand(key)
+
+    def unsubscribe_inputs(self):
+        for key in self.queues:
+            self.context.unsubscribe(key, self.reader_id)
+        self.queues = {}
+        for key in tuple(self.demands):
+            self.set_demand(key, False)
+
+    def set_demand(self, key, wanted=True):
+        ''' Tell producer of key this node need it, or not anymore '''
+        if (wanted == (key in self.demands) or
+                not callable(getattr(self.context, 'demand', None))):
+            return
+        if wanted:
+            self.context.demand(key, self.reader_id)
+            self.demands.add(key)
+        else:
+            self.context.release(key, self.reader_id)
+            self.demands.discard(key)
+
+    def demanded(self, keys):
+        ''' [True if a node need key, for key in keys], always True when
+            context could not track demands
+        '''
+        if not callable(getattr(self.context, 'demanded', None)):
+            return [True] * len(keys)
+        return self.context.demanded(keys)
+
+    def fetch_calls(self, inputs):
+        ''' Argument lists to call a callback with: one per queued write
+            when it has queued inputs, otherwise at most one
+        '''
+        if not isinstance(inputs, (list, tuple)):
+            inputs = (inputs, )
+        if self.queues and any(key in self.queues for key in inputs):
+            return self.fetch_queued(inputs)
+        cbargs = self.fetch_inputs(inputs)
+        return [] if cbargs is None else [cbargs]
+
+    def fetch_queued(self, inputs):
+        queued = [key for key in inputs if key in self.queues]
+        writes = []
+        for key, (items, dropped) in zip(queued, self.context.drain(
+                queued, self.reader_id)):
+            if dropped:
+                self.record_drops(key, dropped)
+            writes.extend((version, key, value, written)
+                          for version, value, written in items)
+        if not writes:
+            return []
+        # Latest value of other inputs, queued ones are replaced in order
+        # along with the sidecars written with them
+        inputs, extra = self.input_keys(inputs)
+        if callable(getattr(self.context, 'snapshot', None)):
+            values, versions = self.context.snapshot(inputs, None, extra)
+        else:
+            values = [self.context.get(key)
+                      for key in tuple(inputs) + tuple(extra)]
+        sidecars = dict(zip(extra, values[len(inputs):]))
+        # Frames of every queued write are resolved before the first call,
+        # views would be overwritten by then
+        current = dict(zip(inputs, (self.resolve(value, True)
+                                    for value in values[:len(inputs)])))
+        calls = []
+        for version, key, value, written in sorted(writes,
+                                                   key=lambda w: w[0]):
+            value = self.resolve(value, True)
+            if value is None:   # Shared frame slot already overwritten
+                self.record_drops(key, 1)
+                continue
+            current[key] = value
+            for suffix in SIDECAR_SUFFIXES:
+                if key + suffix in sidecars:
+                    sidecars[key + suffix] = written.get(key + suffix)
+            calls.append(QueuedCall([current[key] for key in inputs],
+                                    [sidecars[key] for key in extra]))
+        return calls
+
+    def record_drops(self, key, count):
+        self.input_drops[key] += count
+        if self.metrics is not None:
+            self.metrics.record_drops(key, count)
+
+    def input_stale(self, callback, inputs, now=None):
+        ''' True if an input is older than its max_age budget, the violation
+            is counted and on_stale called
+        '''
+        now = now or time.time()
+        for key in inputs:
+            budget = self.max_age.get(key)
+            if budget is None:
+                continue
+            written = self.input_captures.get(key)
+            if written is None:
+                written = self.input_timestamps.get(
+                    self.make_timestamp_key(key))
+            if written is not None and now - written > budget:
+                self.stale_inputs[key] += 1
+                if self.metrics is not None:
+                    self.metrics.record_stale(key)
+                self.on_stale(callback, key, now - written)
+                return True
+        return False
+
+    def on_stale(self, callback, key, age):
+        ''' callback was not called, its input key was age seconds old
+            Override to apply a safe action
+        '''
+        pass
 
     def input_updated(self, inputs):
         if not isinstance(inputs, (list, tuple)):
@@ -105,47 +441,308 @@ class Node(object):
         self.input_timestamps.update(updated_ts)
         return True
 
+    def fetch_inputs(self, inputs, copy=False):
+        ''' Values of inputs if all of them are updated, otherwise None
+            Use context snapshot (single round trip) when available, inputs
+            are updated when their version changed. Plain dict context
+            compare timestamps.
+        '''
+        inputs, extra = self.input_keys(inputs)
+        if callable(getattr(self.context, 'snapshot', None)):
+            return self.snapshot_values(inputs, self.context.snapshot(
+                inputs, self.snapshot_since(inputs), extra), copy)
+        if not self.input_updated(inputs):
+            return None
+        values = [self.context.get(key) for key in inputs]
+        self.read_sidecars(inputs, [self.context.get(key) for key in extra])
+        return [self.resolve(value, copy) for value in values]
+
+    def input_keys(self, inputs):
+        ''' (input keys, sidecar keys to read with them)
+            Sidecars are traces when tracing, timestamps (input age) when
+            metrics or max_age are enabled and capture times when node has
+            outputs (to carry them) or max_age
+        '''
+        if not isinstance(inputs, (list, tuple)):
+            inputs = (inputs, )
+        extra = []
+        if self.trace:
+            extra.extend(self.make_trace_key(key) for key in inputs)
+        if self.metrics is not None or self.max_age:
+            extra.extend(self.make_timestamp_key(key) for key in inputs)
+        if self.outputs or self.max_age:
+            extra.extend(self.make_capture_key(key) for key in inputs)
+        return inputs, extra
+
+    def read_sidecars(self, inputs, values):
+        ''' Apply sidecar values listed by input_keys '''
+        traces = [None] * len(inputs)
+        if self.trace:
+            traces = values[:len(inputs)]
+            self.current_trace = newest_trace(traces)
+            values = values[len(inputs):]
+        if self.metrics is not None or self.max_age:
+            self.input_timestamps.update(
+                (self.make_timestamp_key(key), timestamp)
+                for key, timestamp in zip(inputs, values)
+                if timestamp is not None)
+            values = values[len(inputs):]
+        if self.outputs or self.max_age:
+            captures = values[:len(inputs)]
+            self.current_capture = newest_capture(captures)
+            # Each input is aged from the capture of its own frame
+            self.input_captures = {
+                key: trace.capture if capture is None and trace else capture
+                for key, trace, capture in zip(inputs, traces, captures)}
+
+    def snapshot_since(self, inputs):
+        return [self.input_versions.get(key, 0) for key in inputs]
+
+    def snapshot_values(self, inputs, snapshot, copy=False):
+        ''' Input values from a context snapshot, None if not updated '''
+        if snapshot is None:
+            return None
+        values, versions = snapshot
+        self.input_versions.update(zip(inputs, versions))
+        self.read_sidecars(inputs, values[len(inputs):])
+        return [self.resolve(value, copy) for value in values[:len(inputs)]]
+
+    def get_mapper(self):
+        ''' Tuple of (callback, inputs, outputs) '''
+        return tuple(
+            (callback, innout.get('inputs'), innout.get('outputs'))
+            for callback, innout in self.input_output_mapping.items()
+        )
+
+    def publish(self, callback, outputs, ret, pending=None):
+        ''' Write callback return value to its output keys
+            pending: collect outputs in this dict instead of writing them
+            Return published {key: value}, None if nothing published
+            Outputs returned as NO_OUTPUT are not published
+        '''
+        if ret is None:
+            return None
+        if not isinstance(ret, tuple):
+            ret = (ret, )
+        if outputs and len(ret) == len(outputs):
+            data = {key: ret[i] for i, key in enumerate(outputs)
+                    if ret[i] is not NO_OUTPUT}
+            if not data:
+                return None
+            keys = tuple(data)
+            if self.current_trace is not None:
+                trace = self.stamp_trace(self.current_trace)
+                data.update({self.make_trace_key(key): trace
+                             for key in keys})
+            if self.current_capture is not None:
+                data.update({self.make_capture_key(key): self.current_capture
+                             for key in keys})
+            if self.first_output is None:
+                self.first_output = time.time()
+                if self.ready_key:
+                    data[self.ready_key + '/first_output'] = self.first_output
+            if pending is not None:
+                pending.update(data)
+            else:
+                self.updates(data)
+            return data
+        self.logger.error('Outputs and keys mismatch in %s', callback)
+
+    def run_callbacks(self, mapper, fused=None, produced=None, pending=None,
+                      timer=True):
+        ''' Call callbacks which inputs are updated, publish their outputs
+            fused: callbacks fed with produced values (output of previous
+            node in a fused pipeline) instead of context
+            timer: call callbacks without inputs, a tick is due
+            Return all published {key: value}
+        '''
+        published = {}
+        for callback, inputs, outputs in mapper:
+            calls = ()
+            context_inputs = inputs
+            self.current_trace = None
+            self.current_capture = None
+            self.input_captures = {}
+            self.views = []
+            if fused and callback in fused:
+                context_inputs = None
+                if produced and all(key in produced for key in inputs):
+                    self.input_captures = {
+                        key: produced.get(self.make_capture_key(key))
+                        for key in inputs}
+                    self.current_capture = newest_capture(
+                        self.input_captures.values())
+                    if self.trace:
+                        self.current_trace = newest_trace(
+                            produced.get(self.make_trace_key(key))
+                            for key in inputs)
+                    calls = ([produced[key] for key in inputs], )
+            elif inputs is not None:
+                calls = self.fetch_calls(inputs)
+            elif timer:
+                calls = ((), )
+            for cbargs in calls:
+                if isinstance(cbargs, QueuedCall):
+                    self.read_sidecars(inputs, cbargs.sidecars)
+                if self.max_age and inputs and self.input_stale(
+                        callback, inputs):
+                    continue
+                ret = self.call(callback, cbargs, context_inputs)
+                if not self.views_valid():
+                    continue
+                data = self.publish(callback, outputs, ret, pending)
+                if data:
+                    published.update(data)
+        return published
+
+    def call(self, callback, args, inputs=None):
+        ''' Call callback, measure it when metrics are enabled
+            inputs: context keys args come from, to measure their age
+        '''
+        if self.metrics is None:
+            return callback(*args)
+        start_time = time.time()
+        ret = callback(*args)
+        self.record_call(callback, inputs, start_time)
+        return ret
+
+    def record_call(self, callback, inputs, start_time):
+        input_age = None
+        if inputs:
+            input_age = start_time - min(
+                self.input_timestamps.get(
+                    self.make_timestamp_key(key), start_time)
+                for key in inputs)
+        self.metrics.record_call(
+            callback.__name__, time.time() - start_time, input_age)
+
+    def record_loop(self, start_time, period):
+        ''' Record a loop, publish metrics to context every interval '''
+        now = time.time()
+        self.metrics.record_loop(now - start_time, now - start_time > period)
+        if self.metrics.due(now):
+            self.updates(self.metrics.report(now))
+
+    def start_trace(self, capture_time=None):
+        ''' Start a frame trace, outputs of current callback carry it, or
+            only the capture time when not tracing
+            Called by source nodes (camera) when a frame is captured
+        '''
+        self.current_capture = capture_time or time.time()
+        if self.trace:
+            self.trace_frame += 1
+            self.current_trace = Trace(
+                self.trace_frame, self.current_capture, ())
+
+    def stamp_trace(self, trace):
+        ''' Trace with this node publish time appended '''
+        return trace._replace(
+            stages=trace.stages + ((repr(self), time.time()), ))
+
+    def record_trace(self, applied=None):
+        ''' Current trace reached an actuator, aggregate it
+            Report is published to trace/<node> every second
+        '''
+        if self.current_trace is None:
+            return
+        if self.traces is None:
+            self.traces = TraceAggregator(repr(self))
+        now = applied or time.time()
+        self.traces.record(self.current_trace, now)
+        if self.traces.due(now):
+            self.updates(self.traces.report(now))
+
+    def make_scheduler(self, wait_keys=None, idle_timeout=None):
+        ''' Scheduler pacing timer callbacks (or polling) at process rate
+            None when loop only wait for inputs
+        '''
+        if wait_keys and idle_timeout is not None:
+            return None
+        scheduler = RateScheduler(self.process_rate, self.overrun_policy,
+                                  self.adaptive_rate)
+        scheduler.start()
+        return scheduler
+
+    def tick_done(self, scheduler):
+        if self.metrics is not None:
+            self.metrics.record_lateness(scheduler.lateness)
+        rate = scheduler.rate
+        scheduler.done()
+        if scheduler.rate != rate:
+            self.logger.info('%s rate changed from %.1f to %.1f',
+                             self, rate, scheduler.rate)
+
+    def prepare_wait(self, mapper):
+        ''' Keys to wait on instead of sleeping between loops
+            Return (keys, timeout), keys is None if context could not notify
+            changes. timeout is None when a callback without input has to
+            be called at process rate.
+        '''
+        if not callable(getattr(self.context, 'wait', None)):
+            return None, None
+        keys = set()
+        timer = False
+        for callback, inputs, outputs in mapper:
+            if inputs:
+                keys.update(inputs)
+            else:
+                timer = True
+        if not keys:
+            return None, None
+        keys.add(STOP_KEY)
+        self.context_version = 0
+        return tuple(keys), None if timer else self.idle_timeout
+
+    def wait_inputs(self, keys, timeout):
+        ''' Block until one of keys changed or timeout '''
+        self.context_version = self.context.wait(
+            keys, self.context_version, timeout)
+
     def process_loop(self, *args):
         ''' This method is call by main loop to update data '''
         pass
+    process_loop.noop = True
 
     def start_up(self):
         pass
 
+    def signal_ready(self):
+        ''' Tell the vehicle start_up is done, node enter its loop '''
+        if self.ready_key:
+            self.update(self.ready_key, time.time())
+
+    def heartbeat(self, now):
+        ''' Heartbeat update for the vehicle supervisor, None if not due '''
+        if (self.heartbeat_key and
+                now - self.last_heartbeat >= self.heartbeat_interval):
+            self.last_heartbeat = now
+            return {self.heartbeat_key: now}
+
     @classmethod
     def start(cls, context, stop_event, *args, **kwargs):
         self = cls(context, *args, **kwargs)
         self.logger.info('Process %s started!' % self.__class__.__name__)
         self.start_up()
+        self.subscribe_inputs()
+        self.signal_ready()
         loop_count = 0
         max_sleep_time = 1.0 / self.process_rate
-        mapper = tuple(
-            (callback, innout.get('inputs'), innout.get('outputs'))
-            for callback, innout in self.input_output_mapping.items()
-        )
+        mapper = self.get_mapper()
+        wait_keys, idle_timeout = self.prepare_wait(mapper)
+        scheduler = self.make_scheduler(wait_keys, idle_timeout)
         while not stop_event.is_set():  # Listen for stop event
             start_time = time.time()
+            heartbeat = self.heartbeat(start_time)
+            if heartbeat:
+                self.context.update(heartbeat)
+            due = scheduler is None or scheduler.due()
             # Check and call callback on input updated
             if mapper:
-                for callback, inputs, outputs in mapper:
-                    ret = None
-                    if inputs is not None:
-                        if self.input_updated(inputs):
-                            cbargs = [self.context.get(input)
-                                      for input in inputs]
-                            ret = callback(*cbargs)
-                    else:
-                        ret = callback()
-                    if ret is not None:
-                        if not isinstance(ret, tuple):
-                            ret = (ret, )
-                        if outputs is not None and len(ret) == len(outputs):
-                            self.updates({
-                                key: ret[i] for i, key in enumerate(outputs)
-                            })
-                        else:
-                            self.logger.error(
-                                'Outputs and keys mismatch in %s', callback)
+                self.run_callbacks(mapper, timer=due)
+            if scheduler is not None and due:
+                self.tick_done(scheduler)
+            if self.metrics is not None:
+                self.record_loop(start_time, max_sleep_time)
 
             loop_count += 1
 
@@ -153,12 +750,20 @@ class Node(object):
                 self.logger.info('Max loop exceeded, Exit')
                 break
 
-            sleep_time = max_sleep_time - (time.time() - start_time)
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+            if wait_keys:
+                # Wake up as soon as an input changed
+                timeout = idle_timeout or scheduler.remaining()
+                if timeout > 0:
+                    self.wait_inputs(wait_keys, timeout)
+            else:
+                sleep_time = scheduler.remaining()
+                if sleep_time > 0:
+                    stop_event.wait(sleep_time)
 
         if callable(getattr(self, 'shutdown', None)):
             self.shutdown()
+        self.unsubscribe_inputs()
+        self.release_frame_buffers()
 
     def shutdown(self):
         ''' Free all resource '''
@@ -169,62 +774,174 @@ class Node(object):
 
 
 class AsyncNode(Node):
-    ''' Just like Node but using async io '''
-    def __init__(self, context, *, loop=None, **kwargs):
+    ''' Just like Node but using async io
+        Context is accessed through async_context so event loop never
+        block on it, use await self.async_update(...) in coroutines
+        blocking: run every plain def callback in a thread pool, True or
+        options of autorc.blocking.blocking
+    '''
+    def __init__(self, context, *, loop=None, blocking=False, **kwargs):
         super(AsyncNode, self).__init__(context, **kwargs)
         # TODO enforce callback as coroutine function
         # asyncio.iscoroutinefunction(callback)
         self.loop = loop
+        self.async_context = AsyncContext(context)
+        self.blocking = blocking
+        self.runners = {}
+        self.blocking_updates = set()
+
+    async def async_update(self, key, value):
+        await self.async_updates({key: value})
+
+    async def async_updates(self, data: dict):
+        await self.async_context.update(self.make_updates(data))
+
+    async def async_fetch_inputs(self, inputs, copy=False):
+        ''' fetch_inputs awaiting the context snapshot '''
+        if not self.async_context.has('snapshot'):
+            return await self.async_context.run(
+                self.fetch_inputs, inputs, copy)
+        inputs, extra = self.input_keys(inputs)
+        return self.snapshot_values(inputs, await self.async_context.snapshot(
+            inputs, self.snapshot_since(inputs), extra), copy)
+
+    async def async_fetch_calls(self, inputs, copy=False):
+        ''' fetch_calls without blocking the event loop
+            copy: shared frames are copied, callback run in a thread pool
+        '''
+        if self.queues and any(key in self.queues for key in inputs):
+            return await self.async_context.run(self.fetch_queued, inputs)
+        cbargs = await self.async_fetch_inputs(inputs, copy)
+        return [] if cbargs is None else [cbargs]
 
     async def process_loop(self, *args):
         pass
+    process_loop.noop = True
+
+    async def call(self, callback, args, inputs=None):
+        if self.metrics is None:
+            return await callback(*args)
+        start_time = time.time()
+        ret = await callback(*args)
+        self.record_call(callback, inputs, start_time)
+        return ret
+
+    def submit_blocking(self, runner, callback, args, inputs, outputs):
+        ''' Hand a blocking callback to its pool, publish when done '''
+        future = runner.submit(callback, args)
+        future.add_done_callback(done_callback(
+            asyncio.get_event_loop(), self.blocking_done, callback, inputs,
+            outputs, self.current_trace, self.current_capture))
+
+    def blocking_done(self, callback, inputs, outputs, trace, capture,
+                      future):
+        if future.cancelled():  # Dropped, newer call waiting
+            return
+        try:
+            ret, start_time = future.result()
+        except Exception:
+            self.logger.exception('Blocking callback %s failed',
+                                  callback.__name__)
+            return
+        if self.metrics is not None:
+            self.record_call(callback, inputs, start_time)
+        # Loop may be in the middle of another callback, keep its trace
+        current = self.current_trace, self.current_capture
+        self.current_trace, self.current_capture = trace, capture
+        pending = {}
+        if self.publish(callback, outputs, ret, pending):
+            task = asyncio.ensure_future(self.async_updates(pending))
+            self.blocking_updates.add(task)
+            task.add_done_callback(self.blocking_updates.discard)
+        self.current_trace, self.current_capture = current
+
+    async def drain_blocking(self):
+        ''' Let blocking calls in flight finish and publish '''
+        for runner in self.runners.values():
+            await runner.drain()
+        await asyncio.sleep(0)  # Run done callbacks
+        if self.blocking_updates:
+            await asyncio.wait(self.blocking_updates)
 
     async def start_up(self):
         pass
 
     async def async_loop(self, stop_event, *args):
         await self.start_up()
+        self.subscribe_inputs()
+        await self.async_context.run(self.signal_ready)
         loop_count = 0
         max_sleep_time = 1.0 / self.process_rate
-        mapper = tuple(
-            (callback, innout.get('inputs'), innout.get('outputs'))
-            for callback, innout in self.input_output_mapping.items()
-        )
+        mapper = self.get_mapper()
+        wait_keys, idle_timeout = self.prepare_wait(mapper)
+        scheduler = self.make_scheduler(wait_keys, idle_timeout)
+        for callback, inputs, outputs in mapper:
+            runner = make_runner(self, callback, self.blocking)
+            if runner is not None:
+                self.runners[callback] = runner
         while not stop_event.is_set():  # Listen for stop event
             start_time = time.time()
+            heartbeat = self.heartbeat(start_time)
+            if heartbeat:
+                await self.async_context.update(heartbeat)
+            due = scheduler is None or scheduler.due()
             # Check and call callback on input updated
             if mapper:
                 for callback, inputs, outputs in mapper:
-                    ret = None
+                    calls = ()
+                    self.current_trace = None
+                    self.current_capture = None
+                    self.input_captures = {}
+                    self.views = []
+                    runner = self.runners.get(callback)
                     if inputs:
-                        if self.input_updated(inputs):
-                            cbargs = [self.context.get(input)
-                                      for input in inputs]
-                            ret = await callback(*cbargs)
-                    else:
-                        ret = await callback()
-                    if ret is not None:
-                        if not isinstance(ret, tuple):
-                            ret = (ret, )
-                        if outputs and len(ret) == len(outputs):
-                            self.updates({
-                                key: ret[i] for i, key in enumerate(outputs)
-                            })
-                        else:
-                            self.logger.error(
-                                'Outputs and keys mismatch in %s', callback)
+                        calls = await self.async_fetch_calls(
+                            inputs, runner is not None)
+                    elif due:
+                        calls = ((), )
+                    for cbargs in calls:
+                        if isinstance(cbargs, QueuedCall):
+                            self.read_sidecars(inputs, cbargs.sidecars)
+                        if self.max_age and inputs and self.input_stale(
+                                callback, inputs):
+                            continue
+                        if runner is not None:
+                            self.submit_blocking(runner, callback, cbargs,
+                                                 inputs, outputs)
+                            continue
+                        ret = await self.call(callback, cbargs, inputs)
+                        if not self.views_valid():
+                            continue
+                        pending = {}
+                        if self.publish(callback, outputs, ret, pending):
+                            await self.async_updates(pending)
+            if scheduler is not None and due:
+                self.tick_done(scheduler)
+            if self.metrics is not None:
+                await self.async_context.run(
+                    self.record_loop, start_time, max_sleep_time)
             loop_count += 1
 
             if self.max_loop and self.max_loop <= loop_count:
                 self.logger.info('Max loop exceeded, Exit')
                 break
 
-            sleep_time = max_sleep_time - (time.time() - start_time)
-            if sleep_time > 0:
-                await asyncio.sleep(sleep_time)
+            if wait_keys:
+                timeout = idle_timeout or scheduler.remaining()
+                if timeout > 0:
+                    self.context_version = await self.async_context.wait(
+                        wait_keys, self.context_version, timeout)
+            else:
+                sleep_time = scheduler.remaining()
+                if sleep_time > 0:
+                    await asyncio.sleep(sleep_time)
 
+        await self.drain_blocking()
         if callable(getattr(self, 'shutdown', None)):
             await self.shutdown()
+        self.unsubscribe_inputs()
+        self.release_frame_buffers()
+        self.async_context.close()
 
     async def shutdown(self):
         ''' Free all resource '''
@@ -237,7 +954,9 @@ class AsyncNode(Node):
     def start(cls, context, stop_event, *args, **kwargs):
         self = cls(context, *args, **kwargs)
         if self.loop is None:
-            self.loop = asyncio.get_event_loop()
+            # Node may run in a thread, which has no event loop
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
         self.logger.info('Process %s started!' % self.__class__.__name__)
         self.loop.run_until_complete(self.async_loop(stop_event, *args))
         self.loop.close()
@@ -1,8 +1,8 @@
 from io import BytesIO
+import threading
 import time
-from autorc.nodes import Node
+from autorc.nodes import NO_OUTPUT, Node
 import numpy as np
-from skimage.transform import resize as skresize
 
 '''
     Supported resolution
@@ -16,6 +16,14 @@ from skimage.transform import resize as skresize
 '''
 
 
+def area_bins(size, new_size):
+    ''' (first pixel, pixel count) of each output pixel when averaging size
+        pixels down to new_size
+    '''
+    starts = np.arange(new_size) * size // new_size
+    return starts, np.diff(np.append(starts, size))
+
+
 class BaseWebCam(Node):
     '''
         USB webcam interface, get image from camera and update:
@@ -23,26 +31,42 @@ class BaseWebCam(Node):
             capture_size=(width, height); capture size
             jpeg_size=(width, height): size of jpeg frame
             numpy_size: (height, width) image array for deep learning
+            crop=(x, y, width, height): part of captured frame kept, both
+                outputs are resized from it
+            shared_memory: publish frames via shared memory ring buffer,
+                context only carry a FrameRef. Vehicle disable it when it
+                allow remote nodes (RemoteVehicle) which can not attach it
+        Frames are preprocessed in one pass: cropped, resized once to the
+        largest output, the other output is resized from it. Resized and
+        converted frames are written in buffers reused across frames.
+        Outputs no node demand (no web client, pilot not engaged, not
+        recording) are not produced, frame is not even decoded when none is.
     '''
+    capture_time = None     # Time last frame was captured, start its trace
+    outputs = ('cam/image-jpeg', 'cam/image-np')
 
-    def __init__(self, context,
-                 outputs=('cam/image-jpeg', 'cam/image-np'),
-                 capture_size=(320, 240),
-                 jpeg_size=(160, 120), numpy_size=None,
-                 framerate=20, disable_numpy_stream=False, **kwargs):
+    def __init__(self, context, outputs=None, capture_size=(320, 240),
+                 jpeg_size=(160, 120), numpy_size=None, crop=None,
+                 framerate=20, disable_numpy_stream=False,
+                 shared_memory=True, **kwargs):
+        outputs = outputs or self.outputs
         super(BaseWebCam, self).__init__(
-            context, outputs=outputs,
-            process_rate=framerate, **kwargs)
+            context, outputs=outputs, shared_outputs=outputs,
+            shared_memory=shared_memory, process_rate=framerate, **kwargs)
         self.capture_size = capture_size
         self.jpeg_size = jpeg_size
+        self.crop = crop
+        self.jpeg_key, self.numpy_key = outputs[0], outputs[-1]
         self.disable_numpy_stream = disable_numpy_stream
+        self.preprocess_buffers = {}
+        source_size = crop[2:] if crop else capture_size
         if (isinstance(jpeg_size, (tuple, list)) and
-                (capture_size[0] < jpeg_size[0] or
-                    capture_size[1] < jpeg_size[1])):
+                (source_size[0] < jpeg_size[0] or
+                    source_size[1] < jpeg_size[1])):
             raise Exception('Capture size must larger than jpeg size')
         if (isinstance(numpy_size, (tuple, list)) and
-                (capture_size[0] < numpy_size[1] or
-                    capture_size[1] < numpy_size[0])):
+                (source_size[0] < numpy_size[1] or
+                    source_size[1] < numpy_size[0])):
             raise Exception('Capture size must larger than numpy size')
         if (isinstance(numpy_size, (tuple, list)) and
                 numpy_size[0] > numpy_size[1]):
@@ -54,36 +78,138 @@ class BaseWebCam(Node):
     def get_frame(self):
         raise Exception('Not yet implemented')
 
-    def get_jpeg(self, frame):
+    def encode_jpeg(self, frame):
         raise Exception('Not yet implemented')
 
-    def get_np_array(self, frame):
+    def resize(self, src, dst):
+        ''' Resize src into dst array, return dst '''
         raise Exception('Not yet implemented')
 
+    def convert_color(self, frame):
+        ''' Color conversion of numpy output, as is by default '''
+        return frame
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        ''' Array reused across frames, allocated again if shape changed '''
+        buf = self.preprocess_buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self.preprocess_buffers[name] = np.empty(shape, dtype)
+        return buf
+
+    def skip_frame(self):
+        ''' No output demanded, keep camera from buffering stale frames '''
+        self.get_frame()
+
+    def preprocess(self, frame, jpeg=True, numpy=True):
+        ''' (jpeg frame, numpy frame) of a captured HxWxC frame, frame is
+            None when not asked for or numpy stream is disabled
+        '''
+        if self.crop:
+            x, y, width, height = self.crop
+            frame = frame[y:y + height, x:x + width]
+        shape = frame.shape[:2]
+        sizes = {}
+        if jpeg:
+            sizes['jpeg'] = shape if not self.jpeg_size else (
+                self.jpeg_size[1], self.jpeg_size[0])
+        if numpy and not self.disable_numpy_stream:
+            sizes['numpy'] = tuple(self.numpy_size or shape)
+        frames = {}
+        resized = frame
+        # Largest first, next one is resized from it when it fit
+        for name, size in sorted(sizes.items(),
+                                 key=lambda item: -item[1][0] * item[1][1]):
+            src = resized
+            if src.shape[0] < size[0] or src.shape[1] < size[1]:
+                src = frame
+            if src.shape[:2] != size:
+                src = resized = self.resize(src, self.buffer(
+                    name, size + frame.shape[2:], frame.dtype))
+            frames[name] = src
+        np_frame = frames.get('numpy')
+        if np_frame is not None:
+            np_frame = self.convert_color(np_frame)
+        return frames.get('jpeg'), np_frame
+
     def process_loop(self):
+        jpeg, numpy = self.demanded((self.jpeg_key, self.numpy_key))
+        numpy = numpy and not self.disable_numpy_stream
+        if not (jpeg or numpy):
+            self.skip_frame()
+            return None
         frame = self.get_frame()
         if frame is not None:
-            jpeg = self.get_jpeg(frame)
-            np_array = None
-            if not self.disable_numpy_stream:
-                np_array = self.get_np_array(frame)
-            return jpeg, np_array
+            self.start_trace(self.capture_time)
+            return self.make_outputs(frame, jpeg, numpy)
+
+    def make_outputs(self, frame, jpeg=True, numpy=True):
+        ''' (jpeg bytes, numpy frame) of a captured frame, NO_OUTPUT for
+            outputs not asked for
+        '''
+        jpeg_frame, np_array = self.preprocess(frame, jpeg, numpy)
+        if jpeg_frame is not None:
+            jpeg_frame = self.encode_jpeg(jpeg_frame)
+        return self.output(jpeg_frame), self.output(np_array)
+
+    def output(self, value):
+        if value is None:
+            return NO_OUTPUT
+        if any(value is buf for buf in self.preprocess_buffers.values()) and (
+                self.numpy_key not in (self.shared_outputs or ())):
+            # Not copied to shared memory, buffer is reused next frame
+            return value.copy()
+        return value
 
 
 class CVWebCam(BaseWebCam):
     ''' USB webcam interface using open CV
+        threaded: a capture thread grab() every frame as soon as camera
+            deliver it, driver buffer never hold stale frames. When the loop
+            ask for a frame the thread retrieve() (decode) the newest grab,
+            the frame is at most one camera interval old at request time
+        buffer_size: frames buffered by the driver, None for its default
+        mjpeg: ask camera for MJPG, its jpeg frames are published as they
+            are (at capture_size, jpeg_size is not used), nothing encoded.
+            Frames are decoded only for numpy output
+        decode_scale: 1, 2, 4 or 8, decode mjpeg at 1 / scale of capture
+            size. Default to the smallest still larger than numpy_size
     '''
     cam = None      # open CV cam instance
+    capture_thread = None
+    DECODE_SCALES = (8, 4, 2, 1)
 
     def __init__(self, context, size=(160, 120), framerate=20,
                  capture_device=0, jpeg_quality=90,
-                 use_rgb=True, **kwargs):
+                 use_rgb=True, threaded=True, buffer_size=1, mjpeg=False,
+                 decode_scale=None, **kwargs):
         super(CVWebCam, self).__init__(context, size=size, framerate=framerate,
                                        **kwargs)
         self.use_rgb = use_rgb
         self.framerate = framerate
         self.capture_device = capture_device
         self.jpeg_quality = jpeg_quality
+        self.threaded = threaded
+        self.buffer_size = buffer_size
+        self.mjpeg = mjpeg
+        if decode_scale is None:
+            decode_scale = 1
+            if self.numpy_size and not self.crop:
+                decode_scale = next(
+                    scale for scale in self.DECODE_SCALES
+                    if self.capture_size[0] // scale >= self.numpy_size[1] and
+                    self.capture_size[1] // scale >= self.numpy_size[0])
+        if decode_scale not in self.DECODE_SCALES:
+            raise Exception('Decode scale must be one of %s' % (
+                ', '.join(str(scale) for scale in self.DECODE_SCALES)))
+        if self.crop and decode_scale != 1:
+            raise Exception('Crop is in capture pixels, decode scale must'
+                            ' be 1')
+        self.decode_scale = decode_scale
+        self.frame_lock = threading.Lock()
+        self.frame_ready = threading.Condition(self.frame_lock)
+        self.frame_wanted = False   # Loop wait for a frame
+        self.latest = None      # (frame, capture time) not yet taken
+        self.capture_stop = threading.Event()
 
     def start_up(self):
         import cv2
@@ -92,35 +218,110 @@ class CVWebCam(BaseWebCam):
         if self.capture_size:   # Not working or camera is not supported
             self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_size[0])
             self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_size[1])
+        if self.buffer_size:    # Not supported by every backend
+            self.cam.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+        if self.mjpeg:
+            self.start_mjpeg()
         self.encode_param = (int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality)
         time.sleep(1)   # Camera warm up
+        if self.threaded:
+            self.start_capture()
+
+    def start_mjpeg(self):
+        ''' Ask camera for MJPG, frames are read undecoded '''
+        cv2 = self.cv2
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+        self.cam.set(cv2.CAP_PROP_FOURCC, fourcc)
+        if (int(self.cam.get(cv2.CAP_PROP_FOURCC)) != fourcc or
+                not self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 0)):
+            self.logger.warning('Camera does not deliver MJPG, decode and'
+                                ' encode frames')
+            self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            self.mjpeg = False
+            return
+        self.decode_flag = {
+            1: cv2.IMREAD_COLOR,
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8,
+        }[self.decode_scale]
+
+    def start_capture(self):
+        self.capture_thread = threading.Thread(
+            target=self.capture_loop, name='%s-capture' % self, daemon=True)
+        self.capture_thread.start()
+
+    def capture_loop(self):
+        ''' Grab frames continuously, decode the newest one when wanted '''
+        while not self.capture_stop.is_set():
+            if not self.cam.grab():
+                self.capture_stop.wait(0.01)
+                continue
+            capture_time = time.time()
+            with self.frame_lock:
+                if not self.frame_wanted:
+                    continue
+            ret, frame = self.cam.retrieve()
+            if ret:
+                with self.frame_ready:
+                    self.frame_wanted = False
+                    self.latest = (frame, capture_time)
+                    self.frame_ready.notify()
+
+    def skip_frame(self):
+        if self.capture_thread is None:
+            self.get_frame()
+        # else capture thread keep grabbing, nothing decoded
 
     def get_frame(self):
-        if self.cam:
+        if self.capture_thread is not None:
+            # Newest grab is decoded, wait at most one camera interval
+            with self.frame_ready:
+                self.latest = None
+                self.frame_wanted = True
+                self.frame_ready.wait_for(lambda: self.latest is not None,
+                                          2.0 / self.framerate)
+                latest, self.latest = self.latest, None
+                self.frame_wanted = False
+            if latest is not None:
+                frame, self.capture_time = latest
+                return frame
+        elif self.cam:
             ret, frame = self.cam.read()
+            self.capture_time = time.time()
             return frame
 
-    def get_jpeg(self, frame):
-        if frame is not None:
-            if (self.jpeg_size is not None and
-                    self.jpeg_size != self.capture_size):
-                frame = self.cv2.resize(frame, self.jpeg_size,
-                                        self.cv2.INTER_LINEAR)
-            ret, jpeg = self.cv2.imencode('.jpg', frame, self.encode_param)
-            return jpeg.tostring()
-
-    def get_np_array(self, frame):
-        new_frame = frame
-        if self.numpy_size:
-            # CV resize use col, row (width, height)
-            new_frame = self.cv2.resize(
-                frame, (self.numpy_size[1], self.numpy_size[0]),
-                self.cv2.INTER_LINEAR)
+    def make_outputs(self, frame, jpeg=True, numpy=True):
+        if not self.mjpeg:
+            return super(CVWebCam, self).make_outputs(frame, jpeg, numpy)
+        # Frame is the jpeg sent by camera
+        np_array = None
+        if numpy:
+            decoded = self.cv2.imdecode(frame, self.decode_flag)
+            if decoded is not None:     # Corrupted frame
+                np_array = self.preprocess(decoded, False)[1]
+        return (frame.tobytes() if jpeg else NO_OUTPUT,
+                self.output(np_array))
+
+    def encode_jpeg(self, frame):
+        ret, jpeg = self.cv2.imencode('.jpg', frame, self.encode_param)
+        return jpeg.tobytes()
+
+    def resize(self, src, dst):
+        # CV resize use col, row (width, height)
+        return self.cv2.resize(src, (dst.shape[1], dst.shape[0]), dst=dst,
+                               interpolation=self.cv2.INTER_LINEAR)
+
+    def convert_color(self, frame):
         if self.use_rgb:
-            new_frame = self.cv2.cvtColor(new_frame, self.cv2.COLOR_BGR2RGB)
-        return new_frame
+            return self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2RGB,
+                                     dst=self.buffer('color', frame.shape))
+        return frame
 
     def shutdown(self):
+        if self.capture_thread is not None:
+            self.capture_stop.set()
+            self.capture_thread.join(1.0)   # grab may block on a dead camera
         if self.cam:
             self.cam.release()
 
@@ -128,6 +329,7 @@ class CVWebCam(BaseWebCam):
 class PGWebCam(BaseWebCam):
     '''
         USB webcam interface using Pygame
+        Frames are resized by area averaging in uint8 / uint32 integer math
     '''
     def __init__(self, context, size=(160, 120), framerate=20,
                  capture_device=None, jpeg_quality=90,
@@ -138,6 +340,7 @@ class PGWebCam(BaseWebCam):
         self.framerate = framerate
         self.capture_device = capture_device
         self.jpeg_quality = jpeg_quality
+        self.resize_plans = {}
 
     def start_up(self):
         import pygame
@@ -178,24 +381,38 @@ class PGWebCam(BaseWebCam):
             # image transpose back
             return np.transpose(frame, (1, 0, 2))   # HxWxC
 
-    def get_jpeg(self, frame):
-        if frame is not None:
-            if self.jpeg_size and self.jpeg_size != self.capture_size:
-                frame = skresize(
-                    frame, (self[1], self.jpeg_size[0]),
-                    mode='reflect', anti_aliasing=False)
-            tmpfile = BytesIO()
-            img = self.Image.fromarray(frame)
-            img.save(tmpfile, format='jpeg')
-            return tmpfile.getvalue()
-
-    def get_np_array(self, frame):
-        if self.numpy_size and (
-            self.numpy_size[0] != self.capture_size[1] or
-                self.numpy_size[1] != self.capture_size[0]):
-            # HxWxD
-            return skresize(frame, self.numpy_size, mode='reflect',
-                            anti_aliasing=False)
+    def encode_jpeg(self, frame):
+        tmpfile = BytesIO()
+        img = self.Image.fromarray(frame)
+        img.save(tmpfile, format='jpeg')
+        return tmpfile.getvalue()
+
+    def resize(self, src, dst):
+        # HxWxD, sum pixels of each output pixel area, rows then columns
+        plan = self.resize_plans.get((src.shape, dst.shape))
+        if plan is None:
+            rows, row_counts = area_bins(src.shape[0], dst.shape[0])
+            cols, col_counts = area_bins(src.shape[1], dst.shape[1])
+            counts = np.outer(row_counts, col_counts).astype(np.uint32)
+            counts = counts.reshape(counts.shape + (1, ) * (dst.ndim - 2))
+            plan = self.resize_plans[src.shape, dst.shape] = (
+                rows, cols, counts, counts // 2)
+        rows, cols, counts, half = plan
+        row_sums = self.buffer('rows%s' % (dst.shape, ),
+                               (dst.shape[0], ) + src.shape[1:], np.uint32)
+        sums = self.buffer('sums%s' % (dst.shape, ), dst.shape, np.uint32)
+        np.add.reduceat(src, rows, axis=0, dtype=np.uint32, out=row_sums)
+        np.add.reduceat(row_sums, cols, axis=1, out=sums)
+        sums += half    # Round to nearest
+        sums //= counts
+        np.copyto(dst, sums, casting='unsafe')
+        return dst
+
+    def convert_color(self, frame):
+        if self.use_bgr:
+            dst = self.buffer('color', frame.shape)
+            dst[...] = frame[..., ::-1]
+            return dst
         return frame
 
     def shutdown(self):
@@ -8,13 +8,27 @@ from autorc.picar3.back_wheels import Back_Wheels
 
 
 class Engine(Node):
-    def __init__(self, context, process_rate=60, **kwargs):
-        # Error in process_loop, no output, no run
+    ''' Drive the car from user and pilot commands
+        max_age: budget of inputs, default ignore pilot steering older than
+        150ms from the capture of its frame. The car stops on stale
+        steering, it resumes user throttle on next fresh steering.
+    '''
+    # Error in process_loop, no output, no run
+    inputs = {
+        'on_pilot_steering': 'pilot/steering',
+        'on_user_steering': 'user/steering',
+        'on_user_throttle': 'user/throttle'
+    }
+
+    def __init__(self, context, process_rate=60, max_age=None, **kwargs):
+        if max_age is None:
+            max_age = {'pilot/steering': 0.15}
         super(Engine, self).__init__(context, process_rate=process_rate,
-                                     **kwargs)
+                                     max_age=max_age, **kwargs)
         # Test car
         self.steering = None
         self.throttle = None
+        self.stale = False      # Stopped on stale input
 
     def start_up(self):
         pwm = PCA9685.PWM(bus_number=1)
@@ -28,25 +42,36 @@ class Engine(Node):
         pass
         # TODO shutdown pwm
 
-    def process_loop(self, *args):
-        if self.input_updated(('pilot/steering', )):
-            steering_percent = self.context.get('pilot/steering', 0)
-            steering = range_map(
-                steering_percent, -1, 1, 70, 110, int_only=True)
-            self.fw.turn(steering)
-        if self.input_updated(('user/steering', )):
-            steering_percent = self.context.get('user/steering', 0)
-            steering = range_map(
-                steering_percent, -1, 1, 70, 110, int_only=True)
-            self.fw.turn(steering)
-        if self.input_updated(('user/throttle', )):
-            throttle_percent = self.context.get('user/throttle', 0)
-            throttle = range_map(
-                abs(throttle_percent), 0, 1, 50, 100, int_only=True)
-            self.bw.speed = throttle
-            if throttle_percent > 0:
-                self.bw.forward()
-            elif throttle_percent < 0:
-                self.bw.backward()
-            else:
-                self.bw.stop()
+    def turn(self, steering_percent):
+        steering = range_map(
+            steering_percent, -1, 1, 70, 110, int_only=True)
+        self.fw.turn(steering)
+
+    def on_stale(self, callback, key, age):
+        if not self.stale:
+            self.logger.warning('%s is %.0fms old, stop', key, age * 1000)
+            self.stale = True
+            self.bw.stop()
+
+    def on_pilot_steering(self, steering_percent):
+        self.turn(steering_percent)
+        self.record_trace()
+        if self.stale:
+            self.stale = False
+            if self.throttle:
+                self.on_user_throttle(self.throttle)
+
+    def on_user_steering(self, steering_percent):
+        self.turn(steering_percent)
+
+    def on_user_throttle(self, throttle_percent):
+        self.throttle = throttle_percent
+        throttle = range_map(
+            abs(throttle_percent), 0, 1, 50, 100, int_only=True)
+        self.bw.speed = throttle
+        if throttle_percent > 0:
+            self.bw.forward()
+        elif throttle_percent < 0:
+            self.bw.backward()
+        else:
+            self.bw.stop()
@@ -9,6 +9,8 @@ class MjpegStreamer(AsyncNode):
     ''' Stand alone mjpeg streamer (for testing only) '''
     def __init__(self, context, *, inputs=('cam/image-jpeg', ), host='0.0.0.0',
                  port=8888, frame_rate=24, **kwargs):
+        # Camera encode jpeg only while a client is connected
+        self.lazy_inputs = inputs
         super(MjpegStreamer, self).__init__(context, inputs=inputs, **kwargs)
         if not inputs or len(inputs) < 1:
             raise Exception('Input key (jpeg stream) is required')
@@ -16,6 +18,7 @@ class MjpegStreamer(AsyncNode):
         self.port = port
         self.is_run = True
         self.frame_rate = frame_rate
+        self.clients = 0
 
     async def start_up(self):
         app = web.Application(logger=self.logger)
@@ -47,12 +50,16 @@ class MjpegStreamer(AsyncNode):
                             'boundary=--%s' % boundary,
             'Cache-Control': 'no-cache'
         })
+        self.clients += 1
+        if self.clients == 1:
+            await self.async_context.run(self.set_demand, self.inputs[0])
         try:
             await response.prepare(request)
             max_sleep_time = 1.0 / self.frame_rate
             while self.is_run:
                 start_time = time.time()
-                frame = self.context.get(self.inputs[0])
+                frame = self.resolve(
+                    await self.async_context.get(self.inputs[0]))
                 if frame is not None:
                     try:
                         # Write header
@@ -79,6 +86,10 @@ class MjpegStreamer(AsyncNode):
         except asyncio.CancelledError:
             print('Client connection closed')
         finally:
+            self.clients -= 1
+            if not self.clients:
+                await self.async_context.run(
+                    self.set_demand, self.inputs[0], False)
             if response is not None:
                 await response.write_eof()
         return response
@@ -4,24 +4,36 @@ import numpy as np
 from io import BytesIO
 
 from autorc.nodes import Node
+from autorc.utils import import_string
 
 
 class PilotBase(Node):
+    heartbeat_timeout = 30.0    # First predict build and warm up the model
 
     def __init__(self, context, camera_feed='cam/image-np',
                  outputs=('pilot/throttle', 'pilot/steering'),
                  pilot_on='pilot/engage',
                  **kwargs):
-        inputs = {
-            'process_loop': camera_feed,
-            'on_pilot_enable': pilot_on
-        }
+        inputs, outputs = PilotBase.declare(camera_feed, outputs, pilot_on)
+        # Camera produce frames for the pilot only when it is engaged
+        self.lazy_inputs = (camera_feed, )
         super(PilotBase, self).__init__(
             context, inputs=inputs, outputs=outputs, **kwargs)
+        self.camera_feed = camera_feed
         self.enabled = False
 
+    @classmethod
+    def declare(cls, camera_feed='cam/image-np',
+                outputs=('pilot/throttle', 'pilot/steering'),
+                pilot_on='pilot/engage', **kwargs):
+        return {
+            'process_loop': camera_feed,
+            'on_pilot_enable': pilot_on
+        }, outputs
+
     def on_pilot_enable(self, value):
         self.enabled = value
+        self.set_demand(self.camera_feed, bool(value))
 
     def predict(self, image):
         raise Exception('Not yet implement')
@@ -32,19 +44,33 @@ class PilotBase(Node):
 
 
 class KerasSteeringPilot(PilotBase):
-    ''' Donkey based '''
+    ''' Donkey based
+        preprocess_input: function or its dotted path, path is imported in
+        node process so vehicle does not load keras
+            'keras.applications.mobilenetv2.preprocess_input'
+    '''
     def __init__(self, context, model_path=None,
                  input_shape=(160, 120, 3), preprocess_input=None,
                  prewarm_model=False, camera_feed_jpeg=False, **kwargs):
         super(KerasSteeringPilot, self).__init__(context, **kwargs)
-        from keras.preprocessing.image import load_img, img_to_array
         self.model = None
         self.input_shape = input_shape
         self.model_path = model_path
         self.preprocess_input = preprocess_input
         self.prewarm_model = prewarm_model
         self.camera_feed_jpeg = camera_feed_jpeg
-        self.get_model(model_path)
+
+    @classmethod
+    def declare(cls, *args, **kwargs):
+        # Positional args are this class ones, not PilotBase
+        return super(KerasSteeringPilot, cls).declare(**kwargs)
+
+    def start_up(self):
+        # Load model in node process
+        from keras.preprocessing.image import load_img, img_to_array
+        if isinstance(self.preprocess_input, str):
+            self.preprocess_input = import_string(self.preprocess_input)
+        self.get_model(self.model_path)
         self.load_img = load_img
         self.img_to_array = img_to_array
 
@@ -4,6 +4,7 @@ import json
 import time
 import numpy as np
 
+from autorc.blocking import blocking
 from autorc.nodes import AsyncNode
 from autorc.config import config
 
@@ -15,7 +16,14 @@ class BaseRecorder(AsyncNode):
                  inputs=('cam/image-jpeg', 'user/steering', 'user/throttle'),
                  path=config.TRAINING_SET_ROOT, record_on='training/record',
                  file_format='', session=None, **kwargs):
-        super(BaseRecorder, self).__init__(context, inputs=inputs, **kwargs)
+        # Every frame is recorded, not only the latest one of each loop
+        kwargs.setdefault('delivery', {inputs[0]: 'lossless'})
+        # Camera produce frames to record only while recording
+        self.lazy_inputs = inputs[:1]
+        super(BaseRecorder, self).__init__(context, inputs={
+            'process_loop': inputs,
+            'on_record': record_on
+        }, **kwargs)
         self.path = path
         if not os.path.isdir(self.path):
             os.makedirs(self.path)
@@ -33,18 +41,26 @@ class BaseRecorder(AsyncNode):
             raise Exception('Could not create session. Please check write'
                             ' permission')
         self.record_on = record_on
+        self.recording = False
 
-    async def write(image, steering, throttle):
+    def write(self, image, steering, throttle):
         pass
 
-    async def process_loop(self, image, steering, throttle):
-        if self.context.get(self.record_on) is True:
-            await self.write(image, steering, throttle)
+    async def on_record(self, value):
+        self.recording = value is True
+        await self.async_context.run(
+            self.set_demand, self.lazy_inputs[0], self.recording)
+
+    @blocking(max_pending=None)
+    def process_loop(self, image, steering, throttle):
+        ''' Disk write run in a worker thread, frames wait for it '''
+        if self.recording:
+            self.write(image, steering, throttle)
             self.counter += 1
 
 
 class SimpleRecorder(BaseRecorder):
-    async def write(self, image, steering, throttle):
+    def write(self, image, steering, throttle):
         # TODO calculate file name format here
         # TODO save image as numpy array instead
         file_name = 'frame-%d-%s' % (self.counter, time.time())
@@ -66,7 +82,7 @@ class NPRecorder(BaseRecorder):
                  **kwargs):
         super(NPRecorder, self).__init__(context, inputs=inputs, **kwargs)
 
-    async def write(self, image, steering, throttle):
+    def write(self, image, steering, throttle):
         # TODO calculate file name format here
         # TODO save image as numpy array instead
         file_name = 'frame-%d-%s' % (self.counter, time.time())
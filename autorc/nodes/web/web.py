@@ -42,9 +42,9 @@ class SocketController(object):
         self.app = app
         self.logger = logger or logging.getLogger(__name__)
         if callable(update_context):
-            self.update_context = update_context
+            self.update_context = update_context  # Coroutine function
         else:
-            self.update_context = lambda x: x
+            self.update_context = self.ignore_update
         if self.USERS not in app:
             app[self.USERS] = {}
             logger.debug('Socket started! Waiting for connection')
@@ -56,6 +56,9 @@ class SocketController(object):
             await user['ws'].close(
                 code=1000, message='Server is shutting down')
 
+    async def ignore_update(self, key, value):
+        pass
+
     def user_json(self, user):
         ''' Return filtered user to json encoder '''
         return {k: user[k] for k in ['id', 'name']}
@@ -173,22 +176,22 @@ class SocketController(object):
                 })
             elif action == CONSTANTS.VEHICLE_STEER:
                 steering_percent = data.get('value', 0)
-                self.update_context('user/steering', steering_percent)
+                await self.update_context('user/steering', steering_percent)
             elif action == CONSTANTS.VEHICLE_THROTTLE:
                 throttle_percent = data.get('value', 0)
-                self.update_context('user/throttle', throttle_percent)
+                await self.update_context('user/throttle', throttle_percent)
             elif action == CONSTANTS.TRAINING_RECORD_START:
                 self.logger.info('You are on cam. smile')
-                self.update_context('training/record', True)
+                await self.update_context('training/record', True)
             elif action == CONSTANTS.TRAINING_RECORD_END:
                 self.logger.info('Done')
-                self.update_context('training/record', False)
+                await self.update_context('training/record', False)
             elif action == CONSTANTS.PILOT_ENGAGE_START:
                 self.logger.info('Auto pilot is on')
-                self.update_context('pilot/engage', True)
+                await self.update_context('pilot/engage', True)
             elif action == CONSTANTS.PILOT_ENGAGE_END:
                 self.logger.info('Auto pilot is off')
-                self.update_context('pilot/engage', False)
+                await self.update_context('pilot/engage', False)
 
     async def handler(self, request):
         ws = web.WebSocketResponse(heartbeat=1.0, timeout=1.0, autoping=True,
@@ -222,21 +225,25 @@ class SocketController(object):
 
 
 class WebController(AsyncNode):
+    ''' Web UI, vehicle stats are pushed to clients every tick '''
+    stats_keys = ('pilot/steering', 'pilot/throttle')
+
     def __init__(self, context, *, host='0.0.0.0', port=8080,
                  mjpeg_frame_rate=24, **kwargs):
-        super(WebController, self).__init__(context, inputs={
-            'update_stats': ('pilot/steering', 'pilot/throttle')
-        }, **kwargs)
+        super(WebController, self).__init__(context, **kwargs)
         self.host = host
         self.port = port
         self.mjpeg_frame_rate = mjpeg_frame_rate
 
     def config_router(self, router, app):
         views = StaticViews()
-        sc = SocketController(app, update_context=self.update,
+        sc = SocketController(app, update_context=self.async_update,
                               logger=self.logger)
         self.socket = sc
-        mjpeg = MjpegStreamer(self.context, frame_rate=self.mjpeg_frame_rate)
+        # Stream demands are held under this node's key, so they are
+        # released with the node when it crashes or stops
+        mjpeg = MjpegStreamer(self.context, frame_rate=self.mjpeg_frame_rate,
+                              ready_key=self.ready_key)
         self.sc = sc
         self.mjpeg = mjpeg
         router.add_static('/static/', os.path.join(BASE_DIR, 'static'))
@@ -244,15 +251,26 @@ class WebController(AsyncNode):
         router.add_get('/ws', sc.handler)
         router.add_get('/mjpeg_stream', mjpeg.handler)
 
-    async def update_stats(self, *args):
+    async def process_loop(self):
+        await self.update_stats()
+
+    async def update_stats(self):
+        ''' Broadcast current pilot outputs, read in one snapshot '''
+        if self.async_context.has('snapshot'):
+            values, versions = await self.async_context.snapshot(
+                self.stats_keys)
+        else:
+            values = [await self.async_context.get(key)
+                      for key in self.stats_keys]
+        steering, throttle = values
         try:
             await self.socket.broadcast({
                 'action': CONSTANTS.VEHICLE_STATS_RESPONSE,
                 'vehicle_stats': {
                     'throttle': 0,
                     'steering': 0,
-                    'pilot/throttle': self.context.get('pilot/throttle'),
-                    'pilot/steering': self.context.get('pilot/steering'),
+                    'pilot/throttle': throttle,
+                    'pilot/steering': steering,
                 }
             })
         except Exception:
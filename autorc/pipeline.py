@@ -0,0 +1,172 @@
+''' Fused pipeline, run a linear chain of nodes in a single process
+    camera -> pilot -> engine normally cross the context twice, each node
+    waking up on the previous one output. Fused, every tick of the head node
+    call the next node callback directly with the values it just produced.
+    Outputs are still published to context for other consumers (recorder,
+    web, ...)
+'''
+import time
+import logging
+
+from autorc.nodes import Node, AsyncNode
+
+
+__all__ = (
+    'find_pipelines',
+    'Pipeline',
+)
+
+
+def node_callbacks(node_cls, args, kwargs):
+    ''' {callback name: (inputs, outputs)} of a node, from Node.declare
+        Node is not built, its __init__ (camera, model...) run in its own
+        process only. None if node could not be fused (async)
+    '''
+    if not issubclass(node_cls, Node) or issubclass(node_cls, AsyncNode):
+        return None
+    callbacks = {}
+    for mtype, keys in zip(('inputs', 'outputs'),
+                           node_cls.declare(*args, **kwargs)):
+        if not keys:
+            continue
+        if isinstance(keys, (list, tuple)):
+            keys = {'process_loop': keys}
+        for name, keys in keys.items():
+            if not callable(getattr(node_cls, name, None)):
+                logging.getLogger('Pipeline').debug(
+                    'No %s callback in %s', name, node_cls.__name__)
+                return None
+            if not isinstance(keys, (list, tuple)):
+                keys = (keys, )
+            innout = callbacks.setdefault(name, {})
+            innout[mtype] = tuple(keys)
+    return {name: (innout.get('inputs', ()), innout.get('outputs', ()))
+            for name, innout in callbacks.items()}
+
+
+def find_pipelines(nodes):
+    ''' Linear chains in node graph
+        nodes: [(node_cls, args, kwargs, options)] as in Vehicle.nodes
+        Node B follow node A when all inputs of one of B callbacks are
+        outputs of A. The link is fused only when A has no other follower
+        and B no other leader.
+        Return [[(node index, fused callback names)]], each chain has at
+        least 2 nodes. Fused callback names of the head node is empty.
+    '''
+    callbacks = [node_callbacks(node_cls, args, kwargs)
+                 for node_cls, args, kwargs, options in nodes]
+    followers = {}
+    leaders = {}
+    for a, a_callbacks in enumerate(callbacks):
+        if not a_callbacks:
+            continue
+        produced = set()
+        for inputs, outputs in a_callbacks.values():
+            produced.update(outputs)
+        for b, b_callbacks in enumerate(callbacks):
+            if b == a or not b_callbacks:
+                continue
+            fused = tuple(
+                name for name, (inputs, outputs) in b_callbacks.items()
+                if inputs and produced.issuperset(inputs)
+            )
+            if fused:
+                followers.setdefault(a, {})[b] = fused
+                leaders.setdefault(b, set()).add(a)
+
+    def next_node(a):
+        if len(followers.get(a, ())) != 1:
+            return None
+        b, fused = next(iter(followers[a].items()))
+        if len(leaders[b]) != 1:
+            return None
+        return b, fused
+
+    fused_nodes = {link[0] for link in map(next_node, followers) if link}
+    pipelines = []
+    for head in range(len(nodes)):
+        if head in fused_nodes:
+            continue    # Not a head, fused with its leader
+        chain = [(head, ())]
+        link = next_node(head)
+        while link is not None and link[0] != head:
+            chain.append(link)
+            link = next_node(link[0])
+        if len(chain) > 1:
+            pipelines.append(chain)
+    return pipelines
+
+
+class Pipeline(object):
+    ''' Nodes of a fused chain, ticked by head node process rate
+        stages: [(node_cls, args, kwargs, fused callback names)]
+    '''
+    def __init__(self, context, stages, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.stages = []
+        for node_cls, args, kwargs, fused in stages:
+            node = node_cls(context, *args, **kwargs)
+            fused = {getattr(node, name) for name in fused}
+            self.stages.append((node, node.get_mapper(), fused))
+
+    def __repr__(self):
+        return ' -> '.join(repr(node) for node, mapper, fused in self.stages)
+
+    @classmethod
+    def start(cls, context, stop_event, stages):
+        self = cls(context, stages)
+        self.logger.info('Pipeline %s started!', self)
+        for node, mapper, fused in self.stages:
+            node.start_up()
+            node.subscribe_inputs()
+            node.signal_ready()
+        head = self.stages[0][0]
+        loop_count = 0
+        max_sleep_time = 1.0 / head.process_rate
+        # Callback read from context wake up the pipeline
+        wait_keys, idle_timeout = head.prepare_wait(tuple(
+            entry for node, mapper, fused in self.stages
+            for entry in mapper if entry[0] not in fused
+        ))
+        scheduler = head.make_scheduler(wait_keys, idle_timeout)
+        while not stop_event.is_set():
+            start_time = time.time()
+            heartbeat = head.heartbeat(start_time)
+            if heartbeat:
+                head.context.update(heartbeat)
+            due = scheduler is None or scheduler.due()
+            produced = {}
+            pending = []
+            for node, mapper, fused in self.stages:
+                outputs = {}
+                produced.update(node.run_callbacks(
+                    mapper, fused, produced, outputs, timer=due))
+                pending.append((node, outputs))
+            # Publish once the chain is done, context is not in the way
+            for node, outputs in pending:
+                if outputs:
+                    node.updates(outputs)
+                if node.metrics is not None:
+                    node.record_loop(start_time, max_sleep_time)
+            if scheduler is not None and due:
+                head.tick_done(scheduler)
+
+            loop_count += 1
+
+            if head.max_loop and head.max_loop <= loop_count:
+                self.logger.info('Max loop exceeded, Exit')
+                break
+
+            if wait_keys:
+                timeout = idle_timeout or scheduler.remaining()
+                if timeout > 0:
+                    head.wait_inputs(wait_keys, timeout)
+            else:
+                sleep_time = scheduler.remaining()
+                if sleep_time > 0:
+                    stop_event.wait(sleep_time)
+
+        for node, mapper, fused in self.stages:
+            node.shutdown()
+            node.unsubscribe_inputs()
+            node.release_frame_buffers()
@@ -0,0 +1,103 @@
+''' CPU placement of node workers
+    Vehicle.add_node(node_cls, cpus={2, 3}, nice=-5, sched='fifo') apply
+    these in the node process (or thread) before the node is created:
+        cpus: CPU set the worker may run on (os.sched_setaffinity)
+        nice: niceness, negative values need root or CAP_SYS_NICE
+        sched: scheduling policy, other, batch, idle, fifo or rr. fifo / rr
+            are real-time, they preempt every normal process.
+        priority: real-time priority (1-99) of fifo / rr, default 10
+        threads: max threads of OpenCV / TensorFlow / BLAS pools, default
+            to the number of cpus. Process wide, not applied to threads.
+    Linux apply affinity, niceness and policy per thread so thread mode
+    nodes are placed too. Settings not permitted are logged and skipped,
+    the node still run.
+'''
+import logging
+import os
+import sys
+
+
+__all__ = (
+    'SCHED_POLICIES',
+    'apply_placement',
+    'run_placed',
+)
+
+
+SCHED_POLICIES = {
+    'other': 'SCHED_OTHER',
+    'batch': 'SCHED_BATCH',
+    'idle': 'SCHED_IDLE',
+    'fifo': 'SCHED_FIFO',
+    'rr': 'SCHED_RR',
+}
+REALTIME_POLICIES = ('fifo', 'rr')
+# Read by OpenMP, BLAS and TensorFlow when their thread pools start
+THREAD_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+              'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS')
+
+
+def cap_threads(threads):
+    for name in THREAD_ENV:
+        os.environ[name] = str(threads)
+    # Libraries already loaded by node module, never import them here
+    cv2 = sys.modules.get('cv2')
+    if cv2 is not None:
+        cv2.setNumThreads(threads)
+    tf = sys.modules.get('tensorflow')
+    if tf is not None:
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(threads)
+        except (AttributeError, RuntimeError):
+            # TF 1.x or pools already created, env vars are too late
+            pass
+
+
+def apply_placement(cpus=None, nice=None, sched=None, priority=None,
+                    threads=None, thread_mode=False, logger=None):
+    ''' Place the calling worker, return the settings which were applied '''
+    logger = logger or logging.getLogger('placement')
+    applied = {}
+    if cpus is not None:
+        try:
+            os.sched_setaffinity(0, cpus)
+            applied['cpus'] = os.sched_getaffinity(0)
+        except (OSError, AttributeError) as ex:
+            logger.warning('Could not pin to cpus %s: %s', cpus, ex)
+    if sched is not None:
+        if sched not in SCHED_POLICIES:
+            raise Exception('Unknown sched policy %s, available: %s' % (
+                sched, ', '.join(SCHED_POLICIES)))
+        if priority is None:
+            priority = 10 if sched in REALTIME_POLICIES else 0
+        try:
+            os.sched_setscheduler(0, getattr(os, SCHED_POLICIES[sched]),
+                                  os.sched_param(priority))
+            applied['sched'] = sched
+        except (OSError, AttributeError) as ex:
+            logger.warning('Could not set %s scheduling: %s', sched, ex)
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+            applied['nice'] = os.getpriority(os.PRIO_PROCESS, 0)
+        except OSError as ex:
+            logger.warning('Could not set nice %s: %s', nice, ex)
+    if threads is None and cpus is not None:
+        threads = len(cpus)
+    if threads is not None:
+        if thread_mode:
+            logger.warning('Thread pools are process wide, threads=%s is '
+                           'ignored in thread mode', threads)
+        else:
+            cap_threads(threads)
+            applied['threads'] = threads
+    return applied
+
+
+def run_placed(target, placement, thread_mode, *args, **kwargs):
+    ''' Worker target: apply placement then run target (node start) '''
+    applied = apply_placement(thread_mode=thread_mode, **placement)
+    logging.getLogger('placement').info('Placed %s: %s', getattr(
+        target, '__qualname__', target), applied)
+    return target(*args, **kwargs)
@@ -6,7 +6,6 @@ from autorc.nodes.engine import Engine
 from autorc.nodes.web import WebController
 from autorc.nodes.recorder import SimpleRecorder
 from autorc.nodes.pilot import KerasSteeringPilot
-from keras.applications import mobilenetv2
 
 
 vehicle = Vehicle()
@@ -17,6 +16,6 @@ vehicle.add_node(Engine)
 vehicle.add_node(SimpleRecorder)
 vehicle.add_node(
     KerasSteeringPilot,
-    preprocess_input=mobilenetv2.preprocess_input,
+    preprocess_input='keras.applications.mobilenetv2.preprocess_input',
     input_shape=(160, 160, 3),
     model_path=os.path.join(config.MODELS_ROOT, 'mobilenetv2.mdl'))
@@ -0,0 +1,118 @@
+''' Fixed rate scheduler for node loops
+    Deadlines are absolute on time.monotonic, no drift and not affected by
+    wall clock jumps (NTP). When a tick take longer than its period:
+        skip: missed ticks are dropped, next tick stay on the rate grid
+        catchup: missed ticks are run back to back until back on schedule
+            (at most max_catchup of them, older ones are skipped)
+        asap: next tick run right away, grid restart from there
+    adaptive: lower rate (down to min_rate) when ticks use most of their
+    period, CPU can not keep up. Rate goes back up when they are short
+    again.
+    lateness: how long after its deadline the last tick started, the
+    scheduling jitter of the loop.
+'''
+import time
+
+
+__all__ = (
+    'RateScheduler',
+    'POLICIES',
+)
+
+
+POLICIES = ('skip', 'catchup', 'asap')
+
+
+class RateScheduler(object):
+    ''' Tell a loop when its next tick is due
+        scheduler.start()
+        while running:
+            if scheduler.due():
+                tick()
+                scheduler.done()
+            sleep(scheduler.remaining())
+    '''
+    max_catchup = 5         # Missed ticks run by catchup policy
+    busy_high = 0.9         # Slow down when ticks use this part of period
+    busy_low = 0.5          # Speed up when they use less than this
+    adapt_interval = 1.0    # Min seconds between two rate changes
+    smoothing = 0.2         # Weight of last tick in busy ratio average
+
+    def __init__(self, rate, policy='skip', adaptive=False, min_rate=1):
+        if policy not in POLICIES:
+            raise Exception('Unknown overrun policy %s, available: %s' % (
+                policy, ', '.join(POLICIES)))
+        self.target_rate = rate
+        self.policy = policy
+        self.adaptive = adaptive
+        self.min_rate = min(min_rate, rate)
+        self.set_rate(rate)
+        self.next_tick = None
+        self.tick_start = None
+        self.lateness = 0.0
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.busy = 0.0
+        self.last_adapt = 0.0
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.period = 1.0 / rate
+
+    def start(self, now=None):
+        ''' First tick is due right away '''
+        self.next_tick = now or time.monotonic()
+
+    def due(self, now=None):
+        ''' True when a tick should run now '''
+        now = now or time.monotonic()
+        if now >= self.next_tick:
+            self.tick_start = now
+            self.lateness = now - self.next_tick
+            return True
+        return False
+
+    def remaining(self, now=None):
+        ''' Seconds until next tick, 0 if it is due '''
+        return max(self.next_tick - (now or time.monotonic()), 0)
+
+    def done(self, now=None):
+        ''' Tick finished, schedule the next one '''
+        now = now or time.monotonic()
+        self.ticks += 1
+        if self.adaptive:
+            self.adapt(now)
+        next_tick = self.next_tick + self.period
+        if next_tick > now:
+            self.next_tick = next_tick
+            return
+        self.overruns += 1
+        missed = int((now - next_tick) / self.period)
+        if self.policy == 'catchup':
+            dropped = missed + 1 - self.max_catchup
+            if dropped > 0:
+                next_tick += dropped * self.period
+                self.skipped += dropped
+            self.next_tick = next_tick
+        elif self.policy == 'asap':
+            self.next_tick = now
+        else:
+            self.next_tick = next_tick + (missed + 1) * self.period
+            self.skipped += missed + 1
+
+    def adapt(self, now):
+        busy = (now - self.tick_start) / self.period
+        self.busy += (busy - self.busy) * self.smoothing
+        if now - self.last_adapt < self.adapt_interval:
+            return
+        rate = self.rate
+        if self.busy > self.busy_high and rate > self.min_rate:
+            rate = max(self.min_rate, rate * 0.8)
+        elif self.busy < self.busy_low and rate < self.target_rate:
+            rate = min(self.target_rate, rate * 1.25)
+        if rate != self.rate:
+            # Keep deadline of current tick, apply new period from it
+            self.busy *= rate / self.rate
+            self.set_rate(rate)
+            self.last_adapt = now
@@ -0,0 +1,87 @@
+''' Startup profiler of vehicle profiles, see manage.py profile-startup
+    import_times: import time of every module a profile pull in, measured
+        by python -X importtime in a fresh interpreter (nothing cached)
+    node_times: __init__ and start_up time of each node of a vehicle, run
+        one by one in this process with their own Context
+'''
+import asyncio
+import re
+import subprocess
+import sys
+import time
+
+from autorc.context import Context
+
+
+__all__ = (
+    'import_times',
+    'node_times',
+)
+
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+def import_times(module):
+    ''' Import module in a new interpreter
+        Return ([(module, self seconds, cumulative seconds, depth)] in
+        import order, error message or None)
+    '''
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    times = []
+    error = []
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            times.append((name, int(own) / 1e6, int(cumulative) / 1e6,
+                          len(indent) // 2))
+        elif not line.startswith('import time:'):
+            error.append(line)
+    if process.returncode:
+        return times, error[-1] if error else 'exit code %d' % (
+            process.returncode)
+    return times, None
+
+
+def run(ret, loop):
+    ''' Wait for coroutine of async nodes '''
+    if asyncio.iscoroutine(ret):
+        return loop.run_until_complete(ret)
+    return ret
+
+
+def node_times(vehicle):
+    ''' [{'node', 'init', 'start_up', 'error'}] of vehicle nodes, times in
+        seconds, None when the step failed or was not reached
+    '''
+    results = []
+    for node_cls, args, kwargs, options in vehicle.nodes:
+        result = {'node': node_cls.__name__, 'init': None, 'start_up': None,
+                  'error': None}
+        results.append(result)
+        # start_up and shutdown of async nodes share one loop, resources
+        # (aiohttp sessions...) are bound to the loop they were made in
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            start_time = time.perf_counter()
+            node = node_cls(Context(), *args, **kwargs)
+            result['init'] = time.perf_counter() - start_time
+            if getattr(node, 'loop', False) is None:
+                node.loop = loop
+            start_time = time.perf_counter()
+            run(node.start_up(), loop)
+            result['start_up'] = time.perf_counter() - start_time
+            if callable(getattr(node, 'shutdown', None)):
+                run(node.shutdown(), loop)
+            node.release_frame_buffers()
+        except Exception as ex:
+            result['error'] = '%s: %s' % (ex.__class__.__name__, ex)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+    return results
@@ -0,0 +1,187 @@
+''' Node supervision
+    Every node loop write heartbeat/<vehicle>/<node> (heartbeat_interval). The
+    vehicle main loop call Supervisor.check() which find nodes that are:
+        dead: process exited with an error (crash, exception in a callback)
+        stopped: exited cleanly (max_loop reached...), not restarted
+        hung: no heartbeat for heartbeat_timeout, or not ready after
+            start_timeout (stuck in start_up)
+    Failed nodes are terminated if needed, their input queues and demands
+    are dropped from context and they are restarted after a backoff doubling
+    on each failure (backoff, 2 * backoff... up to max_backoff). Stopped nodes
+    have their queues and demands dropped too.
+    After max_restarts failures in a row the node is given up (failed). A
+    node running longer than max_backoff reset the count. Threads can be
+    restarted once dead but not stopped, a hung thread is reported once and
+    marked failed. Health of every node is published to
+    health/<vehicle>/<node>:
+        state: starting, ok, restarting, failed or stopped
+        restarts: restarts so far
+        heartbeat_age: seconds since last heartbeat
+        recovery_time: seconds from last failure detected to node ready
+'''
+import threading
+import time
+
+
+__all__ = (
+    'NodeWorker',
+    'Supervisor',
+)
+
+
+class NodeWorker(object):
+    ''' A node process or thread of the vehicle, which can be started again
+        target(*args, **kwargs) is run by the process / thread
+    '''
+    def __init__(self, name, mode, target, args, kwargs, shutdown_timeout,
+                 heartbeat_timeout, heartbeat_key=None, ready_keys=()):
+        self.name = name
+        self.mode = mode
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.shutdown_timeout = shutdown_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_key = heartbeat_key
+        self.ready_keys = ready_keys
+        self.worker = None
+        self.start_time = None
+        self.state = 'starting'
+        self.restarts = 0           # Failures in a row
+        self.failed_at = None       # Time last failure was detected
+        self.next_restart = None
+        self.recovery_time = None
+        self.error = None           # Exception which ended the thread
+
+    def __repr__(self):
+        return self.name
+
+    def run_thread(self):
+        try:
+            self.target(*self.args, **self.kwargs)
+        except BaseException as ex:
+            self.error = ex
+            raise
+
+    def start(self, mp_context):
+        self.error = None
+        if self.mode == 'thread':
+            worker = threading.Thread(target=self.run_thread, name=self.name)
+        else:
+            worker = mp_context.Process(target=self.target, name=self.name,
+                                        args=self.args, kwargs=self.kwargs)
+        worker.daemon = True
+        self.start_time = time.time()
+        worker.start()
+        self.worker = worker
+        return worker
+
+    def is_alive(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    @property
+    def exitcode(self):
+        ''' Exit code of the process, a thread exit with 1 if it raised
+            None while running
+        '''
+        if self.worker is None or self.worker.is_alive():
+            return None
+        if self.mode == 'thread':
+            return 0 if self.error is None else 1
+        return self.worker.exitcode
+
+
+class Supervisor(object):
+    ''' Detect dead or hung nodes of a vehicle, restart them with backoff '''
+    def __init__(self, vehicle, start_timeout=30, max_restarts=5,
+                 backoff=0.5, max_backoff=30, logger=None):
+        self.vehicle = vehicle
+        self.start_timeout = start_timeout
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logger or vehicle.logger
+
+    def check(self, now=None):
+        ''' Check every node, restart failed ones, publish their health
+            Return {node name: health}
+        '''
+        now = now or time.time()
+        context = self.vehicle.context
+        health = {}
+        for worker in self.vehicle.workers:
+            heartbeat = None
+            if worker.heartbeat_key:
+                heartbeat = context.get(worker.heartbeat_key)
+            self.check_worker(worker, heartbeat, now)
+            health['health/%s/%s' % (self.vehicle.name, worker)] = {
+                'state': worker.state,
+                'restarts': worker.restarts,
+                'heartbeat_age': None if heartbeat is None
+                else now - heartbeat,
+                'recovery_time': worker.recovery_time,
+            }
+        if health:
+            context.update(health)
+        return health
+
+    def check_worker(self, worker, heartbeat, now):
+        if worker.state in ('failed', 'stopped'):
+            return
+        if worker.state == 'restarting':
+            if now >= worker.next_restart:
+                self.restart(worker)
+            return
+        if not worker.is_alive():
+            if worker.exitcode == 0:
+                worker.state = 'stopped'
+                self.vehicle.release_worker(worker)
+                self.logger.info('%s stopped', worker)
+                return
+            return self.fail(worker, now, 'died (exit code %s)' % (
+                worker.exitcode))
+        if heartbeat is None or heartbeat < worker.start_time:
+            # Not looping yet, still in start_up
+            if now - worker.start_time > self.start_timeout:
+                return self.fail(worker, now, 'not ready after %.1fs' % (
+                    now - worker.start_time))
+            return
+        if now - heartbeat > worker.heartbeat_timeout:
+            return self.fail(worker, now, 'hung, no heartbeat for %.1fs' % (
+                now - heartbeat))
+        if worker.state == 'starting':
+            worker.state = 'ok'
+            if worker.failed_at is not None:
+                worker.recovery_time = heartbeat - worker.failed_at
+                worker.failed_at = None
+                self.logger.info('%s recovered in %.2fs', worker,
+                                 worker.recovery_time)
+        elif worker.restarts and now - worker.start_time > self.max_backoff:
+            worker.restarts = 0     # Stable again
+
+    def fail(self, worker, now, reason):
+        if worker.failed_at is None:
+            worker.failed_at = now
+        if worker.is_alive():
+            if isinstance(worker.worker, threading.Thread):
+                worker.state = 'failed'
+                self.logger.error('%s %s, threads can not be restarted',
+                                  worker, reason)
+                return
+            self.vehicle.stop_worker(worker.worker)
+        # Producers stop serving it until it is running again
+        self.vehicle.release_worker(worker)
+        if worker.restarts >= self.max_restarts:
+            worker.state = 'failed'
+            self.logger.error('%s %s, gave up after %d restarts', worker,
+                              reason, worker.restarts)
+            return
+        delay = min(self.backoff * 2 ** worker.restarts, self.max_backoff)
+        worker.state = 'restarting'
+        worker.next_restart = now + delay
+        self.logger.error('%s %s, restart in %.1fs', worker, reason, delay)
+
+    def restart(self, worker):
+        worker.restarts += 1
+        worker.state = 'starting'
+        self.vehicle.restart_worker(worker)
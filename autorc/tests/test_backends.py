@@ -0,0 +1,225 @@
+import unittest
+import threading
+import time
+from multiprocessing import Process, Event
+
+from autorc.backends import (
+    ManagerBackend, SharedMemoryBackend, RedisBackend, get_backend
+)
+from autorc.backends.resp import RespConnection
+from autorc.nodes import Node
+from autorc.vehicle import VehicleManager
+
+
+class FakeVehicle(object):
+    name = 'TestVehicle'
+    allow_remote = False
+    address = '127.0.0.1'
+    authkey = b'test'
+
+
+class EchoNode(Node):
+    def __init__(self, context):
+        super(EchoNode, self).__init__(context, inputs={
+            'on_key1_change': 'key1'
+        }, outputs={
+            'on_key1_change': 'test_result_key1'
+        })
+
+    def on_key1_change(self, key1):
+        return key1 + 1
+
+
+class ManagerBackendTestCase(unittest.TestCase):
+    def create_backend(self):
+        return ManagerBackend()
+
+    def run(self, result=None):
+        with VehicleManager() as manager:
+            vehicle = FakeVehicle()
+            vehicle.manager = manager
+            self.backend = self.create_backend()
+            self.context = self.backend.start(vehicle)
+            try:
+                super(ManagerBackendTestCase, self).run(result)
+            finally:
+                self.backend.shutdown()
+
+    def test_dict(self):
+        context = self.context
+        self.assertEqual(context.get('vehicle_name'), 'TestVehicle')
+        context['key1'] = 1
+        context.update({'key2': (1, 2), 'key3': None})
+        self.assertEqual(context['key1'], 1)
+        self.assertEqual(context.get('key2'), (1, 2))
+        self.assertEqual('key3' in context, True)
+        self.assertEqual(context.get('key3', 5), None)
+        self.assertEqual('key4' in context, False)
+        self.assertEqual(context.get('key4', 5), 5)
+        self.assertEqual(set(context.keys()),
+                         {'vehicle_name', 'key1', 'key2', 'key3'})
+        del context['key1']
+        self.assertEqual('key1' in context, False)
+        with self.assertRaises(KeyError):
+            context['key1']
+
+    def test_snapshot(self):
+        context = self.context
+        context.update({'key1': 1, 'key1__timestamp': 10})
+        context.update({'key2': 2, 'key2__timestamp': 20})
+        version1 = context.version('key1')
+        version2 = context.version('key2')
+        self.assertTrue(version2 > version1 > 0)
+        self.assertEqual(context.snapshot(('key1', 'key2')),
+                         ([1, 2], [version1, version2]))
+        self.assertEqual(context.snapshot(('key1', 'key2'),
+                                          (0, version2)), None)
+        self.assertEqual(context.snapshot(('key1', 'key3'), (0, 0)), None)
+        self.assertEqual(context.timestamp('key2'), 20)
+        context['key1__trace'] = 'trace'
+        self.assertEqual(context.snapshot(('key1', ), (0, ), ('key1__trace',
+                                                              'key3')),
+                         ([1, 'trace', None], [version1]))
+
+    def test_changed_since(self):
+        context = self.context
+        context.update({'key1': 1})
+        since = context.version()
+        context.update({'key2': 2, 'key3': 3})
+        version = context.version()
+        self.assertEqual(context.changed_since(since),
+                         {'key2': version, 'key3': version})
+        self.assertEqual(context.changed_since(since, ('key1', 'key2')),
+                         {'key2': version})
+        del context['key3']
+        self.assertEqual(context.changed_since(since), {'key2': version})
+
+    def test_version_wait(self):
+        context = self.context
+        since = context.version()
+        self.assertEqual(context.wait(('key1', ), since, 0.1), since)
+        timer = threading.Timer(0.1, context.update, ({'key1': 1}, ))
+        timer.start()
+        start_time = time.time()
+        version = context.wait(('key1', ), since, 5)
+        self.assertEqual(time.time() - start_time < 1, True)
+        self.assertEqual(version > since, True)
+        self.assertEqual(context.version('key1'), version)
+        self.assertEqual(context.wait(('key1', ), since, 5), version)
+        timer.join()
+
+    def test_concurrent_writes(self):
+        # Key version never go backward, last write of key is the newest
+        def write():
+            for i in range(100):
+                self.context.update({'key1': i})
+        writers = [threading.Thread(target=write) for i in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(self.context.version('key1'), self.context.version())
+
+    def test_node(self):
+        stop_event = Event()
+        p = Process(target=EchoNode.start, args=(self.context, stop_event))
+        p.daemon = True
+        p.start()
+        time.sleep(0.5)
+        self.context.update({'key1': 1, 'key1__timestamp': time.time()})
+        time.sleep(0.3)
+        self.assertEqual(self.context.get('test_result_key1'), 2)
+        stop_event.set()
+        p.join()
+
+
+class SharedMemoryBackendTestCase(ManagerBackendTestCase):
+    def create_backend(self):
+        return SharedMemoryBackend(capacity=64, value_size=1024)
+
+    def test_value_size(self):
+        with self.assertRaises(ValueError):
+            self.context['key1'] = b'0' * 2048
+
+    def test_atomic_snapshot(self):
+        # Keys written together are never read half updated
+        stop = threading.Event()
+
+        def write():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                self.context.update({'key1': i, 'key2': i})
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for i in range(2000):
+                values, versions = self.context.snapshot(('key1', 'key2'))
+                self.assertEqual(values[0], values[1])
+        finally:
+            stop.set()
+            writer.join()
+
+
+class RedisBackendTestCase(ManagerBackendTestCase):
+    def create_backend(self):
+        return RedisBackend(port=0, serve=True)
+
+    def test_transaction(self):
+        connection = RespConnection('127.0.0.1', self.backend.port)
+        other = RespConnection('127.0.0.1', self.backend.port)
+        # Dropped when a watched key changed
+        connection.execute(('WATCH', 'key'))
+        other.execute(('SET', 'key', 'other'))
+        self.assertEqual(connection.execute(
+            ('MULTI', ), ('SET', 'key', 'mine'), ('EXEC', )),
+            [b'OK', b'QUEUED', None])
+        self.assertEqual(other.execute(('GET', 'key')), [b'other'])
+        connection.execute(('WATCH', 'key'))
+        self.assertEqual(connection.execute(
+            ('MULTI', ), ('SET', 'key', 'mine'), ('INCR', 'count'),
+            ('EXEC', ))[-1], [b'OK', 1])
+        self.assertEqual(other.execute(('GET', 'key')), [b'mine'])
+        connection.close()
+        other.close()
+
+
+class CompactSharedMemoryTestCase(SharedMemoryBackendTestCase):
+    def create_backend(self):
+        return SharedMemoryBackend(capacity=64, value_size=1024,
+                                   codec='compact')
+
+
+class CompactRedisTestCase(ManagerBackendTestCase):
+    def create_backend(self):
+        return RedisBackend(port=0, serve=True, codec='compact')
+
+
+class LocalManagerBackendTestCase(unittest.TestCase):
+    def test_remote_address(self):
+        # Remote vehicles are handed a proxy they can connect to
+        vehicle = FakeVehicle()
+        for allow_remote in (False, True):
+            vehicle.allow_remote = allow_remote
+            backend = ManagerBackend()
+            context = backend.start(vehicle, local=True)
+            try:
+                context['key1'] = 1
+                self.assertEqual(backend.local_context['key1'], 1)
+                self.assertEqual(isinstance(context._token.address, tuple),
+                                 allow_remote)
+            finally:
+                backend.shutdown()
+
+
+class GetBackendTestCase(unittest.TestCase):
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend('manager'), ManagerBackend)
+        backend = SharedMemoryBackend()
+        self.assertIs(get_backend(backend), backend)
+        with self.assertRaises(Exception):
+            get_backend('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import asyncio
+import threading
+import time
+
+from autorc.blocking import blocking, BlockingRunner
+from autorc.context import Context
+from autorc.nodes import AsyncNode
+
+
+class SlowWriterNode(AsyncNode):
+    ''' Blocking callback much slower than the loop '''
+    def __init__(self, context, **kwargs):
+        super(SlowWriterNode, self).__init__(context, inputs={
+            'write': 'key1'
+        }, outputs={
+            'write': 'written',
+            'process_loop': 'counter'
+        }, process_rate=50, **kwargs)
+        self.counter = 0
+        self.writes = []
+
+    @blocking
+    def write(self, value):
+        time.sleep(0.2)
+        self.writes.append(value)
+        return value
+
+    async def process_loop(self):
+        self.counter += 1
+        return self.counter
+
+
+class BlockingRunnerTestCase(unittest.TestCase):
+    def test_drop_oldest(self):
+        runner = BlockingRunner('test', workers=1, max_pending=1)
+        futures = [runner.submit(time.sleep, (0.1, )) for i in range(4)]
+        # First one running, 2nd and 3rd replaced by newer calls
+        self.assertEqual([future.cancelled() for future in futures],
+                         [False, True, True, False])
+        self.assertEqual(runner.dropped, 2)
+        futures[3].result()
+        runner.executor.shutdown()
+
+    def test_decorator(self):
+        def func():
+            pass
+        self.assertEqual(blocking(func).blocking,
+                         {'workers': 1, 'max_pending': 1})
+        self.assertEqual(blocking(max_pending=3)(func).blocking['max_pending'],
+                         3)
+
+
+class BlockingNodeTestCase(unittest.TestCase):
+    def test_loop_not_delayed(self):
+        context = Context()
+        stop_event = threading.Event()
+        node = SlowWriterNode(context)
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(node.async_loop(stop_event))
+            loop.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            for i in range(10):
+                context.update({'key1': i, 'key1__timestamp': time.time()})
+                time.sleep(0.05)
+            time.sleep(0.5)
+        finally:
+            stop_event.set()
+            thread.join()
+        # 1s at 50Hz, loop kept its rate while writes took 0.2s each
+        self.assertTrue(context.get('counter') > 35)
+        self.assertEqual(context.get('written'), 9)
+        self.assertEqual(node.writes[-1], 9)
+        self.assertTrue(node.runners[node.write].dropped > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 import unittest
+import time
+import numpy as np
 from multiprocessing import Process, Manager, Event
 from io import BytesIO
 
-from autorc.nodes import Node
-from autorc.nodes.camera import CVWebCam, PGWebCam
+from autorc.context import Context
+from autorc.nodes import NO_OUTPUT, Node
+from autorc.nodes.camera import BaseWebCam, CVWebCam, PGWebCam
 
 try:
     import pygame
@@ -79,6 +82,173 @@ class CVNodeTestCase(unittest.TestCase):
             )
 
 
+class FakeCapture(object):
+    ''' VideoCapture delivering numbered frames at 100 fps '''
+    def __init__(self):
+        self.grabbed = 0
+        self.retrieved = 0
+
+    def grab(self):
+        time.sleep(0.01)
+        self.grabbed += 1
+        return True
+
+    def retrieve(self):
+        self.retrieved += 1
+        return True, self.grabbed
+
+    def release(self):
+        pass
+
+
+class CVCaptureTestCase(unittest.TestCase):
+    def test_latest_frame(self):
+        camera = CVWebCam(Context())
+        camera.cam = FakeCapture()
+        camera.start_capture()
+        time.sleep(0.03)
+        # Frames are the newest grabbed when asked, one interval old at most
+        frames = []
+        for i in range(5):
+            start_time = time.time()
+            frame = camera.get_frame()
+            self.assertTrue(time.time() - start_time < 0.02)
+            self.assertTrue(start_time - camera.capture_time < 0.015)
+            frames.append(frame)
+            time.sleep(0.05)
+        camera.shutdown()
+        self.assertFalse(camera.capture_thread.is_alive())
+        self.assertEqual(camera.get_frame(), None)  # Nothing grabbed
+        self.assertEqual(frames, sorted(set(frames)))
+        # Only frames taken by the loop were decoded
+        self.assertEqual(camera.cam.retrieved, 5)
+        self.assertTrue(camera.cam.grabbed > 20)
+
+
+class ArrayCam(BaseWebCam):
+    ''' Nearest neighbour resize, record resizes '''
+    def __init__(self, context, **kwargs):
+        super(ArrayCam, self).__init__(context, **kwargs)
+        self.resizes = []
+
+    def resize(self, src, dst):
+        self.resizes.append((src.shape[:2], dst.shape[:2]))
+        rows = np.arange(dst.shape[0]) * src.shape[0] // dst.shape[0]
+        cols = np.arange(dst.shape[1]) * src.shape[1] // dst.shape[1]
+        dst[...] = src[rows][:, cols]
+        return dst
+
+    def convert_color(self, frame):
+        dst = self.buffer('color', frame.shape)
+        dst[...] = frame[..., ::-1]
+        return dst
+
+
+class PreprocessTestCase(unittest.TestCase):
+    def test_preprocess(self):
+        camera = ArrayCam(Context(), jpeg_size=(160, 120),
+                          numpy_size=(60, 80))
+        frame = np.random.randint(0, 255, (240, 320, 3), dtype=np.uint8)
+        jpeg, array = camera.preprocess(frame)
+        # One resize from capture, numpy frame resized from jpeg one
+        self.assertEqual(camera.resizes, [((240, 320), (120, 160)),
+                                          ((120, 160), (60, 80))])
+        self.assertEqual(jpeg.shape, (120, 160, 3))
+        self.assertTrue(np.array_equal(array, jpeg[::2, ::2, ::-1]))
+        buffers = {name: id(buf)
+                   for name, buf in camera.preprocess_buffers.items()}
+        camera.preprocess(frame)
+        self.assertEqual(buffers, {name: id(buf) for name, buf in
+                                   camera.preprocess_buffers.items()})
+
+    def test_crop(self):
+        camera = ArrayCam(Context(), jpeg_size=(160, 120),
+                          crop=(0, 120, 320, 120), disable_numpy_stream=True)
+        frame = np.random.randint(0, 255, (240, 320, 3), dtype=np.uint8)
+        jpeg, array = camera.preprocess(frame)
+        self.assertEqual(array, None)
+        self.assertTrue(np.array_equal(jpeg, frame[120:, ::2]))
+        camera = ArrayCam(Context(), jpeg_size=(320, 240),
+                          numpy_size=(240, 320))
+        jpeg, array = camera.preprocess(frame)
+        self.assertEqual(camera.resizes, [])
+        self.assertTrue(jpeg is frame)
+
+    def test_copy_unshared(self):
+        context = Context()
+        context.demand('cam/image-np', 'pilot')
+        camera = ArrayCam(context, numpy_size=(60, 80), shared_memory=False)
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        camera.get_frame = lambda: frame
+        camera.encode_jpeg = lambda frame: b'jpeg'
+        jpeg, array = camera.process_loop()
+        self.assertFalse(any(array is buf for buf in
+                             camera.preprocess_buffers.values()))
+
+    def test_demand(self):
+        context = Context()
+        camera = ArrayCam(context, numpy_size=(60, 80))
+        frames = []
+        camera.get_frame = lambda: frames.append(1) or np.zeros(
+            (240, 320, 3), dtype=np.uint8)
+        camera.encode_jpeg = lambda frame: b'jpeg'
+        # Nobody consume, camera only drained
+        self.assertEqual(camera.process_loop(), None)
+        self.assertEqual((frames, camera.resizes), ([1], []))
+        context.demand('cam/image-jpeg', 'web')
+        self.assertEqual(camera.process_loop(), (b'jpeg', NO_OUTPUT))
+        self.assertEqual(camera.resizes, [((240, 320), (120, 160))])
+        context.demand('cam/image-np', 'pilot')
+        context.release('cam/image-jpeg', 'web')
+        jpeg, array = camera.process_loop()
+        self.assertEqual((jpeg, array.shape), (NO_OUTPUT, (60, 80, 3)))
+
+
+class PGResizeTestCase(unittest.TestCase):
+    def test_area_average(self):
+        camera = PGWebCam(Context())
+        frame = np.random.randint(0, 255, (240, 320, 3), dtype=np.uint8)
+        dst = np.empty((120, 160, 3), dtype=np.uint8)
+        self.assertTrue(camera.resize(frame, dst) is dst)
+        expected = frame.reshape(120, 2, 160, 2, 3).mean(axis=(1, 3))
+        self.assertTrue(np.array_equal(dst, np.floor(expected + 0.5)))
+        buffers = {name: id(buf)
+                   for name, buf in camera.preprocess_buffers.items()}
+        camera.resize(frame, dst)
+        self.assertEqual(buffers, {name: id(buf) for name, buf in
+                                   camera.preprocess_buffers.items()})
+
+    def test_uneven(self):
+        camera = PGWebCam(Context())
+        frame = np.full((144, 176, 3), 200, dtype=np.uint8)
+        frame[:, 88:] = 10
+        dst = np.empty((120, 160, 3), dtype=np.uint8)
+        camera.resize(frame, dst)
+        self.assertTrue((dst[:, :80] == 200).all())
+        self.assertTrue((dst[:, 80:] == 10).all())
+
+
+class MjpegTestCase(unittest.TestCase):
+    def test_decode_scale(self):
+        for numpy_size, scale in (((120, 160), 4), ((300, 400), 1),
+                                  ((60, 80), 8), (None, 1)):
+            camera = CVWebCam(Context(), capture_size=(640, 480),
+                              numpy_size=numpy_size, mjpeg=True)
+            self.assertEqual(camera.decode_scale, scale)
+        camera = CVWebCam(Context(), capture_size=(640, 480),
+                          numpy_size=(120, 160), crop=(0, 0, 640, 240))
+        self.assertEqual(camera.decode_scale, 1)
+        with self.assertRaises(Exception):
+            CVWebCam(Context(), decode_scale=3)
+
+    def test_passthrough(self):
+        camera = CVWebCam(Context(), mjpeg=True)
+        frame = np.frombuffer(b'\xff\xd8jpeg\xff\xd9', dtype=np.uint8)
+        # Camera jpeg published as is, not decoded for jpeg only
+        self.assertEqual(camera.make_outputs(frame, numpy=False),
+                         (b'\xff\xd8jpeg\xff\xd9', NO_OUTPUT))
+
+
 class PGNodeTestCase(CVNodeTestCase):
     camera_class = PGWebCam
 
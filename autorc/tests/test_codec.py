@@ -0,0 +1,71 @@
+import unittest
+import pickle
+
+import numpy as np
+
+from autorc.codec import CompactCodec, PickleCodec, get_codec
+from autorc.framebuffer import FrameRef
+
+
+class CompactCodecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.codec = CompactCodec()
+
+    def round_trip(self, value):
+        data = self.codec.encode(value)
+        decoded = self.codec.decode(data)
+        self.assertEqual(type(decoded), type(value))
+        return data, decoded
+
+    def test_scalars(self):
+        for value in (None, True, False, 0, -5, 2 ** 62, 0.25, 'auto',
+                      b'\xff\xd8', '', b''):
+            data, decoded = self.round_trip(value)
+            self.assertEqual(decoded, value)
+        self.assertEqual(len(self.codec.encode(0.25)), 9)
+        self.assertTrue(len(self.codec.encode(0.25)) <
+                        len(pickle.dumps(0.25, pickle.HIGHEST_PROTOCOL)))
+
+    def test_sequences(self):
+        for value in ((0.1, 0.5), [1, 2, 3], (True, 1, 2.5), (), [2 ** 70],
+                      ('a', 1), tuple(range(300))):
+            data, decoded = self.round_trip(value)
+            self.assertEqual(decoded, value)
+        self.assertEqual(len(self.codec.encode((0.1, 0.5))), 20)
+
+    def test_array(self):
+        frame = np.arange(120 * 160 * 3, dtype=np.uint8).reshape(120, 160, 3)
+        data, decoded = self.round_trip(frame)
+        self.assertTrue(np.array_equal(decoded, frame))
+        self.assertEqual(decoded.dtype, frame.dtype)
+        self.assertEqual(len(data), frame.nbytes + 3 + 3 + 12)
+        # Not contiguous and other dtypes
+        view = np.arange(20, dtype='<f4').reshape(4, 5)[:, 1:3]
+        data, decoded = self.round_trip(view)
+        self.assertTrue(np.array_equal(decoded, view))
+        data, decoded = self.round_trip(np.array(1.5))
+        self.assertEqual(decoded.shape, ())
+
+    def test_fallback(self):
+        ref = FrameRef('buffer', 1, 2, 100, None, None)
+        data, decoded = self.round_trip(ref)
+        self.assertEqual(decoded, ref)
+        data, decoded = self.round_trip({'steering': 0.1})
+        self.assertEqual(decoded, {'steering': 0.1})
+        data, decoded = self.round_trip(np.array([{}], dtype=object))
+        self.assertEqual(data[:1], b'p')
+
+    def test_pickle(self):
+        # Contexts holding a codec are pickled to node processes
+        codec = pickle.loads(pickle.dumps(self.codec))
+        self.assertEqual(codec.decode(self.codec.encode((0.1, 2))), (0.1, 2))
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec('pickle'), PickleCodec)
+        self.assertIs(get_codec(self.codec), self.codec)
+        with self.assertRaises(Exception):
+            get_codec('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,415 @@
+import unittest
+import asyncio
+import threading
+import time
+from multiprocessing import Process, Event
+
+import numpy as np
+
+from autorc.context import Context, AsyncContext
+from autorc.framebuffer import FrameRingBuffer
+from autorc.nodes import Node
+from autorc.tracing import Trace
+from autorc.vehicle import VehicleManager
+
+
+class SlowNode(Node):
+    ''' Low process rate, only react on input change '''
+    def __init__(self, context):
+        super(SlowNode, self).__init__(context, inputs={
+            'on_key1_change': 'key1'
+        }, outputs={
+            'on_key1_change': 'test_result_key1'
+        }, process_rate=1)
+
+    def on_key1_change(self, key1):
+        return key1 + 1
+
+
+class ContextTestCase(unittest.TestCase):
+    def test_version(self):
+        context = Context(key1=1)
+        version = context.version('key1')
+        self.assertEqual(version > 0, True)
+        context.update({'key1': 2, 'key2': 3})
+        self.assertEqual(context.version('key1') > version, True)
+        self.assertEqual(context.version('key1'), context.version('key2'))
+        self.assertEqual(context.version('key3'), 0)
+        self.assertEqual(context.get('key2'), 3)
+
+    def test_snapshot(self):
+        context = Context({'key1': 1})
+        context['key2'] = 2
+        self.assertEqual(context.snapshot(('key1', 'key2')),
+                         ([1, 2], [1, 2]))
+        self.assertEqual(context.snapshot(('key1', 'key2'), (0, 0)),
+                         ([1, 2], [1, 2]))
+        # key2 is not updated since last seen
+        self.assertEqual(context.snapshot(('key1', 'key2'), (0, 2)), None)
+        self.assertEqual(context.snapshot(('key1', 'key3'), (0, 0)), None)
+        # Same value written twice is still a change
+        context['key2'] = 2
+        self.assertEqual(context.snapshot(('key2', ), (2, )), ([2], [3]))
+
+    def test_changed_since(self):
+        context = Context({'key1': 1})
+        since = context.version()
+        context.update({'key2': 2, 'key3': 3})
+        self.assertEqual(context.changed_since(since), {'key2': 2, 'key3': 2})
+        self.assertEqual(context.changed_since(0, ('key1', 'key4')),
+                         {'key1': 1})
+        del context['key3']
+        self.assertEqual(context.changed_since(since), {'key2': 2})
+
+    def test_wait(self):
+        context = Context()
+        since = context.version()
+        start_time = time.time()
+        self.assertEqual(context.wait(('key1', ), since, 0.1), since)
+        self.assertEqual(time.time() - start_time >= 0.1, True)
+
+        timer = threading.Timer(0.1, context.update, ({'key1': 1}, ))
+        timer.start()
+        start_time = time.time()
+        version = context.wait(('key1', ), since, 5)
+        self.assertEqual(time.time() - start_time < 1, True)
+        self.assertEqual(version > since, True)
+        # Already changed since, return immediately
+        self.assertEqual(context.wait(('key1', ), since, 5), version)
+
+
+class NodeWakeupTestCase(unittest.TestCase):
+    def run(self, result=None):
+        with VehicleManager() as manager:
+            context = manager.Context()
+            stop_event = Event()
+            p = Process(target=SlowNode.start, args=(context, stop_event))
+            p.daemon = True
+            p.start()
+            self.context = context
+            super(NodeWakeupTestCase, self).run(result)
+            stop_event.set()
+            p.join()
+
+    def test_wakeup(self):
+        time.sleep(0.5)     # Wait for node to start
+        for i in range(3):
+            self.context.update({'key1': i, 'key1__timestamp': time.time()})
+            time.sleep(0.2)     # Much less than 1 / process_rate
+            self.assertEqual(self.context.get('test_result_key1'), i + 1)
+
+
+class CounterNode(Node):
+    def __init__(self, context, **kwargs):
+        super(CounterNode, self).__init__(context, inputs={
+            'on_count': ('count', 'mode')
+        }, metrics=True, **kwargs)
+        self.received = []
+
+    def on_count(self, count, mode):
+        self.received.append((count, mode))
+
+
+class FrameNode(Node):
+    ''' Camera like source, frame captured at capture_time '''
+    def __init__(self, context, **kwargs):
+        super(FrameNode, self).__init__(context, outputs={
+            'process_loop': 'frame'
+        }, **kwargs)
+        self.capture_time = None
+
+    def process_loop(self):
+        self.start_trace(self.capture_time)
+        return 1
+
+
+class SteeringNode(Node):
+    ''' Pilot like relay, steering derive from frame '''
+    def __init__(self, context, **kwargs):
+        super(SteeringNode, self).__init__(context, inputs={
+            'on_frame': 'frame'
+        }, outputs={
+            'on_frame': 'steering'
+        }, **kwargs)
+
+    def on_frame(self, frame):
+        return frame
+
+
+class ActuatorNode(Node):
+    ''' Engine like, steering older than 0.1s from capture is stale '''
+    def __init__(self, context, **kwargs):
+        super(ActuatorNode, self).__init__(context, inputs={
+            'on_steering': 'steering'
+        }, max_age={'steering': 0.1}, **kwargs)
+        self.applied = []
+
+    def on_steering(self, steering):
+        self.applied.append(steering)
+
+
+class DeliveryTestCase(unittest.TestCase):
+    def write_counts(self, context, counts):
+        for i in counts:
+            context.update({'count': i, 'count__timestamp': time.time()})
+
+    def test_versions(self):
+        context = Context()
+        node = CounterNode(context)
+        mapper = node.get_mapper()
+        # Same timestamp, then clock stepped back: still two changes
+        context.update({'count': 1, 'count__timestamp': 100.0, 'mode': 'a'})
+        node.run_callbacks(mapper)
+        context.update({'count': 2, 'count__timestamp': 100.0, 'mode': 'a'})
+        node.run_callbacks(mapper)
+        context.update({'count': 3, 'count__timestamp': 50.0, 'mode': 'a'})
+        node.run_callbacks(mapper)
+        node.run_callbacks(mapper)
+        self.assertEqual([count for count, mode in node.received], [1, 2, 3])
+
+    def test_context_queue(self):
+        context = Context()
+        context.subscribe('key1', 'reader1', 2)
+        context.subscribe('key1', 'reader2')
+        for i in range(4):
+            context.update({'key1': i, 'key1__timestamp': i + 10.0})
+        items, dropped = context.drain(('key1', ), 'reader1')[0]
+        self.assertEqual([value for version, value, sidecars in items],
+                         [2, 3])
+        # Sidecars written with each value are queued with it
+        self.assertEqual([sidecars for version, value, sidecars in items],
+                         [{'key1__timestamp': 12.0},
+                          {'key1__timestamp': 13.0}])
+        self.assertEqual(dropped, 2)
+        items, dropped = context.drain(('key1', ), 'reader2')[0]
+        self.assertEqual([value for version, value, sidecars in items],
+                         [0, 1, 2, 3])
+        self.assertEqual(dropped, 0)
+        self.assertEqual(context.drain(('key1', ), 'reader1'), [([], 0)])
+        context.unsubscribe('key1', 'reader1')
+        context.unsubscribe('key1', 'reader2')
+        self.assertEqual(context.queues, {})
+
+    def test_latest(self):
+        context = Context(mode='auto')
+        node = CounterNode(context)
+        node.subscribe_inputs()
+        self.write_counts(context, range(3))
+        node.run_callbacks(node.get_mapper())
+        self.assertEqual(node.received, [(2, 'auto')])
+
+    def test_queue(self):
+        context = Context(mode='auto')
+        node = CounterNode(context, delivery={'count': ('queue', 2)})
+        node.subscribe_inputs()
+        self.write_counts(context, range(5))
+        node.run_callbacks(node.get_mapper())
+        self.assertEqual(node.received, [(3, 'auto'), (4, 'auto')])
+        self.assertEqual(node.input_drops, {'count': 3})
+        report = node.metrics.report()
+        self.assertEqual(report['metrics/CounterNode/inputs'],
+                         {'count': {'dropped': 3}})
+        self.assertEqual(report['metrics/CounterNode/on_count']['calls'], 2)
+
+    def test_lossless(self):
+        with VehicleManager() as manager:
+            context = manager.Context()
+            context['mode'] = 'auto'
+            node = CounterNode(context, delivery={'count': 'lossless'})
+            node.subscribe_inputs()
+            self.write_counts(context, range(20))
+            node.run_callbacks(node.get_mapper())
+            self.write_counts(context, range(20, 30))
+            node.run_callbacks(node.get_mapper())
+            node.unsubscribe_inputs()
+        self.assertEqual([count for count, mode in node.received],
+                         list(range(30)))
+        self.assertEqual(node.input_drops, {'count': 0})
+
+    def test_queued_frames(self):
+        # Queued frames are copied out of the ring, still intact once the
+        # writer wrapped around
+        context = Context(mode='auto')
+        node = CounterNode(context, delivery={'count': 'lossless'})
+        node.subscribe_inputs()
+        ring = FrameRingBuffer.create(slots=2, slot_size=64)
+        for i in range(2):
+            context.update({'count': ring.write(np.full(4, i, np.uint8))})
+        node.run_callbacks(node.get_mapper())
+        for i in range(2):
+            ring.write(np.full(4, 9, np.uint8))
+        self.assertEqual([count.tolist() for count, mode in node.received],
+                         [[0] * 4, [1] * 4])
+        node.release_frame_buffers()
+        ring.close()
+
+    def test_max_age(self):
+        context = Context(mode='auto')
+        node = CounterNode(context, max_age={'count': 0.1})
+        stale = []
+        node.on_stale = lambda callback, key, age: stale.append((key, age))
+        mapper = node.get_mapper()
+        context.update({'count': 1, 'count__timestamp': time.time() - 0.5})
+        node.run_callbacks(mapper)
+        self.assertEqual(node.received, [])
+        self.assertEqual(stale[0][0], 'count')
+        self.assertTrue(0.5 <= stale[0][1] < 1)
+        context.update({'count': 2, 'count__timestamp': time.time(),
+                        'mode': 'auto'})
+        node.run_callbacks(mapper)
+        self.assertEqual(node.received, [(2, 'auto')])
+        # Traced input age is measured from frame capture
+        context.update({'count': 3, 'count__timestamp': time.time(),
+                        'count__trace': Trace(1, time.time() - 0.2, ()),
+                        'mode': 'auto'})
+        node.trace = True
+        node.run_callbacks(mapper)
+        self.assertEqual(node.received, [(2, 'auto')])
+        self.assertEqual(node.stale_inputs, {'count': 2})
+        report = node.metrics.report()
+        self.assertEqual(report['metrics/CounterNode/inputs'],
+                         {'count': {'stale': 2}})
+
+    def test_queued_age(self):
+        # Each queued write and each input is aged from its own capture
+        context = Context(mode='auto')
+        node = CounterNode(context, delivery={'count': 'lossless'},
+                           max_age={'count': 0.1})
+        node.subscribe_inputs()
+        context.update({'count': 1, 'count__capture': time.time() - 0.5})
+        context.update({'count': 2, 'count__capture': time.time()})
+        context.update({'mode': 'auto', 'mode__capture': time.time()})
+        node.run_callbacks(node.get_mapper())
+        self.assertEqual(node.received, [(2, 'auto')])
+        self.assertEqual(node.stale_inputs, {'count': 1})
+        context.update({'count': 3, 'count__capture': time.time() - 0.5,
+                        'mode__capture': time.time()})
+        node.run_callbacks(node.get_mapper())
+        self.assertEqual(node.received, [(2, 'auto')])
+        self.assertEqual(node.stale_inputs, {'count': 2})
+
+    def test_capture_age(self):
+        # Not traced, steering freshly written from an old frame is stale
+        context = Context()
+        nodes = [FrameNode(context), SteeringNode(context),
+                 ActuatorNode(context)]
+        for capture_time in (time.time() - 0.5, time.time()):
+            nodes[0].capture_time = capture_time
+            for node in nodes:
+                node.run_callbacks(node.get_mapper())
+        self.assertEqual(nodes[2].stale_inputs, {'steering': 1})
+        self.assertEqual(nodes[2].applied, [1])
+        self.assertEqual(context.get('frame__capture'), capture_time)
+        # Fused, capture time come with produced values
+        engine = ActuatorNode(context)
+        fused = {engine.on_steering}
+        for capture_time in (time.time() - 0.5, time.time()):
+            engine.run_callbacks(engine.get_mapper(), fused, {
+                'steering': 2, 'steering__capture': capture_time})
+        self.assertEqual(engine.stale_inputs, {'steering': 1})
+        self.assertEqual(engine.applied, [2])
+
+    def test_demand(self):
+        context = Context()
+        node = CounterNode(context)
+        lazy = CounterNode(context)
+        lazy.lazy_inputs = ('count', )
+        node.subscribe_inputs()
+        lazy.subscribe_inputs()
+        self.assertEqual(context.demanded(('count', 'mode', 'other')),
+                         [True, True, False])
+        node.unsubscribe_inputs()
+        self.assertEqual(context.demanded(('count', 'mode')), [False, True])
+        lazy.set_demand('count')
+        self.assertEqual(context.demanded(('count', )), [True])
+        lazy.unsubscribe_inputs()
+        self.assertEqual(context.demands, {})
+        # Context without demand tracking, everything is consumed
+        self.assertEqual(CounterNode({}).demanded(('count', )), [True])
+
+    def test_release_reader(self):
+        # Crashed node never unsubscribe, restarted one take its place
+        context = Context()
+        for i in range(2):
+            node = CounterNode(context, delivery={'count': 'queue'},
+                               ready_key='startup/NoahCar/CounterNode')
+            node.subscribe_inputs()
+        self.assertEqual(context.demands, {
+            'count': {node.reader_id}, 'mode': {node.reader_id}})
+        self.assertEqual(list(context.queues['count']), [node.reader_id])
+        context.release_reader(node.reader_id)
+        self.assertEqual((context.demands, context.queues), ({}, {}))
+
+    def test_not_queue_capable(self):
+        node = CounterNode({}, delivery={'count': 'lossless'})
+        node.subscribe_inputs()
+        self.assertEqual(node.queues, {})
+        with self.assertRaises(Exception):
+            node = CounterNode(Context(), delivery={'count': 'all'})
+            node.subscribe_inputs()
+
+
+class AsyncContextTestCase(unittest.TestCase):
+    def run(self, result=None):
+        with VehicleManager() as manager:
+            self.proxy = manager.Context()
+            super(AsyncContextTestCase, self).run(result)
+
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    async def heartbeat(self, ticks, stop):
+        while not stop.is_set():
+            ticks.append(time.time())
+            await asyncio.sleep(0.01)
+
+    def test_not_blocking(self):
+        async def test():
+            context = AsyncContext(self.proxy)
+            await context.update({'key1': 1})
+            self.assertEqual(await context.get('key1'), 1)
+            since = await context.version()
+            self.assertEqual(await context.snapshot(('key1', )),
+                             ([1], [since]))
+            self.assertEqual(await context.changed_since(since - 1),
+                             {'key1': since})
+            # Event loop keep running while waiting for changes
+            ticks = []
+            stop = asyncio.Event()
+            task = asyncio.ensure_future(self.heartbeat(ticks, stop))
+            self.assertEqual(await context.wait(('key2', ), since, 0.3),
+                             since)
+            # Reads are not delayed by a pending wait
+            waiter = asyncio.ensure_future(
+                context.wait(('key2', ), since, 5))
+            start_time = time.time()
+            self.assertEqual(await context.get('key1'), 1)
+            self.assertTrue(time.time() - start_time < 0.1)
+            await context.update({'key2': 2})
+            self.assertTrue(await waiter > since)
+            stop.set()
+            await task
+            # One connection per concurrent call, reused after
+            self.assertEqual(len(context.connections), 2)
+            with self.assertRaises(KeyError):
+                await context.call('pop', 'missing')
+            context.close()
+            return ticks
+        ticks = self.run_async(test())
+        self.assertTrue(len(ticks) >= 20)
+
+    def test_direct(self):
+        async def test():
+            context = AsyncContext(Context(key1=1))
+            self.assertTrue(context.direct)
+            self.assertEqual(await context.get('key1'), 1)
+            context.close()
+        self.run_async(test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import time
+import numpy as np
+from multiprocessing import Process, Manager, Event
+
+from autorc.framebuffer import FrameRef, FrameRingBuffer
+from autorc.nodes import Node
+
+
+class FrameProducerNode(Node):
+    def __init__(self, context, **kwargs):
+        super(FrameProducerNode, self).__init__(
+            context, outputs=('frame-np', 'frame-jpeg'),
+            shared_outputs=('frame-np', 'frame-jpeg'), **kwargs)
+        self.counter = 0
+
+    def process_loop(self):
+        self.counter += 1
+        return (np.full((4, 6, 3), self.counter, dtype=np.uint8),
+                b'jpeg-%d' % self.counter)
+
+
+class FrameConsumerNode(Node):
+    def __init__(self, context, **kwargs):
+        super(FrameConsumerNode, self).__init__(
+            context, inputs={'on_frame': ('frame-np', 'frame-jpeg')},
+            outputs={'on_frame': ('frame-counter', 'frame-shape',
+                                  'frame-bytes')}, **kwargs)
+
+    def on_frame(self, frame, jpeg):
+        if frame is not None and jpeg is not None:
+            return int(frame[0, 0, 0]), frame.shape, jpeg
+
+
+class SlowConsumerNode(FrameConsumerNode):
+    ''' Producer wrap the ring while frame is being used '''
+    def __init__(self, context, producer, **kwargs):
+        super(SlowConsumerNode, self).__init__(context, **kwargs)
+        self.producer = producer
+
+    def on_frame(self, frame, jpeg):
+        for i in range(self.producer.frame_slots):
+            self.producer.run_callbacks(self.producer.get_mapper())
+        return super(SlowConsumerNode, self).on_frame(frame, jpeg)
+
+
+class FrameRingBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRingBuffer.create(slots=3, slot_size=1024)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_read_write(self):
+        arr = np.arange(24, dtype=np.int16).reshape((2, 3, 4))
+        ref = self.ring.write(arr)
+        self.assertIsInstance(ref, FrameRef)
+        reader = FrameRingBuffer.attach(ref.name)
+        self.assertTrue(np.array_equal(reader.read(ref), arr))
+        self.assertEqual(reader.read(self.ring.write(b'abc')), b'abc')
+        reader.close()
+
+    def test_overwritten_slot(self):
+        ref = self.ring.write(b'first')
+        for i in range(3):
+            self.ring.write(b'next')
+        self.assertEqual(self.ring.is_valid(ref), False)
+        self.assertEqual(self.ring.read(ref), None)
+
+    def test_too_large(self):
+        self.assertEqual(self.ring.write(b'0' * 2048), None)
+
+    def test_not_shared(self):
+        # Value itself in context, for readers on another machine
+        node = FrameProducerNode({}, shared_memory=False)
+        self.assertEqual(node.make_updates({'frame-jpeg': b'jpeg'})[
+            'frame-jpeg'], b'jpeg')
+        self.assertEqual(node.frame_buffers, {})
+
+
+class TornFrameTestCase(unittest.TestCase):
+    def test_torn_frame(self):
+        context = {}
+        producer = FrameProducerNode(context)
+        consumer = SlowConsumerNode(context, producer)
+        producer.run_callbacks(producer.get_mapper())
+        consumer.run_callbacks(consumer.get_mapper())
+        # Result of the overwritten frame is not published
+        self.assertEqual(consumer.torn_frames, 1)
+        self.assertFalse('frame-counter' in context)
+        consumer = FrameConsumerNode(context)
+        consumer.run_callbacks(consumer.get_mapper())
+        self.assertEqual(consumer.torn_frames, 0)
+        self.assertEqual(context['frame-counter'], 5)
+        for node in (producer, consumer):
+            node.release_frame_buffers()
+
+
+class SharedFrameNodeTestCase(unittest.TestCase):
+    def run(self, result=None):
+        with Manager() as manager:
+            context = manager.dict()
+            stop_event = Event()
+            p_producer = Process(target=FrameProducerNode.start,
+                                 args=(context, stop_event))
+            p_consumer = Process(target=FrameConsumerNode.start,
+                                 args=(context, stop_event))
+            p_consumer.daemon = True
+            p_consumer.start()
+            p_producer.daemon = True
+            p_producer.start()
+            self.context = context
+            super(SharedFrameNodeTestCase, self).run(result)
+            stop_event.set()
+            p_producer.join()
+            p_consumer.join()
+
+    def test_shared_frame(self):
+        time.sleep(1)
+        self.assertIsInstance(self.context.get('frame-np'), FrameRef)
+        self.assertEqual(self.context.get('frame-counter') > 0, True)
+        self.assertEqual(self.context.get('frame-shape'), (4, 6, 3))
+        self.assertEqual(
+            self.context.get('frame-bytes').startswith(b'jpeg-'), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import time
+import threading
+
+from autorc.context import Context
+from autorc.metrics import Histogram, NodeMetrics
+from autorc.nodes import Node
+
+
+class SlowNode(Node):
+    def __init__(self, context, **kwargs):
+        super(SlowNode, self).__init__(context, inputs={
+            'on_key1': 'key1'
+        }, outputs={
+            'process_loop': 'tick'
+        }, **kwargs)
+
+    def on_key1(self, value):
+        pass
+
+    def process_loop(self):
+        time.sleep(0.02)
+        return 1
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_percentile(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), None)
+        for i in range(1, 101):
+            histogram.add(i / 1000.0)
+        self.assertAlmostEqual(histogram.total, 5.05)
+        self.assertEqual(histogram.max, 0.1)
+        # Bucket upper bound, within 25% of actual value
+        self.assertTrue(0.05 <= histogram.percentile(50) <= 0.05 * 1.25)
+        self.assertTrue(0.095 <= histogram.percentile(95) <= 0.1)
+        self.assertEqual(histogram.percentile(100), 0.1)
+        histogram.add(1000)
+        self.assertEqual(histogram.percentile(100), 1000)
+
+    def test_report(self):
+        metrics = NodeMetrics('Test', interval=1)
+        start = metrics.window_start
+        self.assertFalse(metrics.due(start + 0.5))
+        self.assertTrue(metrics.due(start + 1))
+        metrics.record_call('on_key1', 0.01, 0.002)
+        metrics.record_call('on_key1', 0.01)
+        metrics.record_loop(0.01)
+        metrics.record_loop(0.1, True)
+        metrics.record_lateness(0.004)
+        report = metrics.report(start + 2)
+        self.assertEqual(set(report),
+                         {'metrics/Test/loop', 'metrics/Test/on_key1'})
+        self.assertEqual(report['metrics/Test/loop']['loops'], 2)
+        self.assertEqual(report['metrics/Test/loop']['overruns'], 1)
+        self.assertEqual(report['metrics/Test/loop']['rate'], 1)
+        self.assertEqual(report['metrics/Test/loop']['lateness']['max'],
+                         0.004)
+        callback = report['metrics/Test/on_key1']
+        self.assertEqual(callback['calls'], 2)
+        self.assertEqual(callback['input_age']['max'], 0.002)
+        # Counters are cumulative, percentiles per window
+        report = metrics.report(start + 3)
+        self.assertEqual(report['metrics/Test/loop']['loops'], 2)
+        self.assertEqual(report['metrics/Test/loop']['p50'], None)
+
+
+class NodeMetricsTestCase(unittest.TestCase):
+    def test_node(self):
+        context = Context()
+        context.update({'key1': 1, 'key1__timestamp': time.time()})
+        stop_event = threading.Event()
+        SlowNode.start(context, stop_event, process_rate=100, max_loop=20,
+                       metrics=True, metrics_interval=0)
+        loop = context.get('metrics/SlowNode/loop')
+        self.assertEqual(loop['loops'], 20)
+        # 20ms process_loop can not meet 100Hz, some loops are input wake up
+        process_loop = context.get('metrics/SlowNode/process_loop')
+        self.assertTrue(process_loop['calls'] >= 18)
+        self.assertEqual(loop['overruns'], process_loop['calls'])
+        self.assertTrue(process_loop['p50'] >= 0.02)
+        on_key1 = context.get('metrics/SlowNode/on_key1')
+        self.assertEqual(on_key1['calls'], 1)
+
+    def test_input_age(self):
+        node = SlowNode(Context(), metrics=True)
+        node.input_timestamps['key1__timestamp'] = time.time() - 1
+        node.call(node.on_key1, (1, ), ('key1', ))
+        age = node.metrics.callbacks['on_key1'].input_age
+        self.assertTrue(1 <= age.max < 1.1)
+
+    def test_disabled(self):
+        context = Context()
+        SlowNode.start(context, threading.Event(), max_loop=2)
+        self.assertEqual([key for key in context.keys()
+                          if key.startswith('metrics/')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import time
+
+from autorc.nodes import Node, AsyncNode
+from autorc.pipeline import find_pipelines
+from autorc.tests.test_vehicle import RelayNode, TestVehicle
+
+
+class CameraNode(Node):
+    outputs = ('cam/image', )
+
+    def process_loop(self):
+        return 1
+
+
+class PilotNode(Node):
+    inputs = {
+        'process_loop': 'cam/image',
+        'on_enable': 'pilot/enable'
+    }
+    outputs = {
+        'process_loop': 'pilot/steering'
+    }
+
+    def on_enable(self, value):
+        pass
+
+    def process_loop(self, image):
+        return image
+
+
+class EngineNode(Node):
+    inputs = {
+        'on_pilot_steering': 'pilot/steering',
+        'on_user_steering': 'user/steering'
+    }
+
+    def on_pilot_steering(self, steering):
+        pass
+
+    def on_user_steering(self, steering):
+        pass
+
+
+class RecorderNode(Node):
+    inputs = ('cam/image', 'user/steering')
+
+
+class AsyncPilotNode(AsyncNode):
+    inputs = ('cam/image', )
+
+
+class HardwareNode(EngineNode):
+    ''' Could only be built on the car '''
+    def __init__(self, context, **kwargs):
+        raise Exception('No hardware')
+
+
+def nodes(*node_classes):
+    return [(node_cls, (), {}, {'mode': 'process'})
+            for node_cls in node_classes]
+
+
+class FindPipelinesTestCase(unittest.TestCase):
+    def test_chain(self):
+        # Recorder does not follow camera, user/steering come from elsewhere
+        self.assertEqual(find_pipelines(nodes(
+            EngineNode, RecorderNode, CameraNode, PilotNode
+        )), [[(2, ()), (3, ('process_loop', )),
+              (0, ('on_pilot_steering', ))]])
+
+    def test_not_linear(self):
+        # Camera has two followers and engine two leaders
+        self.assertEqual(find_pipelines(nodes(
+            CameraNode, PilotNode, PilotNode, EngineNode
+        )), [])
+        self.assertEqual(find_pipelines(nodes(
+            CameraNode, PilotNode, EngineNode, PilotNode
+        )), [])
+        # Async nodes are not fused nor counted as follower
+        self.assertEqual(find_pipelines(nodes(
+            CameraNode, PilotNode, AsyncPilotNode, EngineNode
+        )), [[(0, ()), (1, ('process_loop', )),
+              (3, ('on_pilot_steering', ))]])
+
+    def test_not_built(self):
+        # Graph come from declarations, nodes are built in their process
+        self.assertEqual(find_pipelines(nodes(
+            CameraNode, PilotNode, HardwareNode
+        )), [[(0, ()), (1, ('process_loop', )),
+              (2, ('on_pilot_steering', ))]])
+        self.assertEqual(find_pipelines([
+            (PilotNode, (), {'inputs': {'on_enable': 'cam/image'}}, {}),
+            (CameraNode, (), {}, {}),
+        ]), [[(1, ()), (0, ('on_enable', ))]])
+
+    def test_cycle(self):
+        self.assertEqual(find_pipelines([
+            (RelayNode, ('key1', 'key2'), {}, {}),
+            (RelayNode, ('key2', 'key1'), {}, {}),
+        ]), [])
+
+
+class FusedVehicleTestCase(unittest.TestCase):
+    def relay(self, context):
+        context.update({'key1': 1, 'key1__timestamp': time.time()})
+        time.sleep(0.5)
+        return {key: context.get(key) for key in ('key2', 'key3', 'key4')}
+
+    def test_fused(self):
+        vehicle = TestVehicle(self.relay, fuse_pipeline=True)
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.add_node(RelayNode, 'key2', 'key3')
+        vehicle.add_node(RelayNode, 'key3', 'key4')
+        vehicle.start()
+        self.assertEqual(len(vehicle.pipelines), 1)
+        self.assertEqual(len(vehicle.processes), 1)
+        # Fused outputs still published to context
+        self.assertEqual(vehicle.result, {'key2': 2, 'key3': 3, 'key4': 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import time
+
+from autorc.scheduler import RateScheduler
+
+
+class RateSchedulerTestCase(unittest.TestCase):
+    def run_ticks(self, scheduler, durations, start=100.0):
+        ''' Run ticks of given durations, return their start times '''
+        now = start
+        scheduler.start(now)
+        starts = []
+        for duration in durations:
+            now += scheduler.remaining(now)
+            self.assertTrue(scheduler.due(now))
+            starts.append(round(now, 6))
+            now += duration
+            scheduler.done(now)
+        return starts
+
+    def test_no_drift(self):
+        scheduler = RateScheduler(10)
+        starts = self.run_ticks(scheduler, [0.03, 0.07, 0.01, 0.09])
+        self.assertEqual(starts, [100.0, 100.1, 100.2, 100.3])
+        self.assertEqual(scheduler.overruns, 0)
+        self.assertFalse(scheduler.due(100.35))
+
+    def test_skip(self):
+        scheduler = RateScheduler(10)
+        starts = self.run_ticks(scheduler, [0.25, 0.01, 0.01])
+        # Ticks at 100.1 and 100.2 are dropped
+        self.assertEqual(starts, [100.0, 100.3, 100.4])
+        self.assertEqual(scheduler.overruns, 1)
+        self.assertEqual(scheduler.skipped, 2)
+
+    def test_catchup(self):
+        scheduler = RateScheduler(10, 'catchup')
+        starts = self.run_ticks(scheduler, [0.25, 0.01, 0.01, 0.01])
+        # Late ticks run back to back
+        self.assertEqual(starts, [100.0, 100.25, 100.26, 100.3])
+        self.assertEqual(scheduler.skipped, 0)
+        scheduler = RateScheduler(10, 'catchup')
+        scheduler.max_catchup = 1
+        starts = self.run_ticks(scheduler, [0.25, 0.01, 0.01])
+        self.assertEqual(starts, [100.0, 100.25, 100.3])
+        self.assertEqual(scheduler.skipped, 1)
+
+    def test_asap(self):
+        scheduler = RateScheduler(10, 'asap')
+        starts = self.run_ticks(scheduler, [0.25, 0.01, 0.01])
+        # Grid restart from late tick
+        self.assertEqual(starts, [100.0, 100.25, 100.35])
+
+    def test_lateness(self):
+        scheduler = RateScheduler(10)
+        scheduler.start(100.0)
+        self.assertTrue(scheduler.due(100.0))
+        self.assertEqual(scheduler.lateness, 0)
+        scheduler.done(100.01)
+        self.assertFalse(scheduler.due(100.05))
+        self.assertTrue(scheduler.due(100.13))
+        self.assertAlmostEqual(scheduler.lateness, 0.03)
+
+    def test_policy(self):
+        with self.assertRaises(Exception):
+            RateScheduler(10, 'unknown')
+
+    def test_adaptive(self):
+        scheduler = RateScheduler(20, adaptive=True, min_rate=5)
+        self.run_ticks(scheduler, [0.06] * 40)
+        self.assertTrue(scheduler.rate < 20)
+        self.assertTrue(scheduler.rate >= 5)
+        lowered = scheduler.rate
+        self.run_ticks(scheduler, [0.001] * 100, start=200.0)
+        self.assertTrue(scheduler.rate > lowered)
+        self.assertTrue(scheduler.rate <= 20)
+
+    def test_monotonic(self):
+        scheduler = RateScheduler(100)
+        scheduler.start()
+        start_time = time.monotonic()
+        ticks = 0
+        while ticks < 30:
+            if scheduler.due():
+                ticks += 1
+                scheduler.done()
+            time.sleep(scheduler.remaining())
+        self.assertAlmostEqual(time.monotonic() - start_time, 0.3, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import asyncio
+import time
+
+from autorc.nodes import Node, AsyncNode
+from autorc.startup import import_times, node_times
+from autorc.utils import import_string
+from autorc.vehicle import Vehicle
+
+
+class SlowStartNode(Node):
+    def start_up(self):
+        time.sleep(0.1)
+
+
+class AsyncStartNode(AsyncNode):
+    async def start_up(self):
+        time.sleep(0.05)
+        self.start_loop = asyncio.get_event_loop()
+
+    async def shutdown(self):
+        if asyncio.get_event_loop() is not self.start_loop:
+            raise RuntimeError('Shut down in another event loop')
+
+
+class BrokenNode(Node):
+    def start_up(self):
+        raise ImportError('No module named cv2')
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_import_times(self):
+        times, error = import_times('json')
+        self.assertEqual(error, None)
+        names = [row[0] for row in times]
+        self.assertEqual(names[-1], 'json')
+        self.assertIn('json.decoder', names)
+        # Package is imported last, its cumulative time cover submodules
+        self.assertTrue(times[-1][2] >= max(row[2] for row in times[:-1]))
+        times, error = import_times('autorc.not_a_module')
+        self.assertIn('ModuleNotFoundError', error)
+
+    def test_node_times(self):
+        vehicle = Vehicle(allow_remote=False)
+        vehicle.add_node(SlowStartNode)
+        vehicle.add_node(AsyncStartNode)
+        vehicle.add_node(BrokenNode)
+        slow, async_node, broken = node_times(vehicle)
+        self.assertEqual(slow['node'], 'SlowStartNode')
+        self.assertTrue(slow['start_up'] >= 0.1)
+        self.assertTrue(async_node['start_up'] >= 0.05)
+        self.assertEqual(async_node['error'], None)
+        self.assertTrue(broken['init'] is not None)
+        self.assertEqual(broken['start_up'], None)
+        self.assertEqual(broken['error'], 'ImportError: No module named cv2')
+
+    def test_import_string(self):
+        self.assertIs(import_string('autorc.nodes.Node'), Node)
+
+
+if __name__ == '__main__':
+    unittest.main()
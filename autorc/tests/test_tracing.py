@@ -0,0 +1,125 @@
+import unittest
+import time
+
+from autorc.context import Context
+from autorc.nodes import Node
+from autorc.tracing import Trace, TraceAggregator
+
+
+class SourceNode(Node):
+    def __init__(self, context, **kwargs):
+        super(SourceNode, self).__init__(
+            context, outputs=('cam/image', ), **kwargs)
+
+    def process_loop(self):
+        self.start_trace()
+        return 'image'
+
+
+class PilotNode(Node):
+    def __init__(self, context, **kwargs):
+        super(PilotNode, self).__init__(context, inputs={
+            'process_loop': ('cam/image', 'pilot/engage')
+        }, outputs={
+            'process_loop': 'pilot/steering'
+        }, **kwargs)
+
+    def process_loop(self, image, engage):
+        return 0.5
+
+
+class SinkNode(Node):
+    def __init__(self, context, **kwargs):
+        super(SinkNode, self).__init__(context, inputs={
+            'on_steering': 'pilot/steering'
+        }, **kwargs)
+
+    def on_steering(self, steering):
+        self.record_trace()
+
+
+class RecorderNode(Node):
+    ''' Every written image, with its trace '''
+    def __init__(self, context, **kwargs):
+        super(RecorderNode, self).__init__(context, inputs={
+            'on_image': 'cam/image'
+        }, delivery={'cam/image': 'lossless'}, **kwargs)
+        self.frames = []
+
+    def on_image(self, image):
+        self.frames.append(self.current_trace.frame)
+
+
+class TraceAggregatorTestCase(unittest.TestCase):
+    def test_record(self):
+        traces = TraceAggregator('Engine')
+        traces.record(Trace(1, 10.0, (('Camera', 10.01), ('Pilot', 10.03))),
+                      10.04)
+        traces.record(Trace(1, 10.0, ()), 10.05)
+        traces.record(Trace(4, 11.0, (('Camera', 11.01), ('Pilot', 11.03))),
+                      11.04)
+        report = traces.report()['trace/Engine']
+        self.assertEqual(report['frames'], 2)
+        self.assertEqual(report['skipped'], 2)
+        self.assertEqual(report['duplicates'], 1)
+        self.assertEqual(list(report['stages']),
+                         ['Camera', 'Pilot', 'applied'])
+        self.assertAlmostEqual(report['total']['max'], 0.04)
+        self.assertAlmostEqual(report['stages']['Pilot']['max'], 0.02)
+
+
+class NodeTraceTestCase(unittest.TestCase):
+    def test_propagate(self):
+        context = Context({'pilot/engage': True,
+                           'pilot/engage__timestamp': time.time()})
+        nodes = [node_cls(context, trace=True)
+                 for node_cls in (SourceNode, PilotNode, SinkNode)]
+        for i in range(3):
+            for node in nodes:
+                node.run_callbacks(node.get_mapper())
+        trace = context.get('pilot/steering__trace')
+        self.assertEqual(trace.frame, 1)
+        self.assertEqual([name for name, stage_time in trace.stages],
+                         ['SourceNode', 'PilotNode'])
+        sink = nodes[2]
+        self.assertEqual(sink.traces.frames, 1)
+        report = sink.traces.report()['trace/SinkNode']
+        self.assertEqual(list(report['stages']),
+                         ['SourceNode', 'PilotNode', 'applied'])
+
+    def test_fused(self):
+        context = Context({'pilot/engage': True,
+                           'pilot/engage__timestamp': time.time()})
+        source = SourceNode(context, trace=True)
+        pilot = PilotNode(context, trace=True)
+        produced = source.run_callbacks(source.get_mapper())
+        produced['pilot/engage'] = True     # Input without trace
+        produced.update(pilot.run_callbacks(
+            pilot.get_mapper(), {pilot.process_loop}, produced))
+        self.assertEqual(produced['pilot/steering'], 0.5)
+        self.assertEqual(produced['pilot/steering__trace'].frame, 1)
+
+    def test_queued(self):
+        # Each queued write come with its own trace, not the latest one
+        context = Context()
+        source = SourceNode(context, trace=True)
+        recorder = RecorderNode(context, trace=True)
+        recorder.subscribe_inputs()
+        for i in range(3):
+            source.run_callbacks(source.get_mapper())
+        recorder.run_callbacks(recorder.get_mapper())
+        first = recorder.frames[0]
+        self.assertEqual(recorder.frames, [first, first + 1, first + 2])
+
+    def test_disabled(self):
+        context = Context()
+        source = SourceNode(context)
+        source.run_callbacks(source.get_mapper())
+        # No trace, capture time is still carried for max_age
+        self.assertEqual(set(context.keys()),
+                         {'cam/image', 'cam/image__timestamp',
+                          'cam/image__capture'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,331 @@
+import unittest
+import os
+import threading
+import time
+
+from autorc.context import Context
+from autorc.nodes import Node
+from autorc.nodes.pilot import PilotBase
+from autorc.vehicle import Vehicle
+
+
+class RelayNode(Node):
+    ''' Add one to input key, report context type it was given '''
+    def __init__(self, context, input_key, output_key, **kwargs):
+        inputs, outputs = self.declare(input_key, output_key)
+        super(RelayNode, self).__init__(context, inputs=inputs,
+                                        outputs=outputs, **kwargs)
+
+    @classmethod
+    def declare(cls, input_key, output_key, **kwargs):
+        return {'on_input': input_key}, {
+            'on_input': (output_key, output_key + '/context')}
+
+    def on_input(self, value):
+        return value + 1, type(self.context).__name__
+
+
+class PlacedNode(Node):
+    ''' Report cpus and niceness of its process '''
+    def __init__(self, context, **kwargs):
+        super(PlacedNode, self).__init__(context, outputs={
+            'process_loop': 'placement'
+        }, **kwargs)
+
+    def process_loop(self):
+        return [sorted(os.sched_getaffinity(0)),
+                os.getpriority(os.PRIO_PROCESS, 0),
+                os.environ.get('OMP_NUM_THREADS')]
+
+
+class SlowShutdownNode(Node):
+    ''' Waiting for inputs, shutdown hook take a while '''
+    def __init__(self, context, **kwargs):
+        super(SlowShutdownNode, self).__init__(context, inputs={
+            'on_input': 'key1'
+        }, process_rate=1, **kwargs)
+
+    def on_input(self, value):
+        pass
+
+    def shutdown(self):
+        time.sleep(0.2)
+
+
+class StuckNode(Node):
+    ''' Stuck in a long callback, never see stop event '''
+    def __init__(self, context, **kwargs):
+        super(StuckNode, self).__init__(context, outputs={
+            'process_loop': 'stuck'
+        }, **kwargs)
+
+    def process_loop(self):
+        time.sleep(30)
+
+
+class CrashNode(Node):
+    ''' Process exit on first run, run fine once restarted '''
+    def __init__(self, context, **kwargs):
+        super(CrashNode, self).__init__(context, outputs={
+            'process_loop': 'crashes'
+        }, **kwargs)
+
+    def process_loop(self):
+        crashes = self.context.get('crashes') or 0
+        if not crashes:
+            self.context.update({'crashes': 1})
+            os._exit(1)
+        return crashes
+
+
+class CrashReaderNode(CrashNode):
+    ''' Crash holding a queued input, never unsubscribed '''
+    def __init__(self, context, **kwargs):
+        super(CrashReaderNode, self).__init__(context, inputs={
+            'on_input': 'key1'
+        }, delivery={'key1': 'queue'}, **kwargs)
+
+    def on_input(self, value):
+        pass
+
+
+class TestVehicle(Vehicle):
+    ''' Run test function as main loop '''
+    def __init__(self, test, **kwargs):
+        kwargs.setdefault('allow_remote', False)
+        super(TestVehicle, self).__init__(**kwargs)
+        self.test = test
+
+    def main_loop(self):
+        self.result = self.test(self.context)
+
+
+class VehicleTestCase(unittest.TestCase):
+    def relay(self, context):
+        context.update({'key1': 1, 'key1__timestamp': time.time()})
+        time.sleep(0.5)
+        return {key: context.get(key) for key in (
+            'key2', 'key2/context', 'key3', 'key3/context')}
+
+    def test_process_mode(self):
+        vehicle = TestVehicle(self.relay)
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.add_node(RelayNode, 'key2', 'key3')
+        vehicle.start()
+        self.assertEqual(vehicle.result, {
+            'key2': 2, 'key2/context': 'ContextProxy',
+            'key3': 3, 'key3/context': 'ContextProxy'
+        })
+
+    def test_thread_mode(self):
+        vehicle = TestVehicle(self.relay, node_mode='thread')
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.add_node(RelayNode, 'key2', 'key3', mode='process')
+        vehicle.start()
+        self.assertEqual(len(vehicle.threads), 1)
+        self.assertEqual(len(vehicle.processes), 1)
+        # Thread node use in-process context, process node use proxy
+        self.assertEqual(vehicle.result, {
+            'key2': 2, 'key2/context': 'Context',
+            'key3': 3, 'key3/context': 'ContextProxy'
+        })
+
+    def test_forkserver(self):
+        vehicle = TestVehicle(self.relay, start_method='forkserver',
+                              preload=('numpy', 'autorc.nodes'))
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.add_node(RelayNode, 'key2', 'key3')
+        vehicle.start()
+        self.assertEqual(vehicle.result, {
+            'key2': 2, 'key2/context': 'ContextProxy',
+            'key3': 3, 'key3/context': 'ContextProxy'
+        })
+
+    def test_ready(self):
+        vehicle = TestVehicle(lambda context: vehicle.startup_report(),
+                              node_mode='thread')
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.add_node(RelayNode, 'key2', 'key3')
+        vehicle.add_node(PlacedNode)
+        vehicle.start()
+        # Nodes of same class get their own key, main loop started once
+        # they were all ready
+        self.assertEqual(set(vehicle.result), {
+            'startup/NoahCar/RelayNode', 'startup/NoahCar/RelayNode.2',
+            'startup/NoahCar/PlacedNode'})
+        for times in vehicle.result.values():
+            self.assertTrue(0 <= times['ready'] < 5)
+        self.assertEqual(
+            vehicle.result['startup/NoahCar/RelayNode']['first_output'], None)
+
+    def test_stale_keys(self):
+        # Context shared with a previous run, keys of this vehicle nodes are
+        # cleared when they are launched
+        vehicle = Vehicle(allow_remote=False, node_mode='thread')
+        vehicle.context = Context({'startup/NoahCar/RelayNode': 1.0,
+                                   'heartbeat/NoahCar/RelayNode': 1.0})
+        vehicle.stop_event = threading.Event()
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.start_nodes(vehicle.context)
+        self.assertNotEqual(vehicle.context.get('heartbeat/NoahCar/RelayNode'),
+                            1.0)
+        ready = vehicle.wait_ready()['startup/NoahCar/RelayNode']
+        self.assertTrue(0 <= ready < 5)
+        vehicle.stop_event.set()
+        vehicle.threads[0].join()
+
+    def test_shutdown(self):
+        # Let StuckNode enter its callback
+        vehicle = TestVehicle(lambda context: time.sleep(0.2))
+        vehicle.add_node(RelayNode, 'key1', 'key2')
+        vehicle.add_node(SlowShutdownNode)
+        vehicle.add_node(StuckNode, shutdown_timeout=0.5)
+        start_time = time.monotonic()
+        vehicle.start()
+        report = vehicle.shutdown_report
+        # Waiting nodes are woken up, no fixed 2s wait
+        self.assertEqual(report['RelayNode'][1], 'stopped')
+        self.assertTrue(report['RelayNode'][0] < 0.3)
+        self.assertEqual(report['SlowShutdownNode'][1], 'stopped')
+        self.assertTrue(0.2 <= report['SlowShutdownNode'][0] < 0.5)
+        self.assertEqual(report['StuckNode'][1], 'terminated')
+        self.assertTrue(0.5 <= report['StuckNode'][0] < 1.5)
+        self.assertTrue(time.monotonic() - start_time < 5)
+
+    def test_placement(self):
+        cpu = min(os.sched_getaffinity(0))
+        nice = os.getpriority(os.PRIO_PROCESS, 0) + 1
+
+        def placement(context):
+            time.sleep(0.2)     # Ready, let first loop publish
+            return context.get('placement')
+        vehicle = TestVehicle(placement)
+        vehicle.add_node(PlacedNode, cpus={cpu}, nice=nice)
+        vehicle.start()
+        self.assertEqual(vehicle.result, [[cpu], nice, '1'])
+        # Vehicle process is left as is
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, 0), nice - 1)
+        self.assertEqual(vehicle.nodes[0][3]['placement'],
+                         {'cpus': {cpu}, 'nice': nice})
+        with self.assertRaises(Exception):
+            vehicle.add_node(PlacedNode, sched='unknown')
+
+    def test_allow_remote(self):
+        # Manager context is published to remote vehicles, shm one stay
+        # local to this machine
+        for backend, context in (('manager', 'ContextProxy'),
+                                 ('shm', 'SharedMemoryContext')):
+            vehicle = TestVehicle(self.relay, allow_remote=True, port=0,
+                                  context_backend=backend)
+            vehicle.add_node(RelayNode, 'key1', 'key2')
+            vehicle.add_node(RelayNode, 'key2', 'key3')
+            vehicle.start()
+            self.assertEqual(vehicle.result, {
+                'key2': 2, 'key2/context': context,
+                'key3': 3, 'key3/context': context
+            })
+            self.assertEqual(vehicle.context_backend.context, None)
+
+    def test_remote_shared_memory(self):
+        # Remote nodes could not attach frames shared on this host
+        vehicle = Vehicle(allow_remote=True)
+        vehicle.add_node(PlacedNode)
+        self.assertEqual(vehicle.nodes[0][2]['shared_memory'], False)
+        # Frames are shared by default
+        vehicle = Vehicle()
+        vehicle.add_node(PlacedNode)
+        self.assertFalse('shared_memory' in vehicle.nodes[0][2])
+        # shm context is local, frames too large for its slots stay shared
+        vehicle = Vehicle(context_backend='shm')
+        self.assertEqual(vehicle.allow_remote, False)
+        vehicle.add_node(PlacedNode)
+        self.assertFalse('shared_memory' in vehicle.nodes[0][2])
+
+    def supervise(self, vehicle, name, done, timeout=5):
+        ''' Run supervisor until done(health of node) '''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            health = vehicle.supervisor.check()['health/NoahCar/%s' % name]
+            if done(health):
+                break
+            time.sleep(0.05)
+        return health
+
+    def test_supervise_crash(self):
+        vehicle = TestVehicle(lambda context: self.supervise(
+            vehicle, 'CrashNode', lambda health: health['restarts'] and
+            health['state'] == 'ok'), restart_backoff=0.1)
+        vehicle.add_node(CrashNode)
+        vehicle.start()
+        health = vehicle.result
+        self.assertEqual(health['state'], 'ok')
+        self.assertEqual(health['restarts'], 1)
+        # Detected, restarted and looping again in a fraction of second
+        self.assertTrue(0 < health['recovery_time'] < 1)
+        self.assertTrue(health['heartbeat_age'] < 1)
+        self.assertEqual(len(vehicle.processes), 1)
+
+    def test_supervise_demands(self):
+        def main_loop(context):
+            self.supervise(vehicle, 'CrashReaderNode', lambda health: health[
+                'restarts'] and health['state'] == 'ok')
+            demanded = context.demanded(('key1', ))
+            # No reader left by the crashed process
+            context.release_reader('startup/NoahCar/CrashReaderNode')
+            return demanded + context.demanded(('key1', ))
+        vehicle = TestVehicle(main_loop, restart_backoff=0.1)
+        vehicle.add_node(CrashReaderNode)
+        vehicle.start()
+        self.assertEqual(vehicle.result, [True, False])
+
+    def test_supervise_stopped(self):
+        # Node leaving its loop on its own is not restarted
+        for mode in ('process', 'thread'):
+            vehicle = TestVehicle(lambda context: self.supervise(
+                vehicle, 'PlacedNode', lambda health: health['state'] not in (
+                    'starting', 'ok')), node_mode=mode, restart_backoff=0.1)
+            vehicle.add_node(PlacedNode, max_loop=1)
+            vehicle.start()
+            self.assertEqual(vehicle.result['state'], 'stopped')
+            self.assertEqual(vehicle.result['restarts'], 0)
+
+    def test_heartbeat_timeout(self):
+        vehicle = Vehicle(allow_remote=False)
+        vehicle.add_node(PlacedNode)
+        vehicle.add_node(PilotBase)
+        vehicle.add_node(PilotBase, heartbeat_timeout=5)
+        # First predict may take long, pilot get a larger default
+        self.assertEqual([options['heartbeat_timeout'] for node_cls, args,
+                          kwargs, options in vehicle.nodes], [3.0, 30.0, 5])
+
+    def test_supervise_hung(self):
+        vehicle = TestVehicle(lambda context: self.supervise(
+            vehicle, 'StuckNode', lambda health: health['state'] == 'failed'),
+            restart_backoff=0.1, max_restarts=1)
+        vehicle.add_node(StuckNode, heartbeat_timeout=0.3)
+        vehicle.start()
+        # Terminated and restarted once, given up when hung again
+        self.assertEqual(vehicle.result['state'], 'failed')
+        self.assertEqual(vehicle.result['restarts'], 1)
+        self.assertEqual(vehicle.shutdown_report['StuckNode'][1], 'stopped')
+
+    def test_supervise_hung_thread(self):
+        def main_loop(context):
+            health = self.supervise(vehicle, 'StuckNode', lambda health:
+                                    health['state'] == 'failed')
+            # Reported once, not on every check
+            with self.assertLogs(vehicle.logger) as logs:
+                vehicle.supervisor.check()
+                vehicle.logger.info('checked')
+            return health, len(logs.output)
+        vehicle = TestVehicle(main_loop, node_mode='thread')
+        vehicle.add_node(StuckNode, heartbeat_timeout=0.3,
+                         shutdown_timeout=0.1)
+        vehicle.start()
+        health, logged = vehicle.result
+        self.assertEqual((health['state'], health['restarts']), ('failed', 0))
+        self.assertEqual(logged, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
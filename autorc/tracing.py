@@ -0,0 +1,99 @@
+''' End to end frame tracing
+    Source node (camera) start a trace for every frame: sequence ID and
+    capture time. Every node publishing an output derived from that frame
+    write the trace, stamped with its name and publish time, in the output
+    key__trace sidecar. Actuator node (engine) record the trace when it
+    apply the command, TraceAggregator publish every interval:
+        trace/<node>: frames, skipped (frame IDs which never reached the
+            node), duplicates (same frame applied twice), total glass to
+            actuator latency and per stage latency percentiles.
+    Stage latency is the time between previous stage (or capture) and the
+    stage publishing its output, "applied" is the last one.
+    Without tracing the capture time alone still travel in key__capture
+    sidecars, nodes check their max_age budget against it.
+'''
+import time
+from collections import namedtuple
+
+from autorc.metrics import Histogram
+
+
+__all__ = (
+    'Trace',
+    'TraceAggregator',
+    'newest_capture',
+)
+
+
+# stages: ((node name, publish time), ...)
+Trace = namedtuple('Trace', ('frame', 'capture', 'stages'))
+
+
+def newest_trace(traces):
+    ''' Trace of the latest frame, None if there is no trace '''
+    newest = None
+    for trace in traces:
+        if trace is not None and (newest is None or
+                                  trace.frame > newest.frame):
+            newest = trace
+    return newest
+
+
+def newest_capture(captures):
+    ''' Capture time of the latest frame, None if there is none '''
+    captures = [capture for capture in captures if capture is not None]
+    return max(captures) if captures else None
+
+
+class TraceAggregator(object):
+    ''' Latency distributions of traces reaching a node '''
+    def __init__(self, name, interval=1.0):
+        self.name = name
+        self.interval = interval
+        self.frames = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.last_frame = None
+        self.total = Histogram()
+        self.stages = {}
+        self.window_start = time.time()
+
+    def record(self, trace, applied=None):
+        applied = applied or time.time()
+        if self.last_frame is not None:
+            if trace.frame == self.last_frame:
+                self.duplicates += 1
+                return
+            if trace.frame > self.last_frame:
+                self.skipped += trace.frame - self.last_frame - 1
+            # Lower frame ID, source restarted
+        self.last_frame = trace.frame
+        self.frames += 1
+        self.total.add(applied - trace.capture)
+        last_time = trace.capture
+        for name, stage_time in trace.stages + (('applied', applied), ):
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = Histogram()
+            histogram.add(stage_time - last_time)
+            last_time = stage_time
+
+    def due(self, now):
+        return now - self.window_start >= self.interval
+
+    def report(self, now=None):
+        ''' {context key: traces summary} of current window '''
+        now = now or time.time()
+        data = {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'duplicates': self.duplicates,
+            'total': self.total.summary(),
+            'stages': {name: histogram.summary()
+                       for name, histogram in self.stages.items()},
+        }
+        self.total.reset()
+        for histogram in self.stages.values():
+            histogram.reset()
+        self.window_start = now
+        return {'trace/%s' % self.name: data}
@@ -1,3 +1,5 @@
+import importlib
+
 
 def range_map(value, in_min, in_max, out_min, out_max, int_only=False):
     '''To map the value from a range to another'''
@@ -7,3 +9,9 @@ def range_map(value, in_min, in_max, out_min, out_max, int_only=False):
     if int_only:
         return int(new_value)
     return new_value
+
+
+def import_string(path):
+    ''' Object from its dotted path, 'package.module.name' '''
+    module, _, name = path.rpartition('.')
+    return getattr(importlib.import_module(module), name)
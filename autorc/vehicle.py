@@ -1,45 +1,316 @@
 import time
 import signal
 import logging
-from multiprocessing import Process
+import threading
 import multiprocessing
 from multiprocessing.managers import SyncManager
 
 from autorc.config import config
+from autorc.backends import get_backend
+from autorc.context import STOP_KEY, Context, ContextProxy
+from autorc.pipeline import find_pipelines, Pipeline
+from autorc.placement import SCHED_POLICIES, run_placed
+from autorc.supervisor import NodeWorker, Supervisor
 
 
 class VehicleManager(SyncManager):
     pass
 
 
+VehicleManager.register('Context', Context, ContextProxy)
+
+# Imported once by the forkserver, node processes fork with them loaded
+DEFAULT_PRELOAD = ('numpy', 'cv2', 'autorc.nodes',
+                   'autorc.context', 'autorc.backends')
+
+
 class Vehicle(object):
     ''' Managed non blocking node
         Node can subcribe to channels
+        context_backend: where context live, 'manager' (default), 'shm',
+        'redis' or a ContextBackend instance
+        node_mode: 'process' run each node in its own process, 'thread' run
+        nodes as threads of vehicle process (low core / low memory boards)
+        fuse_pipeline: run linear chains of nodes (camera -> pilot -> engine)
+        in a single process, each node feeding the next one directly
+        metrics: publish runtime metrics of every node under metrics/<node>
+        trace: trace camera frames through nodes, see autorc.tracing
+        start_method: multiprocessing start method of node processes,
+        'forkserver' fork them from a server which imported preload modules
+        once (default to DEFAULT_PRELOAD), None for platform default
+        ready_timeout: seconds start() wait for every node to finish its
+        start_up before entering main loop, 0 to not wait
+        shutdown_timeout: seconds a node has to stop and run its shutdown
+        hook, it is terminated after that (add_node to set it per node)
+        supervise: main loop restart dead or hung nodes and publish their
+        health, see autorc.supervisor
+        heartbeat_timeout: seconds without heartbeat a node is hung (add_node
+        to set it per node). Node classes may ask for more (heartbeat_timeout
+        class attribute, pilots)
+        max_restarts, restart_backoff: restarts in a row before giving up a
+        node, first restart delay (doubled on each restart)
     '''
+    terminate_timeout = 1.0     # Wait after terminate before kill
+
     def __init__(self, name='NoahCar', loglevel=logging.DEBUG,
-                 allow_remote=True, address='', port=9999,
-                 authkey: bytes=None):
+                 allow_remote=False, address='', port=9999,
+                 authkey: bytes=None, context_backend='manager',
+                 node_mode='process', fuse_pipeline=False, metrics=False,
+                 trace=False, start_method=None, preload=DEFAULT_PRELOAD,
+                 ready_timeout=30, shutdown_timeout=2.0, supervise=True,
+                 heartbeat_timeout=3.0, max_restarts=5, restart_backoff=0.5):
         self.processes = []
+        self.threads = []
+        self.workers = []       # NodeWorker
+        self.shutdown_timeout = shutdown_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.launch_times = {}  # Ready key: time worker was started
+        self.ready_timeout = ready_timeout
+        self.mp_context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver' and preload:
+            self.mp_context.set_forkserver_preload(list(preload))
+        self.node_mode = node_mode
+        self.fuse_pipeline = fuse_pipeline
+        self.metrics = metrics
+        self.trace = trace
+        self.pipelines = []
+        self.context_backend = get_backend(context_backend)
         logging.basicConfig(
             level=loglevel,
             format='%(levelname)s(%(processName)s): %(message)s. %(asctime)s')
         self.logger = logging.getLogger(self.__class__.__name__)
         self.name = name
         self.nodes = []
+        self.supervisor = None
+        if supervise:
+            self.supervisor = Supervisor(
+                self, start_timeout=ready_timeout or 30,
+                max_restarts=max_restarts, backoff=restart_backoff)
         # Remote manager
+        if allow_remote and not self.context_backend.remote:
+            self.logger.warning('%s context is local to this machine, '
+                                'remote vehicles can not join',
+                                self.context_backend)
+            allow_remote = False
         self.allow_remote = allow_remote
         self.address = address
         self.port = port
         self.authkey = authkey or multiprocessing.current_process().authkey
 
-    def add_node(self, node_cls, *args, **kwargs):
+    def add_node(self, node_cls, *args, mode=None, cpus=None, nice=None,
+                 sched=None, priority=None, threads=None,
+                 shutdown_timeout=None, heartbeat_timeout=None, **kwargs):
+        ''' Add node to vehicle, args and kwargs are passed to node
+            mode: 'process' or 'thread', default to vehicle node_mode
+            shutdown_timeout, heartbeat_timeout: default to vehicle ones
+            cpus, nice, sched, priority, threads: placement of the node
+            worker, see autorc.placement
+        '''
+        if sched is not None and sched not in SCHED_POLICIES:
+            raise Exception('Unknown sched policy %s, available: %s' % (
+                sched, ', '.join(SCHED_POLICIES)))
         kwargs['logger'] = self.logger
-        self.nodes.append((node_cls, args, kwargs))
+        if self.metrics:
+            kwargs.setdefault('metrics', True)
+        if self.trace:
+            kwargs.setdefault('trace', True)
+        if self.allow_remote:
+            # Remote nodes could not attach shared memory of this host
+            kwargs.setdefault('shared_memory', False)
+        placement = {
+            'cpus': set(cpus) if cpus is not None else None,
+            'nice': nice,
+            'sched': sched,
+            'priority': priority,
+            'threads': threads
+        }
+        if heartbeat_timeout is None:
+            heartbeat_timeout = max(self.heartbeat_timeout, getattr(
+                node_cls, 'heartbeat_timeout', None) or 0)
+        self.nodes.append((node_cls, args, kwargs, {
+            'mode': mode or self.node_mode,
+            'shutdown_timeout': shutdown_timeout or self.shutdown_timeout,
+            'heartbeat_timeout': heartbeat_timeout,
+            'placement': {key: value for key, value in placement.items()
+                          if value is not None}
+        }))
+
+    def worker_name(self, name):
+        names = {worker.name for worker in self.workers}
+        index = 2
+        unique_name = name
+        while unique_name in names:
+            unique_name = '%s.%d' % (name, index)
+            index += 1
+        return unique_name
+
+    def start_worker(self, name, target, args, mode, context,
+                     local_context=None, kwargs=None, placement=None,
+                     ready_keys=(), shutdown_timeout=None,
+                     heartbeat_timeout=None, heartbeat_key=None):
+        kwargs = kwargs or {}
+        if mode == 'thread':
+            args = (local_context or context, self.stop_event, *args)
+        else:
+            args = (context, self.stop_event, *args)
+        if placement:
+            args = (target, placement, mode == 'thread', *args)
+            target = run_placed
+        worker = NodeWorker(
+            name, mode, target, args, kwargs,
+            shutdown_timeout or self.shutdown_timeout,
+            heartbeat_timeout or self.heartbeat_timeout,
+            heartbeat_key, ready_keys)
+        self.workers.append(worker)
+        self.launch_worker(worker)
+
+    def launch_worker(self, worker):
+        self.logger.info('Starting %s up (%s)', worker, worker.mode)
+        # Values left by a previous run are not this worker's
+        stale = dict.fromkeys(worker.ready_keys, None)
+        stale.update((key + '/first_output', None)
+                     for key in worker.ready_keys)
+        if worker.heartbeat_key:
+            stale[worker.heartbeat_key] = None
+        self.context.update(stale)
+        launch_time = time.time()
+        for key in worker.ready_keys:
+            self.launch_times[key] = launch_time
+        worker.start(self.mp_context)
+        if worker.mode == 'thread':
+            self.threads.append(worker.worker)
+        else:
+            self.processes.append(worker.worker)
+
+    def restart_worker(self, worker):
+        ''' Start a new process / thread for a worker which failed '''
+        for workers in (self.processes, self.threads):
+            if worker.worker in workers:
+                workers.remove(worker.worker)
+        self.launch_worker(worker)
+
+    def release_worker(self, worker):
+        ''' Worker process / thread is gone, drop queues and demands its
+            nodes left in context (reader id is their ready key)
+        '''
+        if not callable(getattr(self.context, 'release_reader', None)):
+            return
+        for key in worker.ready_keys:
+            self.context.release_reader(key)
+
+    def make_ready_key(self, node_cls):
+        ''' startup/<vehicle>/<node>, vehicles sharing a context (remote
+            vehicle) do not see each other nodes ready
+        '''
+        name = node_cls.__name__
+        key = 'startup/%s/%s' % (self.name, name)
+        index = 2
+        while key in self.launch_times:
+            key = 'startup/%s/%s.%d' % (self.name, name, index)
+            index += 1
+        self.launch_times[key] = None
+        return key
+
+    def make_heartbeat_key(self, name):
+        return 'heartbeat/%s/%s' % (self.name, name)
+
+    def start_nodes(self, context, local_context=None):
+        ''' Start node processes and threads, they start up in parallel
+            Threads use local_context (no cross process transport) if given
+        '''
+        fused = set()
+        if self.fuse_pipeline:
+            for chain in find_pipelines(self.nodes):
+                name = self.worker_name(' -> '.join(
+                    self.nodes[index][0].__name__ for index, _ in chain))
+                stages = []
+                for index, callbacks in chain:
+                    node_cls, args, kwargs, options = self.nodes[index]
+                    kwargs = dict(kwargs, ready_key=self.make_ready_key(
+                        node_cls))
+                    if not stages:  # Head node loop drive the pipeline
+                        kwargs['heartbeat_key'] = self.make_heartbeat_key(
+                            name)
+                    stages.append((node_cls, args, kwargs, callbacks))
+                    fused.add(index)
+                self.pipelines.append(stages)
+                head_options = self.nodes[chain[0][0]][3]
+                self.start_worker(
+                    name, Pipeline.start, (stages, ), head_options['mode'],
+                    context, local_context,
+                    placement=head_options['placement'],
+                    ready_keys=[stage[2]['ready_key'] for stage in stages],
+                    shutdown_timeout=head_options['shutdown_timeout'],
+                    # Head loop wait for the slowest stage
+                    heartbeat_timeout=max(
+                        self.nodes[index][3]['heartbeat_timeout']
+                        for index, _ in chain),
+                    heartbeat_key=stages[0][2]['heartbeat_key'])
+        for index, (node_cls, args, kwargs, options) in enumerate(self.nodes):
+            if index not in fused:
+                name = self.worker_name(node_cls.__name__)
+                kwargs = dict(kwargs, ready_key=self.make_ready_key(node_cls),
+                              heartbeat_key=self.make_heartbeat_key(name))
+                self.start_worker(name, node_cls.start, args,
+                                  options['mode'], context, local_context,
+                                  kwargs, options['placement'],
+                                  [kwargs['ready_key']],
+                                  options['shutdown_timeout'],
+                                  options['heartbeat_timeout'],
+                                  kwargs['heartbeat_key'])
+
+    def wait_ready(self, timeout=None):
+        ''' Readiness barrier: wait until every node finished start_up
+            Return {ready key: seconds from launch to ready, None if not}
+        '''
+        timeout = self.ready_timeout if timeout is None else timeout
+        keys = tuple(self.launch_times)
+        deadline = time.monotonic() + timeout
+        version = 0
+        while True:
+            pending = [key for key in keys if self.context.get(key) is None]
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            if any(worker.exitcode is not None for worker in self.processes):
+                self.logger.error('Node process exited during start up')
+                break
+            if callable(getattr(self.context, 'wait', None)):
+                version = self.context.wait(pending, version,
+                                            min(remaining, 0.5))
+            else:
+                time.sleep(min(remaining, 0.05))
+        report = self.startup_report()
+        for key, times in report.items():
+            if times['ready'] is None:
+                self.logger.warning('%s not ready after %.1fs', key, timeout)
+            else:
+                self.logger.info(
+                    '%s ready in %.3fs, first output %s', key, times['ready'],
+                    'pending' if times['first_output'] is None
+                    else '%.3fs' % times['first_output'])
+        return {key: times['ready'] for key, times in report.items()}
+
+    def startup_report(self):
+        ''' {ready key: {'ready': time to ready, 'first_output': time to
+            first output}} in seconds from worker launch, None if not yet
+        '''
+        report = {}
+        for key, launch_time in self.launch_times.items():
+            times = {}
+            for name, value in (
+                    ('ready', self.context.get(key)),
+                    ('first_output', self.context.get(key + '/first_output'))):
+                times[name] = None if value is None else value - launch_time
+            report[key] = times
+        return report
 
     def main_loop(self):
         try:
             while True:
-                time.sleep(1)
+                time.sleep(0.5)
+                if self.supervisor is not None:
+                    self.supervisor.check()
         except KeyboardInterrupt:
             return
 
@@ -60,21 +331,22 @@ class Vehicle(object):
         # Start up nodes process
         with VehicleManager(**manager_opts) as manager:
             self.manager = manager
-            self.stop_event = manager.Event()
-            self.context = manager.dict(vehicle_name=self.name)
+            self.stop_event = self.mp_context.Event()
+            self.context = self.context_backend.start(self, local=any(
+                options['mode'] == 'thread'
+                for node_cls, args, kwargs, options in self.nodes))
+            self.logger.info('Context backend: %s', self.context_backend)
             if self.allow_remote:
-                ctx_holder = manager.get_context_holder()
-                ctx_holder.update({'context': self.context})
-
-            # TODO: report error if process unable to start. Node failed
-            for node_cls, args, kwargs in self.nodes:
-                p = Process(target=node_cls.start,
-                            args=(self.context, self.stop_event, *args),
-                            kwargs=kwargs)
-                p.daemon = True
-                self.processes.append(p)
-                self.logger.info('Starting %s up', node_cls)
-                p.start()
+                try:
+                    ctx_holder = manager.get_context_holder()
+                    ctx_holder.update({'context': self.context})
+                except Exception:
+                    self.context_backend.shutdown()
+                    raise
+
+            self.start_nodes(self.context, self.context_backend.local_context)
+            if self.ready_timeout:
+                self.wait_ready()
 
             # Begin main vehicle loop?
             signal.signal(signal.SIGINT, original_sigint_handler)
@@ -83,19 +355,55 @@ class Vehicle(object):
                 print('Sync Server: %s:%s' % (self.address, self.port))
                 print('Auth:', self.authkey)
             self.main_loop()
-            self.stop_event.set()
             self.shutdown()
 
     def shutdown(self):
+        ''' Stop nodes and wait for them, each up to its shutdown timeout
+            so their shutdown hooks run. Processes still alive after that are
+            terminated, then killed. Threads can only be left running.
+            Return {worker name: (seconds to stop, how)}, how is stopped,
+            terminated, killed or running
+        '''
         print('Shutting down.')
-        # Waiting for all process to stop on it self
-        time.sleep(2)
-        for p in self.processes:
-            try:
-                p.terminate()
-            except Exception as ex:
-                self.logger.error(ex)
-                pass
+        stop_time = time.monotonic()
+        self.stop_event.set()
+        try:
+            self.context.update({STOP_KEY: True})   # Wake up waiting nodes
+        except Exception as ex:
+            self.logger.warning('Could not wake up nodes: %s', ex)
+        report = {}
+        pending = list(self.workers)
+        while pending:
+            now = time.monotonic()
+            for worker in list(pending):
+                how = 'stopped'
+                if worker.is_alive():
+                    if now - stop_time < worker.shutdown_timeout:
+                        continue
+                    how = self.stop_worker(worker.worker)
+                report[worker.name] = (time.monotonic() - stop_time, how)
+                pending.remove(worker)
+            if pending:
+                time.sleep(0.01)
+        for name, (duration, how) in report.items():
+            log = self.logger.info if how == 'stopped' else self.logger.error
+            log('%s %s in %.3fs', name, how, duration)
+        self.context_backend.shutdown()
+        self.context = None
+        self.shutdown_report = report
+        return report
+
+    def stop_worker(self, worker):
+        ''' Worker missed its shutdown deadline, terminate then kill it '''
+        if isinstance(worker, threading.Thread):
+            return 'running'
+        worker.terminate()
+        worker.join(self.terminate_timeout)
+        if not worker.is_alive():
+            return 'terminated'
+        worker.kill()
+        worker.join()
+        return 'killed'
 
 
 class RemoteVehicle(Vehicle):
@@ -120,17 +428,10 @@ class RemoteVehicle(Vehicle):
         # Start up nodes process
         with VehicleManager() as manager:
             self.manager = manager
-            self.stop_event = manager.Event()
-
-            # TODO: report error if process unable to start. Node failed
-            for node_cls, args, kwargs in self.nodes:
-                p = Process(target=node_cls.start,
-                            args=(self.context, self.stop_event, *args),
-                            kwargs=kwargs)
-                p.daemon = True
-                self.processes.append(p)
-                self.logger.info('Starting %s up', node_cls)
-                p.start()
+            self.stop_event = self.mp_context.Event()
+            self.start_nodes(self.context)
+            if self.ready_timeout:
+                self.wait_ready()
 
             # Begin main vehicle loop?
             signal.signal(signal.SIGINT, original_sigint_handler)
@@ -139,5 +440,4 @@ class RemoteVehicle(Vehicle):
                 print('Server: %s:%s' % (self.address, self.port))
                 print('Auth:', self.authkey)
             self.main_loop()
-            self.stop_event.set()
             self.shutdown()
@@ -0,0 +1,24 @@
+''' Performance benchmarks, run from repository root:
+    python -m benchmarks.<name>
+'''
+import time
+
+
+def percentile(values, percent):
+    ''' Nearest rank percentile of a list '''
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * len(values))))
+    return values[index]
+
+
+def ops_per_sec(func, duration=1.0):
+    ''' Call func repeatedly for duration seconds, return calls per second '''
+    count = 0
+    start_time = time.perf_counter()
+    end_time = start_time + duration
+    while time.perf_counter() < end_time:
+        func()
+        count += 1
+    return count / (time.perf_counter() - start_time)
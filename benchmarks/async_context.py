@@ -0,0 +1,148 @@
+''' Control latency of an async node under MJPEG load
+    python -m benchmarks.async_context [--clients 4] [--duration 3]
+
+    Mimic WebController: MJPEG client tasks read the latest jpeg from
+    context at stream frame rate while a websocket thread push steering
+    messages into the event loop. Control latency is the time between a
+    message arriving and its context update being done, loop lag is how
+    late a 5ms timer fire (any other websocket traffic wait that long).
+    Compare coroutines calling the blocking proxy with AsyncContext.
+'''
+import argparse
+import asyncio
+import threading
+import time
+from multiprocessing import Process, Event
+
+from autorc.context import AsyncContext
+from autorc.vehicle import VehicleManager
+from benchmarks import percentile
+
+
+class BlockingContext(object):
+    ''' Same coroutine interface, blocking proxy call in event loop '''
+    def __init__(self, context):
+        self.context = context
+
+    async def get(self, key, default=None):
+        return self.context.get(key, default)
+
+    async def update(self, *args, **kwargs):
+        return self.context.update(*args, **kwargs)
+
+    def close(self):
+        pass
+
+
+def camera(context, stop_event, frame_size, framerate):
+    frame = b'\xff' * frame_size
+    while not stop_event.is_set():
+        context.update({'cam/image-jpeg': frame,
+                        'cam/image-jpeg__timestamp': time.time()})
+        time.sleep(1.0 / framerate)
+
+
+def load(context, stop_event):
+    ''' Other node processes talking to the manager '''
+    while not stop_event.is_set():
+        context.get('cam/image-jpeg__timestamp')
+
+
+async def mjpeg_client(context, stop, frame_rate):
+    while not stop.is_set():
+        await context.get('cam/image-jpeg')
+        await asyncio.sleep(1.0 / frame_rate)
+
+
+async def controller(context, messages, latencies, stop):
+    while not stop.is_set():
+        sent_time, value = await messages.get()
+        await context.update({'user/steering': value})
+        latencies.append(time.time() - sent_time)
+
+
+async def heartbeat(lags, stop, interval=0.005):
+    while not stop.is_set():
+        start_time = time.time()
+        await asyncio.sleep(interval)
+        lags.append(time.time() - start_time - interval)
+
+
+def websocket(loop, messages, stop_event, rate):
+    while not stop_event.is_set():
+        loop.call_soon_threadsafe(
+            messages.put_nowait, (time.time(), 0.1))
+        time.sleep(1.0 / rate)
+
+
+def bench(context, clients, duration, frame_rate, message_rate):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    stop = asyncio.Event()
+    messages = asyncio.Queue()
+    latencies = []
+    lags = []
+    stop_event = threading.Event()
+    sender = threading.Thread(target=websocket, args=(
+        loop, messages, stop_event, message_rate))
+
+    async def run():
+        tasks = [asyncio.ensure_future(mjpeg_client(context, stop, frame_rate))
+                 for i in range(clients)]
+        tasks.append(asyncio.ensure_future(
+            controller(context, messages, latencies, stop)))
+        tasks.append(asyncio.ensure_future(heartbeat(lags, stop)))
+        sender.start()
+        await asyncio.sleep(duration)
+        stop.set()
+        stop_event.set()
+        messages.put_nowait((time.time(), 0))
+        await asyncio.gather(*tasks)
+
+    loop.run_until_complete(run())
+    sender.join()
+    context.close()
+    loop.close()
+    return latencies, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--frame-size', type=int, default=50000)
+    parser.add_argument('--frame-rate', type=int, default=24)
+    parser.add_argument('--message-rate', type=int, default=50)
+    parser.add_argument('--load', type=int, default=4,
+                        help='Processes keeping the manager busy')
+    args = parser.parse_args()
+    print('%-10s %9s %9s %9s %9s %9s %9s' % (
+        'context', 'messages', 'p50 ms', 'p95 ms', 'max ms',
+        'lag p95', 'lag max'))
+    with VehicleManager() as manager:
+        context = manager.Context()
+        stop_event = Event()
+        writer = Process(target=camera, args=(
+            context, stop_event, args.frame_size, 20))
+        writer.start()
+        loaders = [Process(target=load, args=(context, stop_event))
+                   for i in range(args.load)]
+        for loader in loaders:
+            loader.start()
+        for name, client_cls in (('blocking', BlockingContext),
+                                 ('async', AsyncContext)):
+            latencies, lags = bench(client_cls(context), args.clients,
+                                    args.duration, args.frame_rate,
+                                    args.message_rate)
+            print('%-10s %9d %9.3f %9.3f %9.3f %9.3f %9.3f' % (
+                name, len(latencies), percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000, max(latencies) * 1000,
+                percentile(lags, 95) * 1000, max(lags) * 1000))
+        stop_event.set()
+        writer.join()
+        for loader in loaders:
+            loader.join()
+
+
+if __name__ == '__main__':
+    main()
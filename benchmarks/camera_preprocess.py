@@ -0,0 +1,75 @@
+''' CVWebCam per frame CPU time and allocations, before / after one pass
+    preprocessing
+    python -m benchmarks.camera_preprocess [--frames 100] [--fps 20]
+
+    Synthetic 320x240 BGR frames at --fps, outputs of the default profile:
+    160x160 jpeg and 120x160 RGB numpy frame. "before" resize the captured
+    frame for each output then convert color (previous CVWebCam), "after"
+    is CVWebCam.preprocess. JPEG encoding is left out, same for both.
+    Allocations are counted with tracemalloc (numpy arrays included).
+'''
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from autorc.context import Context
+from autorc.nodes.camera import CVWebCam
+from benchmarks import percentile
+
+
+def before(camera, frame):
+    jpeg = cv2.resize(frame, camera.jpeg_size, interpolation=cv2.INTER_LINEAR)
+    array = cv2.resize(frame, (camera.numpy_size[1], camera.numpy_size[0]),
+                       interpolation=cv2.INTER_LINEAR)
+    return jpeg, cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+
+
+def after(camera, frame):
+    return camera.preprocess(frame)
+
+
+def run(func, camera, frames, fps):
+    cpu = []
+    allocations = []
+    allocated = []
+    tracemalloc.start()
+    for frame in frames:
+        next_frame = time.monotonic() + 1.0 / fps
+        tracemalloc.clear_traces()
+        snapshot = tracemalloc.take_snapshot()
+        start_time = time.process_time()
+        func(camera, frame)
+        cpu.append(time.process_time() - start_time)
+        stats = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+        allocations.append(sum(max(stat.count_diff, 0) for stat in stats))
+        allocated.append(sum(max(stat.size_diff, 0) for stat in stats))
+        time.sleep(max(0, next_frame - time.monotonic()))
+    tracemalloc.stop()
+    return cpu, allocations, allocated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--fps', type=float, default=20)
+    args = parser.parse_args()
+    camera = CVWebCam(Context(), capture_size=(320, 240),
+                      jpeg_size=(160, 160), numpy_size=(120, 160))
+    camera.cv2 = cv2
+    frames = [np.random.randint(0, 255, (240, 320, 3), dtype=np.uint8)
+              for i in range(args.frames)]
+    print('%-8s %12s %12s %14s %14s' % (
+        'path', 'cpu p50 us', 'cpu p99 us', 'allocs/frame', 'bytes/frame'))
+    for name, func in (('before', before), ('after', after)):
+        cpu, allocations, allocated = run(func, camera, frames, args.fps)
+        print('%-8s %12.1f %12.1f %14.1f %14.0f' % (
+            name, percentile(cpu, 50) * 1e6, percentile(cpu, 99) * 1e6,
+            sum(allocations[1:]) / (len(frames) - 1),
+            sum(allocated[1:]) / (len(frames) - 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+''' Context value codecs: bytes on the wire, encode / decode time
+    python -m benchmarks.codec [--duration 0.3]
+
+    One row per codec and value type found in a car context: control
+    scalars, flags, steering / throttle tuples, jpeg bytes and raw numpy
+    frames.
+'''
+import argparse
+import time
+
+import numpy as np
+
+from autorc.codec import PickleCodec, CompactCodec
+from benchmarks import ops_per_sec
+
+
+VALUES = (
+    ('float', 0.35),
+    ('bool', True),
+    ('int', 1024),
+    ('str', 'local_angle'),
+    ('tuple(2)', (0.35, 0.6)),
+    ('timestamp', time.time()),
+    ('jpeg 12KB', b'\xff' * 12000),
+    ('uint8 160x120x3', np.zeros((120, 160, 3), dtype=np.uint8)),
+    ('float32 66x200x3', np.zeros((66, 200, 3), dtype=np.float32)),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=0.3)
+    args = parser.parse_args()
+    print('%-18s %-8s %9s %11s %11s' % (
+        'value', 'codec', 'bytes', 'encode us', 'decode us'))
+    for name, value in VALUES:
+        for codec in (PickleCodec(), CompactCodec()):
+            data = codec.encode(value)
+            encode = ops_per_sec(lambda: codec.encode(value), args.duration)
+            decode = ops_per_sec(lambda: codec.decode(data), args.duration)
+            print('%-18s %-8s %9d %11.2f %11.2f' % (
+                name, repr(codec)[:-5].lower(), len(data),
+                1e6 / encode, 1e6 / decode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+''' Compare context backends: ops/sec and frame latency
+    python -m benchmarks.context_backends [--duration 1] [--frame-size 12000]
+
+    ops/sec are measured from the main process, frame latency is the time
+    between a writer process publishing a frame and a reader process
+    (sleeping in context.wait) getting it.
+'''
+import argparse
+import time
+from multiprocessing import Process, Event, Queue
+
+from autorc.backends import ManagerBackend, SharedMemoryBackend, RedisBackend
+from autorc.vehicle import VehicleManager
+from benchmarks import percentile, ops_per_sec
+
+
+class BenchVehicle(object):
+    name = 'Benchmark'
+
+
+def frame_writer(context, stop_event, frame_size, framerate):
+    frame = b'\xff' * frame_size
+    while not stop_event.is_set():
+        now = time.time()
+        context.update({'cam/image-jpeg': frame,
+                        'cam/image-jpeg__timestamp': now})
+        time.sleep(1.0 / framerate)
+
+
+def frame_reader(context, stop_event, result):
+    latencies = []
+    since = context.version()
+    while not stop_event.is_set():
+        since = context.wait(('cam/image-jpeg', ), since, 0.5)
+        values, versions = context.snapshot(
+            ('cam/image-jpeg', ), None, ('cam/image-jpeg__timestamp', ))
+        if values[0] is not None:
+            latencies.append(time.time() - values[1])
+    result.put(latencies)
+
+
+def bench_backend(backend, duration, frame_size, framerate):
+    with VehicleManager() as manager:
+        vehicle = BenchVehicle()
+        vehicle.manager = manager
+        context = backend.start(vehicle)
+        try:
+            context.update({'user/steering': 0.0, 'user/throttle': 0.0})
+            stats = {
+                'set': ops_per_sec(lambda: context.update({
+                    'user/steering': 0.1,
+                    'user/steering__timestamp': time.time()}), duration),
+                'get': ops_per_sec(
+                    lambda: context.get('user/steering'), duration),
+                'snapshot(3)': ops_per_sec(lambda: context.snapshot(
+                    ('user/steering', 'user/throttle', 'vehicle_name')),
+                    duration),
+            }
+            stop_event = Event()
+            result = Queue()
+            reader = Process(target=frame_reader,
+                             args=(context, stop_event, result))
+            writer = Process(target=frame_writer, args=(
+                context, stop_event, frame_size, framerate))
+            reader.start()
+            time.sleep(0.2)
+            writer.start()
+            time.sleep(max(duration * 2, 2))
+            stop_event.set()
+            latencies = result.get()
+            reader.join()
+            writer.join()
+            stats['frames'] = len(latencies)
+            stats['p50'] = percentile(latencies, 50) * 1000
+            stats['p95'] = percentile(latencies, 95) * 1000
+            return stats
+        finally:
+            backend.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=1.0)
+    parser.add_argument('--frame-size', type=int, default=12000,
+                        help='Frame payload bytes (jpeg 160x120 ~ 12KB)')
+    parser.add_argument('--framerate', type=int, default=20)
+    args = parser.parse_args()
+
+    backends = (
+        ('manager', ManagerBackend()),
+        ('shm', SharedMemoryBackend(value_size=args.frame_size + 1024)),
+        ('redis (RespServer)', RedisBackend(port=0, serve=True)),
+    )
+    print('%-20s %10s %10s %12s %8s %9s %9s' % (
+        'backend', 'set/s', 'get/s', 'snapshot/s', 'frames',
+        'p50 ms', 'p95 ms'))
+    for name, backend in backends:
+        stats = bench_backend(backend, args.duration, args.frame_size,
+                              args.framerate)
+        print('%-20s %10.0f %10.0f %12.0f %8d %9.2f %9.2f' % (
+            name, stats['set'], stats['get'], stats['snapshot(3)'],
+            stats['frames'], stats['p50'], stats['p95']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+''' Loop jitter of a node under CPU load, per placement
+    python -m benchmarks.jitter [--duration 3] [--rate 60] [--load 2]
+
+    A 60Hz RateScheduler loop (the node loop) run in its own process while
+    busy processes load every CPU. Each placement report tick lateness
+    (start past deadline) percentiles in ms and ticks skipped. Negative nice
+    and fifo need root or CAP_SYS_NICE, they are reported as not applied
+    otherwise.
+'''
+import argparse
+import multiprocessing
+import os
+import time
+
+from autorc.placement import apply_placement
+from autorc.scheduler import RateScheduler
+from benchmarks import percentile
+
+
+PLACEMENTS = (
+    ('default', {}),
+    ('nice -5', {'nice': -5}),
+    ('fifo', {'sched': 'fifo'}),
+    ('cpus {0} fifo', {'cpus': {0}, 'sched': 'fifo'}),
+)
+
+
+def busy(stop_event):
+    while not stop_event.is_set():
+        sum(range(10000))
+
+
+def node_loop(placement, rate, duration, work, results):
+    applied = apply_placement(**placement)
+    scheduler = RateScheduler(rate)
+    lateness = []
+    scheduler.start()
+    end_time = time.monotonic() + duration
+    while time.monotonic() < end_time:
+        if scheduler.due():
+            lateness.append(scheduler.lateness)
+            work_end = time.perf_counter() + work
+            while time.perf_counter() < work_end:
+                pass
+            scheduler.done()
+        time.sleep(scheduler.remaining())
+    results.put((applied, lateness, scheduler.skipped))
+
+
+def run(placement, args):
+    stop_event = multiprocessing.Event()
+    loaders = [multiprocessing.Process(target=busy, args=(stop_event, ))
+               for i in range(args.load)]
+    for loader in loaders:
+        loader.start()
+    results = multiprocessing.Queue()
+    node = multiprocessing.Process(target=node_loop, args=(
+        placement, args.rate, args.duration, args.work / 1000, results))
+    node.start()
+    result = results.get()
+    node.join()
+    stop_event.set()
+    for loader in loaders:
+        loader.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--rate', type=float, default=60)
+    parser.add_argument('--load', type=int, default=os.cpu_count() * 2,
+                        help='Busy processes, default 2 per cpu')
+    parser.add_argument('--work', type=float, default=2,
+                        help='CPU time of a tick in ms')
+    args = parser.parse_args()
+    print('%d Hz loop, %d busy processes, %d cpus' % (
+        args.rate, args.load, os.cpu_count()))
+    print('%-16s %-8s %8s %8s %8s %8s %8s' % (
+        'placement', 'applied', 'ticks', 'p50 ms', 'p99 ms', 'max ms',
+        'skipped'))
+    for name, placement in PLACEMENTS:
+        applied, lateness, skipped = run(placement, args)
+        ok = all(key in applied for key in placement)
+        print('%-16s %-8s %8d %8.3f %8.3f %8.3f %8d' % (
+            name, 'yes' if ok else 'no', len(lateness),
+            percentile(lateness, 50) * 1000,
+            percentile(lateness, 99) * 1000,
+            max(lateness) * 1000, skipped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+''' Compare process and thread node modes: message round trips and memory
+    python -m benchmarks.node_modes [--duration 3]
+
+    A ping node and a pong node bounce a timestamp through the context, the
+    vehicle report round trips per second, round trip latency and total
+    resident memory of vehicle process and its children (Linux only).
+'''
+import argparse
+import logging
+import os
+import time
+
+from autorc.nodes import Node
+from autorc.vehicle import Vehicle
+from benchmarks import percentile
+
+
+class PingNode(Node):
+    def __init__(self, context, **kwargs):
+        super(PingNode, self).__init__(context, inputs={
+            'on_pong': 'bench/pong'
+        }, outputs={
+            'on_pong': 'bench/ping'
+        }, **kwargs)
+        self.latencies = []
+
+    def start_up(self):
+        time.sleep(0.5)     # Let pong node start
+        self.update('bench/ping', time.time())
+
+    def on_pong(self, sent_time):
+        self.latencies.append(time.time() - sent_time)
+        if len(self.latencies) % 100 == 0:
+            self.update('bench/stats',
+                        (len(self.latencies), self.latencies[-1000:]))
+        return time.time()
+
+
+class PongNode(Node):
+    def __init__(self, context, **kwargs):
+        super(PongNode, self).__init__(context, inputs={
+            'on_ping': 'bench/ping'
+        }, outputs={
+            'on_ping': 'bench/pong'
+        }, **kwargs)
+
+    def on_ping(self, sent_time):
+        return sent_time
+
+
+def rss_kb(pid):
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class BenchVehicle(Vehicle):
+    def __init__(self, duration, **kwargs):
+        super(BenchVehicle, self).__init__(
+            allow_remote=False, loglevel=logging.WARNING, **kwargs)
+        self.duration = duration
+
+    def main_loop(self):
+        time.sleep(1)
+        start_count, _ = self.context.get('bench/stats', (0, []))
+        time.sleep(self.duration)
+        count, self.latencies = self.context.get('bench/stats', (0, []))
+        self.round_trips = (count - start_count) / self.duration
+        self.rss = rss_kb(os.getpid()) + sum(
+            rss_kb(p.pid) for p in self.processes)
+        if self.manager is not None:
+            self.rss += rss_kb(self.manager._process.pid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=3)
+    args = parser.parse_args()
+    print('%-10s %12s %9s %9s %10s' % (
+        'mode', 'round trip/s', 'p50 ms', 'p95 ms', 'RSS MB'))
+    for mode in ('process', 'thread'):
+        vehicle = BenchVehicle(args.duration, node_mode=mode)
+        vehicle.add_node(PingNode)
+        vehicle.add_node(PongNode)
+        vehicle.start()
+        print('%-10s %12.0f %9.3f %9.3f %10.1f' % (
+            mode, vehicle.round_trips,
+            percentile(vehicle.latencies, 50) * 1000,
+            percentile(vehicle.latencies, 95) * 1000,
+            vehicle.rss / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+''' PGWebCam resize frames per second at the supported capture resolutions
+    python -m benchmarks.pg_resize [--duration 1] [--size 160x120]
+
+    Random RGB frames of each resolution are resized to --size. "uint8" is
+    PGWebCam.resize (integer area average into reused buffers), "skimage"
+    the previous float resize, reported when scikit-image is installed.
+'''
+import argparse
+
+import numpy as np
+
+from autorc.context import Context
+from autorc.nodes.camera import PGWebCam
+from benchmarks import ops_per_sec
+
+RESOLUTIONS = ((160, 120), (176, 144), (320, 240), (352, 288), (640, 480),
+               (1024, 768), (1280, 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=1.0)
+    parser.add_argument('--size', default='160x120', help='Output WxH')
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.size.split('x'))
+    try:
+        from skimage.transform import resize
+    except ImportError:
+        resize = None
+    camera = PGWebCam(Context())
+    dst = np.empty((height, width, 3), dtype=np.uint8)
+    print('%-10s %12s %12s' % ('capture', 'uint8 fps', 'skimage fps'))
+    for capture_width, capture_height in RESOLUTIONS:
+        frame = np.random.randint(0, 255, (capture_height, capture_width, 3),
+                                  dtype=np.uint8)
+        fps = ops_per_sec(lambda: camera.resize(frame, dst), args.duration)
+        if resize is None:
+            skimage_fps = 'n/a'
+        else:
+            skimage_fps = '%.1f' % ops_per_sec(lambda: resize(
+                frame, dst.shape[:2], mode='reflect', anti_aliasing=False,
+                preserve_range=True), args.duration)
+        print('%-10s %12.1f %12s' % ('%dx%d' % (capture_width, capture_height),
+                                     fps, skimage_fps))
+
+
+if __name__ == '__main__':
+    main()
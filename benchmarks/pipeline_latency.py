@@ -0,0 +1,98 @@
+''' Glass to servo latency of camera -> pilot -> engine, fused or not
+    python -m benchmarks.pipeline_latency [--duration 5] [--framerate 20]
+
+    Fake nodes with the same shape as CVWebCam, KerasSteeringPilot and
+    Engine: camera publish a 120x160 frame with its capture time, pilot
+    reduce the frame to a steering value, engine measure the time between
+    capture and the moment it would turn the wheels.
+'''
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from autorc.nodes import Node
+from autorc.vehicle import Vehicle
+from benchmarks import percentile
+
+
+class FakeCamera(Node):
+    outputs = ('cam/image-np', 'cam/capture-time')
+    shared_outputs = ('cam/image-np', )
+
+    def __init__(self, context, framerate=20, **kwargs):
+        super(FakeCamera, self).__init__(
+            context, process_rate=framerate, **kwargs)
+        self.frame = np.zeros((120, 160, 3), dtype=np.uint8)
+
+    def process_loop(self):
+        return self.frame, time.time()
+
+
+class FakePilot(Node):
+    inputs = {
+        'process_loop': ('cam/image-np', 'cam/capture-time')
+    }
+    outputs = {
+        'process_loop': ('pilot/steering', 'pilot/capture-time')
+    }
+
+    def process_loop(self, image, capture_time):
+        return float(image[::8, ::8].mean()), capture_time
+
+
+class FakeEngine(Node):
+    inputs = {
+        'on_pilot_steering': ('pilot/steering', 'pilot/capture-time'),
+        'on_user_steering': 'user/steering'
+    }
+
+    def __init__(self, context, **kwargs):
+        super(FakeEngine, self).__init__(context, **kwargs)
+        self.latencies = []
+
+    def on_pilot_steering(self, steering, capture_time):
+        self.latencies.append(time.time() - capture_time)
+        if len(self.latencies) % 10 == 0:
+            self.update('bench/latencies', self.latencies)
+
+    def on_user_steering(self, steering):
+        pass
+
+
+class BenchVehicle(Vehicle):
+    def __init__(self, duration, **kwargs):
+        super(BenchVehicle, self).__init__(
+            allow_remote=False, loglevel=logging.WARNING, **kwargs)
+        self.duration = duration
+
+    def main_loop(self):
+        time.sleep(1)
+        skip = len(self.context.get('bench/latencies', ()))
+        time.sleep(self.duration)
+        self.latencies = self.context.get('bench/latencies', [])[skip:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--framerate', type=int, default=20)
+    args = parser.parse_args()
+    print('%-10s %8s %9s %9s %9s' % (
+        'pipeline', 'frames', 'p50 ms', 'p95 ms', 'max ms'))
+    for fuse_pipeline in (False, True):
+        vehicle = BenchVehicle(args.duration, fuse_pipeline=fuse_pipeline)
+        vehicle.add_node(FakeCamera, framerate=args.framerate)
+        vehicle.add_node(FakePilot)
+        vehicle.add_node(FakeEngine)
+        vehicle.start()
+        latencies = vehicle.latencies or [0]
+        print('%-10s %8d %9.3f %9.3f %9.3f' % (
+            'fused' if fuse_pipeline else 'separate', len(vehicle.latencies),
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000, max(latencies) * 1000))
+
+
+if __name__ == '__main__':
+    main()
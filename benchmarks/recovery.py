@@ -0,0 +1,82 @@
+''' Recovery time of a crashed or hung node under the vehicle supervisor
+    python -m benchmarks.recovery [--rounds 3] [--interval 0.5]
+
+    A node publishing at 20Hz is made to exit (crash) or block in its
+    callback (hang) --rounds times in a row. Report seconds from the failure
+    to its first output once restarted. Restart delay doubles each round,
+    hang also wait --heartbeat-timeout before being detected.
+'''
+import argparse
+import logging
+import os
+import time
+
+from autorc.nodes import Node
+from autorc.vehicle import Vehicle
+
+
+class FailingNode(Node):
+    def __init__(self, context, failure, **kwargs):
+        super(FailingNode, self).__init__(context, outputs={
+            'process_loop': 'bench/alive'
+        }, process_rate=20, **kwargs)
+        self.failure = failure
+
+    def start_up(self):
+        self.failures = self.context.get('bench/fail') or 0
+
+    def process_loop(self):
+        if (self.context.get('bench/fail') or 0) > self.failures:
+            self.context.update({'bench/failed': time.time()})
+            if self.failure == 'crash':
+                os._exit(1)
+            time.sleep(60)
+        return time.time()
+
+
+class RecoveryVehicle(Vehicle):
+    def __init__(self, rounds, interval, **kwargs):
+        super(RecoveryVehicle, self).__init__(**kwargs)
+        self.rounds = rounds
+        self.interval = interval
+
+    def main_loop(self):
+        self.recovery = []
+        for index in range(self.rounds):
+            self.context.update({'bench/fail': index + 1})
+            failed = None
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                time.sleep(self.interval)
+                self.supervisor.check()
+                failed = failed or self.context.get('bench/failed')
+                alive = self.context.get('bench/alive')
+                if failed and alive and alive > failed:
+                    self.recovery.append(alive - failed)
+                    break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='Supervisor check interval')
+    parser.add_argument('--backoff', type=float, default=0.5)
+    parser.add_argument('--heartbeat-timeout', type=float, default=3.0)
+    args = parser.parse_args()
+    print('%-8s %s' % ('failure', 'recovery s per round'))
+    for failure in ('crash', 'hang'):
+        vehicle = RecoveryVehicle(
+            args.rounds, args.interval, allow_remote=False,
+            loglevel=logging.WARNING, restart_backoff=args.backoff,
+            max_restarts=args.rounds,
+            heartbeat_timeout=args.heartbeat_timeout)
+        vehicle.logger.setLevel(logging.CRITICAL)
+        vehicle.add_node(FailingNode, failure)
+        vehicle.start()
+        print('%-8s %s' % (failure, ' '.join(
+            '%.2f' % seconds for seconds in vehicle.recovery)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+''' Vehicle startup time per start method: time to ready, first frame
+    python -m benchmarks.startup [--nodes 4] [--preload numpy,autorc.nodes]
+
+    A frame node and --nodes relay nodes, each process importing numpy at
+    start up like camera / pilot nodes import cv2, numpy and keras. Report
+    per node time from launch to ready (start_up done) and to first output,
+    and total time until every node published.
+'''
+import argparse
+import importlib
+import logging
+import time
+
+from autorc.nodes import Node
+from autorc.vehicle import Vehicle
+
+
+class FrameNode(Node):
+    def __init__(self, context, **kwargs):
+        super(FrameNode, self).__init__(context, outputs={
+            'process_loop': 'bench/frame'
+        }, process_rate=60, **kwargs)
+
+    def start_up(self):
+        self.np = importlib.import_module('numpy')
+
+    def process_loop(self):
+        return self.np.zeros((120, 160, 3), dtype=self.np.uint8)
+
+
+class RelayNode(Node):
+    def __init__(self, context, index, **kwargs):
+        super(RelayNode, self).__init__(context, inputs={
+            'on_frame': 'bench/frame'
+        }, outputs={
+            'on_frame': 'bench/relay%d' % index
+        }, **kwargs)
+
+    def start_up(self):
+        self.np = importlib.import_module('numpy')
+
+    def on_frame(self, frame):
+        return int(self.np.mean(frame[::8, ::8]))
+
+
+class StartupVehicle(Vehicle):
+    def main_loop(self):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            self.report = self.startup_report()
+            if all(times['first_output'] is not None
+                   for times in self.report.values()):
+                break
+            time.sleep(0.01)
+
+
+def run(start_method, args):
+    vehicle = StartupVehicle(
+        allow_remote=False, loglevel=logging.WARNING,
+        start_method=start_method, preload=args.preload.split(','))
+    vehicle.logger.setLevel(logging.WARNING)
+    vehicle.add_node(FrameNode)
+    for index in range(args.nodes):
+        vehicle.add_node(RelayNode, index)
+    vehicle.start()
+    return vehicle.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--preload', default='numpy,autorc.nodes')
+    args = parser.parse_args()
+    print('%-12s %-22s %10s %16s' % (
+        'method', 'node', 'ready ms', 'first output ms'))
+    for start_method in ('fork', 'spawn', 'forkserver'):
+        report = run(start_method, args)
+        for key, times in sorted(report.items()):
+            print('%-12s %-22s %10.1f %16.1f' % (
+                start_method, key.split('/', 2)[-1], times['ready'] * 1000,
+                times['first_output'] * 1000))
+        print('%-12s %-22s %27.1f' % (
+            start_method, 'all published', max(
+                times['first_output'] for times in report.values()) * 1000))
+
+
+if __name__ == '__main__':
+    main()
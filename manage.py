@@ -36,20 +36,54 @@ def reset_servo(args):
         servo.write(90)
 
 
-def start(args):
-    ''' Run a vehicle profile '''
-    profile = args.profile
+def load_vehicle(profile):
+    ''' Vehicle instance of a profile, None if profile has none '''
+    if profile not in get_profiles():
+        print('Unknown profile', profile)
+        list_profile(None)
+        return None
     mod = importlib.import_module('autorc.profiles.' + profile)
     if not hasattr(mod, 'vehicle'):
         print('Profile', profile, 'does not has vehicle instance')
-    else:
-        print('Start', profile, 'vehicle.')
-        getattr(mod, 'vehicle').start()
+        return None
+    return getattr(mod, 'vehicle')
+
+
+def start(args):
+    ''' Run a vehicle profile '''
+    vehicle = load_vehicle(args.profile)
+    if vehicle is not None:
+        print('Start', args.profile, 'vehicle.')
+        vehicle.start()
+
+
+def profile_startup(args):
+    ''' Report profile import time per module, node init / start_up time '''
+    from autorc.startup import import_times, node_times
+    module = 'autorc.profiles.' + args.profile
+    times, error = import_times(module)
+    print('Slowest imports of %s (cumulative, self in seconds):' % module)
+    for name, own, cumulative, depth in sorted(
+            times, key=lambda row: -row[2])[:args.top]:
+        print('  %8.3f %8.3f  %s%s' % (cumulative, own, '  ' * depth, name))
+    if error:
+        print('Import failed:', error)
+        return
+    vehicle = load_vehicle(args.profile)
+    if vehicle is None:
+        return
+    print('Node start up (seconds):')
+    print('  %-24s %8s %8s' % ('node', 'init', 'start_up'))
+    for result in node_times(vehicle):
+        print('  %-24s %8s %8s %s' % (result['node'], *(
+            '-' if result[step] is None else '%.3f' % result[step]
+            for step in ('init', 'start_up')), result['error'] or ''))
 
 
 ALLOWED_ACTIONS = {
     'reset-servo': reset_servo,
     'list-profile': list_profile,
+    'profile-startup': profile_startup,
     'start': start
 }
 
@@ -57,9 +91,11 @@ ALLOWED_ACTIONS = {
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Noahcar cli.')
 
+    # Profiles are checked when loaded, list-profile to show them
     parser.add_argument('-p', '--profile', default='default',
-                        choices=get_profiles(), dest='profile',
-                        help='Vehicle profile to load')
+                        dest='profile', help='Vehicle profile to load')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Imports listed by profile-startup')
 
     parser.add_argument('action', help='Action to run', nargs='?')
 